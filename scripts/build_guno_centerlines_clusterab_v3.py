@@ -2,50 +2,18 @@
 # -*- coding: utf-8 -*-
 
 import argparse
-import math
 from pathlib import Path
-from typing import List, Tuple, Optional, Dict
+from typing import List, Tuple, Dict
 
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import LineString, Point
-from shapely.ops import unary_union, linemerge, nearest_points
+from shapely.geometry import LineString
+from shapely.ops import unary_union, linemerge
 
-
-# ---------- CRS helpers ----------
-def is_geographic_crs(gdf: gpd.GeoDataFrame) -> bool:
-    try:
-        return bool(gdf.crs and gdf.crs.is_geographic)
-    except Exception:
-        return False
-
-def estimate_utm_epsg(lon: float, lat: float) -> int:
-    zone = int(math.floor((lon + 180) / 6) + 1)
-    return (32600 + zone) if lat >= 0 else (32700 + zone)
-
-def project_to_metric(gdf: gpd.GeoDataFrame) -> Tuple[gpd.GeoDataFrame, Optional[str]]:
-    if gdf.crs is None:
-        return gdf, None
-    if not is_geographic_crs(gdf):
-        return gdf, str(gdf.crs)
-
-    minx, miny, maxx, maxy = gdf.total_bounds
-    lon = (minx + maxx) / 2.0
-    lat = (miny + maxy) / 2.0
-    epsg = estimate_utm_epsg(lon, lat)
-    out = gdf.to_crs(epsg=epsg)
-    return out, str(out.crs)
+from geodo_geom import explode_lines, project_to_metric, sample_midline
 
 
 # ---------- geometry helpers ----------
-def explode_lines(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
-    g = gdf.explode(index_parts=True, ignore_index=True)
-    g = g[g.geometry.notna() & ~g.geometry.is_empty].copy()
-    g = g[g.geometry.geom_type.isin(["LineString", "MultiLineString"])].copy()
-    g = g.explode(index_parts=True, ignore_index=True)
-    g = g[g.geometry.geom_type == "LineString"].copy()
-    return g
-
 def to_segments(line: LineString) -> List[LineString]:
     coords = list(line.coords)
     if len(coords) < 2:
@@ -130,38 +98,6 @@ def simplify_line(line: LineString, tol_m: float) -> LineString:
         pass
     return line
 
-def orient_same_direction(a: LineString, b: LineString) -> Tuple[LineString, LineString]:
-    a0, a1 = Point(a.coords[0]), Point(a.coords[-1])
-    b0, b1 = Point(b.coords[0]), Point(b.coords[-1])
-
-    d_same = a0.distance(b0) + a1.distance(b1)
-    b_rev = LineString(list(reversed(list(b.coords))))
-    d_rev = a0.distance(Point(b_rev.coords[0])) + a1.distance(Point(b_rev.coords[-1]))
-    return (a, b_rev) if d_rev < d_same else (a, b)
-
-def sample_midline(a: LineString, b: LineString, n: int = 400) -> Optional[LineString]:
-    if a.length == 0 or b.length == 0:
-        return None
-    a, b = orient_same_direction(a, b)
-
-    pts = []
-    for i in range(n + 1):
-        t = i / n
-        pa = a.interpolate(t, normalized=True)
-        pb = nearest_points(pa, b)[1]
-        pts.append(((pa.x + pb.x) / 2.0, (pa.y + pb.y) / 2.0))
-
-    if len(pts) < 2:
-        return None
-
-    cleaned = [pts[0]]
-    for x, y in pts[1:]:
-        px, py = cleaned[-1]
-        if (x - px) ** 2 + (y - py) ** 2 > 0.25:  # >0.5m
-            cleaned.append((x, y))
-
-    return LineString(cleaned) if len(cleaned) >= 2 else None
-
 
 # ---------- per-route ----------
 def process_route(line_fp: Path, simplify_m: float, seg_min_m: float, cluster_iters: int, sample_n: int) -> Dict:
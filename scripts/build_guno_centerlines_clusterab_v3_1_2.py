@@ -4,48 +4,17 @@
 import argparse
 import math
 from pathlib import Path
-from typing import List, Tuple, Optional, Dict
+from typing import List, Tuple, Dict
 
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import LineString, Point
-from shapely.ops import unary_union, linemerge, nearest_points
+from shapely.geometry import LineString
+from shapely.ops import unary_union, linemerge
 
-
-# ---------------- CRS helpers ----------------
-def is_geographic_crs(gdf: gpd.GeoDataFrame) -> bool:
-    try:
-        return bool(gdf.crs and gdf.crs.is_geographic)
-    except Exception:
-        return False
-
-def estimate_utm_epsg(lon: float, lat: float) -> int:
-    zone = int(math.floor((lon + 180) / 6) + 1)
-    return (32600 + zone) if lat >= 0 else (32700 + zone)
-
-def project_to_metric(gdf: gpd.GeoDataFrame) -> Tuple[gpd.GeoDataFrame, Optional[str]]:
-    if gdf.crs is None:
-        return gdf, None
-    if not is_geographic_crs(gdf):
-        return gdf, str(gdf.crs)
-
-    minx, miny, maxx, maxy = gdf.total_bounds
-    lon = (minx + maxx) / 2.0
-    lat = (miny + maxy) / 2.0
-    epsg = estimate_utm_epsg(lon, lat)
-    out = gdf.to_crs(epsg=epsg)
-    return out, str(out.crs)
+from geodo_geom import explode_lines, project_to_metric, sample_midline
 
 
 # ---------------- Geometry helpers ----------------
-def explode_lines(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
-    g = gdf.explode(index_parts=True, ignore_index=True)
-    g = g[g.geometry.notna() & ~g.geometry.is_empty].copy()
-    g = g[g.geometry.geom_type.isin(["LineString", "MultiLineString"])].copy()
-    g = g.explode(index_parts=True, ignore_index=True)
-    g = g[g.geometry.geom_type == "LineString"].copy()
-    return g
-
 def to_segments(line: LineString) -> List[LineString]:
     coords = list(line.coords)
     segs = []
@@ -132,28 +101,6 @@ def simplify_line(line, tol_m):
     except Exception:
         return line
 
-def orient_same_direction(a: LineString, b: LineString):
-    a0, a1 = Point(a.coords[0]), Point(a.coords[-1])
-    b0, b1 = Point(b.coords[0]), Point(b.coords[-1])
-    d_same = a0.distance(b0) + a1.distance(b1)
-    b_rev = LineString(list(reversed(b.coords)))
-    d_rev = a0.distance(Point(b_rev.coords[0])) + a1.distance(Point(b_rev.coords[-1]))
-    return (a, b_rev) if d_rev < d_same else (a, b)
-
-def sample_midline(a: LineString, b: LineString, n: int):
-    if a.length == 0 or b.length == 0:
-        return None
-    a, b = orient_same_direction(a, b)
-    pts = []
-    for i in range(n + 1):
-        t = i / n
-        pa = a.interpolate(t, normalized=True)
-        pb = nearest_points(pa, b)[1]
-        pts.append(((pa.x + pb.x) / 2, (pa.y + pb.y) / 2))
-    if len(pts) < 2:
-        return None
-    return LineString(pts)
-
 def as_lines(g):
     if g is None:
         return []
@@ -203,7 +150,7 @@ def process_route(line_fp: Path, simplify_m, seg_min_m, sample_n):
                 best_b = b
         if best_b is None or best_d > 600:
             continue
-        mid = sample_midline(a, best_b, sample_n)
+        mid = sample_midline(a, best_b, sample_n, dedupe_m=None)
         if mid and mid.length > 200:
             mids.append(mid)
 
@@ -212,7 +159,7 @@ def process_route(line_fp: Path, simplify_m, seg_min_m, sample_n):
         a_long = max(partsA, key=lambda g: g.length, default=None)
         b_long = max(partsB, key=lambda g: g.length, default=None)
         if a_long and b_long:
-            mid = sample_midline(a_long, b_long, sample_n)
+            mid = sample_midline(a_long, b_long, sample_n, dedupe_m=None)
             if mid:
                 mids = [mid]
 
@@ -13,58 +13,27 @@ v3.3 改善点（v3.1.x からの主な変更）
 - seed更新を数回反復（安定化）
 - merge前に自己snap（端点ズレを吸収）して 1本化しやすくする
 - centerlineはA/Bの“主成分（最大連結成分）”で生成（車庫・支線の影響を抑制）
+- --jobs N で路線単位をプロセス並列に処理（出力は各ワーカーが書き込み、summary順は入力順のまま）
 """
 
 import argparse
 import math
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import List, Tuple, Optional, Dict, Any
 
+import numpy as np
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import LineString, MultiLineString, Point
-from shapely.ops import unary_union, linemerge, nearest_points, snap
+import shapely
+from shapely.geometry import LineString, MultiLineString
+from shapely.ops import unary_union, linemerge, snap
 
-
-# ---------------- CRS helpers ----------------
-def is_geographic_crs(gdf: gpd.GeoDataFrame) -> bool:
-    try:
-        return bool(gdf.crs and gdf.crs.is_geographic)
-    except Exception:
-        return False
-
-
-def estimate_utm_epsg(lon: float, lat: float) -> int:
-    zone = int(math.floor((lon + 180) / 6) + 1)
-    return (32600 + zone) if lat >= 0 else (32700 + zone)
-
-
-def project_to_metric(gdf: gpd.GeoDataFrame) -> Tuple[gpd.GeoDataFrame, Optional[str]]:
-    """EPSG:4326 など地理座標なら、路線中心付近のUTMへ投影してメートル系へ。"""
-    if gdf.crs is None:
-        return gdf, None
-    if not is_geographic_crs(gdf):
-        return gdf, str(gdf.crs)
-
-    minx, miny, maxx, maxy = gdf.total_bounds
-    lon = (minx + maxx) / 2.0
-    lat = (miny + maxy) / 2.0
-    epsg = estimate_utm_epsg(lon, lat)
-    out = gdf.to_crs(epsg=epsg)
-    return out, str(out.crs)
+from geodo_geom import WGS84_EPSG, RouteGeometry, sample_midline
 
 
 # ---------------- Geometry helpers ----------------
-def explode_lines(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
-    """MultiLineString混在を LineString のみの行へ展開。"""
-    g = gdf.explode(index_parts=True, ignore_index=True)
-    g = g[g.geometry.notna() & ~g.geometry.is_empty].copy()
-    g = g[g.geometry.geom_type.isin(["LineString", "MultiLineString"])].copy()
-    g = g.explode(index_parts=True, ignore_index=True)
-    g = g[g.geometry.geom_type == "LineString"].copy()
-    return g
-
-
 def to_segments(line: LineString) -> List[LineString]:
     coords = list(line.coords)
     if len(coords) < 2:
@@ -88,16 +57,6 @@ def lines_to_segments(lines: List[LineString], min_seg_len_m: float) -> List[Lin
     return segs
 
 
-def seg_angle_rad(seg: LineString) -> float:
-    (x1, y1), (x2, y2) = list(seg.coords)
-    return math.atan2(y2 - y1, x2 - x1)
-
-
-def angle_diff(a: float, b: float) -> float:
-    d = abs(a - b) % (2 * math.pi)
-    return min(d, 2 * math.pi - d)
-
-
 def pick_two_seeds_parallel(
     segs: List[LineString],
     min_d: float,
@@ -108,6 +67,9 @@ def pick_two_seeds_parallel(
     """
     近傍で並行な2線分をseedにする（上下複線を拾いやすい）。
     見つからなければフォールバック（遠い2本）。
+
+    候補は STRtree の max_d 窓検索で絞り、距離・角度の判定は NumPy で一括。
+    同距離なら segs 順で先の線分（従来の全件走査と同じ結果）。
     """
     if not segs:
         return LineString(), LineString()
@@ -115,24 +77,27 @@ def pick_two_seeds_parallel(
     candA = sorted(segs, key=lambda g: g.length, reverse=True)[: min(topN, len(segs))]
     max_angle = math.radians(max_angle_deg)
 
+    arr = np.asarray(segs, dtype=object)
+    tree = shapely.STRtree(arr)
+    xy = shapely.get_coordinates(arr).reshape(-1, 2, 2)
+    angles = np.arctan2(xy[:, 1, 1] - xy[:, 0, 1], xy[:, 1, 0] - xy[:, 0, 0])
+    pos = {id(g): i for i, g in enumerate(segs)}
+    # 窓は少し広めに取り、境界は正確な distance で判定する
+    window = max_d + 1e-9 * max(1.0, abs(max_d))
+
     for seedA in candA:
-        a_ang = seg_angle_rad(seedA)
-        best = None
-        best_d = 1e18
-        for s in segs:
-            if s is seedA:
-                continue
-            d = seedA.distance(s)
-            if d < min_d or d > max_d:
-                continue
-            if angle_diff(a_ang, seg_angle_rad(s)) > max_angle:
-                continue
+        idx = np.sort(tree.query(seedA, predicate="dwithin", distance=window))
+        idx = idx[idx != pos[id(seedA)]]
+        if idx.size == 0:
+            continue
+        d = shapely.distance(seedA, arr[idx])
+        da = np.abs(angles[pos[id(seedA)]] - angles[idx]) % (2 * math.pi)
+        da = np.minimum(da, 2 * math.pi - da)
+        ok = (d >= min_d) & (d <= max_d) & (da <= max_angle)
+        if ok.any():
             # 近いほど良い
-            if d < best_d:
-                best_d = d
-                best = s
-        if best is not None:
-            return seedA, best
+            k = np.flatnonzero(ok)
+            return seedA, segs[idx[k[np.argmin(d[k])]]]
 
     # fallback: farthest pair among long segments
     cand = candA
@@ -148,15 +113,78 @@ def pick_two_seeds_parallel(
     return best if best else (segs[0], segs[0])
 
 
-def assign_by_distance(segs: List[LineString], seedA, seedB) -> Tuple[List[LineString], List[LineString]]:
-    """線分を seedA/seedB のどちらに近いかで割当。距離は線→線の最短距離。"""
-    A: List[LineString] = []
-    B: List[LineString] = []
-    for s in segs:
-        dA = s.distance(seedA)
-        dB = s.distance(seedB)
-        (A if dA <= dB else B).append(s)
-    return A, B
+def seed_pieces(seed) -> Tuple[List[tuple], Optional[np.ndarray]]:
+    """seed を2点線分に分解。(向き付き端点座標キーのリスト, 線分配列)。線以外のseedは (None)。"""
+    if seed is None or seed.geom_type not in ("LineString", "MultiLineString"):
+        return [], None
+    coords = [np.asarray(p.coords)[:, :2] for p in as_lines(seed) if len(p.coords) >= 2]
+    if not coords:
+        return [], np.empty(0, dtype=object)
+    ends = np.concatenate([np.stack([c[:-1], c[1:]], axis=1) for c in coords])
+    keys = [tuple(k) for k in ends.reshape(-1, 4).tolist()]
+    return keys, shapely.linestrings(ends)
+
+
+class SeedDistanceCache:
+    """
+    各線分から1つのseedまでの最短距離を保持し、seedの作り直しに合わせて差分更新する。
+
+    seed→線分の距離は seed の構成2点線分（piece）への距離の最小値。
+    - 最寄りpieceが新seedにも残っている線分: 距離は「旧距離」と「新規pieceへの距離」の小さい方
+    - 最寄りpieceが消えた線分だけ、新seed全体に対して再検索
+    どちらも厳密値なので、毎回全件計算した結果と同じになる。
+    """
+
+    def __init__(self, geoms: np.ndarray):
+        self.geoms = geoms
+        self.keys: Optional[set] = None
+        self.dist = np.full(len(geoms), np.nan)
+        self.near: List[Optional[tuple]] = [None] * len(geoms)
+        self.requeried = 0
+
+    def _query(self, mask: np.ndarray, keys: List[tuple], pieces: np.ndarray):
+        idx = np.flatnonzero(mask)
+        if idx.size == 0 or len(pieces) == 0:
+            return idx[:0], idx[:0], np.empty(0)
+        (src, hit), d = shapely.STRtree(pieces).query_nearest(
+            self.geoms[idx], return_distance=True, all_matches=False)
+        return idx[src], hit, d
+
+    def update(self, seed) -> np.ndarray:
+        keys, pieces = seed_pieces(seed)
+        if pieces is None:
+            self.keys = None
+            self.near = [None] * len(self.geoms)
+            self.dist = shapely.distance(self.geoms, seed)
+            self.requeried += len(self.geoms)
+            return self.dist
+
+        new_keys = set(keys)
+        if self.keys is None:
+            lost = np.ones(len(self.geoms), dtype=bool)
+        else:
+            lost = np.fromiter((k not in new_keys for k in self.near), dtype=bool, count=len(self.near))
+        self.dist = self.dist.copy()
+        self.dist[lost] = np.nan
+        for i in np.flatnonzero(lost):
+            self.near[i] = None
+
+        seg, hit, d = self._query(lost, keys, pieces)
+        self.dist[seg] = d
+        for i, h in zip(seg.tolist(), hit.tolist()):
+            self.near[i] = keys[h]
+        self.requeried += int(lost.sum())
+
+        if self.keys is not None:
+            added = [i for i, k in enumerate(keys) if k not in self.keys]
+            if added:
+                seg, hit, d = self._query(~lost, keys, pieces[added])
+                better = d < self.dist[seg]
+                self.dist[seg[better]] = d[better]
+                for i, h in zip(seg[better].tolist(), hit[better].tolist()):
+                    self.near[i] = keys[added[h]]
+        self.keys = new_keys
+        return self.dist
 
 
 def snap_and_merge(geoms: List[LineString], snap_tol_m: float):
@@ -206,46 +234,6 @@ def keep_main_component(g):
     return g
 
 
-def orient_same_direction(a: LineString, b: LineString) -> Tuple[LineString, LineString]:
-    a0, a1 = Point(a.coords[0]), Point(a.coords[-1])
-    b0, b1 = Point(b.coords[0]), Point(b.coords[-1])
-    d_same = a0.distance(b0) + a1.distance(b1)
-    b_rev = LineString(list(reversed(list(b.coords))))
-    d_rev = a0.distance(Point(b_rev.coords[0])) + a1.distance(Point(b_rev.coords[-1]))
-    return (a, b_rev) if d_rev < d_same else (a, b)
-
-
-def sample_midline(a: LineString, b: LineString, n: int, dedupe_m: float = 0.5) -> Optional[LineString]:
-    """a上を均等サンプル→bへ最近接→中点列をLineString化。"""
-    if a is None or b is None:
-        return None
-    if a.length == 0 or b.length == 0:
-        return None
-    a, b = orient_same_direction(a, b)
-
-    pts: List[Tuple[float, float]] = []
-    for i in range(n + 1):
-        t = i / n
-        pa = a.interpolate(t, normalized=True)
-        pb = nearest_points(pa, b)[1]
-        pts.append(((pa.x + pb.x) / 2.0, (pa.y + pb.y) / 2.0))
-
-    if len(pts) < 2:
-        return None
-
-    # remove near-duplicates
-    cleaned = [pts[0]]
-    thr2 = dedupe_m * dedupe_m
-    for x, y in pts[1:]:
-        px, py = cleaned[-1]
-        if (x - px) ** 2 + (y - py) ** 2 > thr2:
-            cleaned.append((x, y))
-
-    if len(cleaned) < 2:
-        return None
-    return LineString(cleaned)
-
-
 # ---------------- Per-route processing ----------------
 def process_route(
     line_fp: Path,
@@ -258,23 +246,22 @@ def process_route(
     seed_max_angle_deg: float,
     snap_tol_m: float,
     center_match_max_d: float,
+    converge_frac: float = 0.0,
+    rg: Optional[RouteGeometry] = None,
 ) -> Dict[str, Any]:
     route = line_fp.stem
 
-    gdf = gpd.read_file(line_fp)
-    if gdf.crs is None:
-        gdf = gdf.set_crs(epsg=4326)
-
-    gdf = explode_lines(gdf)
-    if len(gdf) == 0:
+    # 読み込み・LineString展開・UTM投影は RouteGeometry で1回だけ（パイプラインからは読み込み済みを受け取る）
+    if rg is None:
+        rg = RouteGeometry.read(line_fp)
+    if len(rg) == 0:
         return {"route": route, "file": str(line_fp), "status": "NO_LINES"}
 
-    gdf_m, metric_crs = project_to_metric(gdf)
+    metric_crs = rg.metric_crs
     if metric_crs is None:
         return {"route": route, "file": str(line_fp), "status": "NO_CRS"}
 
-    lines = list(gdf_m.geometry)
-    segs = lines_to_segments(lines, min_seg_len_m=seg_min_m)
+    segs = lines_to_segments(rg.metric_lines, min_seg_len_m=seg_min_m)
     if len(segs) < 50:
         return {"route": route, "file": str(line_fp), "status": "NOT_ENOUGH_SEGS", "segs": len(segs)}
 
@@ -285,17 +272,57 @@ def process_route(
         max_angle_deg=seed_max_angle_deg,
     )
 
-    # iterate seed refinement
+    # iterate seed refinement (assign / merge time per iteration, ms)
+    # 所属が変わらなくなったら（変化数 <= converge_frac * 線分数）打ち切る。
+    # 変化0なら次のmergeは同じseedを作るので、最後まで回した結果と同じ。
+    t_cluster = time.perf_counter()
+    arr = np.asarray(segs, dtype=object)
+    cacheA = SeedDistanceCache(arr)
+    cacheB = SeedDistanceCache(arr)
+    assign_ms: List[float] = []
+    merge_ms: List[float] = []
+    deltas: List[int] = []
+    prev = None
+    iters_used = 0
+    need_final = True
+
+    def assign():
+        t0 = time.perf_counter()
+        to_a = cacheA.update(seedA) <= cacheB.update(seedB)
+        assign_ms.append((time.perf_counter() - t0) * 1000.0)
+        return to_a
+
     for _ in range(max(1, cluster_iters)):
-        A, B = assign_by_distance(segs, seedA, seedB)
-        if not A or not B:
+        to_a = assign()
+        iters_used += 1
+        if not to_a.any() or to_a.all():
+            need_final = False
             break
-        seedA = merge_seed(A, snap_tol_m=snap_tol_m)
-        seedB = merge_seed(B, snap_tol_m=snap_tol_m)
-
-    A, B = assign_by_distance(segs, seedA, seedB)
+        if prev is not None:
+            deltas.append(int((to_a != prev).sum()))
+            if deltas[-1] <= converge_frac * len(segs):
+                need_final = False
+                break
+        prev = to_a
+        t0 = time.perf_counter()
+        seedA = merge_seed([s for s, a in zip(segs, to_a) if a], snap_tol_m=snap_tol_m)
+        seedB = merge_seed([s for s, a in zip(segs, to_a) if not a], snap_tol_m=snap_tol_m)
+        merge_ms.append((time.perf_counter() - t0) * 1000.0)
+
+    if need_final:
+        to_a = assign()
+    A = [s for s, a in zip(segs, to_a) if a]
+    B = [s for s, a in zip(segs, to_a) if not a]
+    timing = {
+        "cluster_iters_used": iters_used,
+        "cluster_ms": round((time.perf_counter() - t_cluster) * 1000.0, 1),
+        "membership_delta": ";".join(str(d) for d in deltas),
+        "requeried": cacheA.requeried + cacheB.requeried,
+        "assign_ms": ";".join(f"{t:.1f}" for t in assign_ms),
+        "merge_ms": ";".join(f"{t:.1f}" for t in merge_ms),
+    }
     if not A or not B:
-        return {"route": route, "file": str(line_fp), "status": "CLUSTER_EMPTY", "segs": len(segs)}
+        return {"route": route, "file": str(line_fp), "status": "CLUSTER_EMPTY", "segs": len(segs), **timing}
 
     oneA = merge_seed(A, snap_tol_m=snap_tol_m)
     oneB = merge_seed(B, snap_tol_m=snap_tol_m)
@@ -316,6 +343,7 @@ def process_route(
             "lenA_m": float(getattr(mainA, "length", 0.0)),
             "lenB_m": float(getattr(mainB, "length", 0.0)),
             "segs": len(segs),
+            **timing,
         }
 
     # Build centerline (single) between mainA and mainB; if too far, fallback to part-matching
@@ -350,15 +378,17 @@ def process_route(
             "segs": len(segs),
             "lenA_m": float(oneA_s.length) if hasattr(oneA_s, "length") else 0.0,
             "lenB_m": float(oneB_s.length) if hasattr(oneB_s, "length") else 0.0,
+            **timing,
         }
 
     mid_all = linemerge(unary_union(mids))
     mid_all = simplify_geom(mid_all, simplify_m)
 
-    # outputs back to EPSG:4326
-    outA = gpd.GeoDataFrame([{"route": route, "cluster": "A", "geometry": oneA_s}], crs=gdf_m.crs).to_crs(epsg=4326)
-    outB = gpd.GeoDataFrame([{"route": route, "cluster": "B", "geometry": oneB_s}], crs=gdf_m.crs).to_crs(epsg=4326)
-    outC = gpd.GeoDataFrame([{"route": route, "derived": "guno_centerline", "geometry": mid_all}], crs=gdf_m.crs).to_crs(epsg=4326)
+    # outputs back to EPSG:4326（3ジオメトリをキャッシュ済みTransformerで一括変換）
+    geoA, geoB, geoC = rg.to_wgs84([oneA_s, oneB_s, mid_all])
+    outA = gpd.GeoDataFrame([{"route": route, "cluster": "A", "geometry": geoA}], crs=WGS84_EPSG)
+    outB = gpd.GeoDataFrame([{"route": route, "cluster": "B", "geometry": geoB}], crs=WGS84_EPSG)
+    outC = gpd.GeoDataFrame([{"route": route, "derived": "guno_centerline", "geometry": geoC}], crs=WGS84_EPSG)
 
     # metrics
     numA = 1 if outA.geometry.iloc[0].geom_type == "LineString" else (len(list(outA.geometry.iloc[0].geoms)) if outA.geometry.iloc[0].geom_type == "MultiLineString" else 0)
@@ -375,12 +405,28 @@ def process_route(
         "mid_length_m": float(mid_all.length),
         "partsA": int(numA),
         "partsB": int(numB),
+        **timing,
         "outA": outA,
         "outB": outB,
         "outC": outC,
     }
 
 
+def run_route(fp: Path, out_onelines: Path, out_center: Path, params: Dict[str, Any]) -> Dict[str, Any]:
+    """1路線を処理して出力を書き、summary行を返す（ワーカープロセスからも呼ばれる）。"""
+    try:
+        r = process_route(fp, **params)
+    except Exception as e:
+        return {"route": fp.stem, "file": str(fp), "status": f"ERROR: {type(e).__name__}: {e}"}
+
+    if r.get("status") == "OK":
+        r["outA"].to_file(out_onelines / f"{fp.stem}_A_oneline.geojson", driver="GeoJSON")
+        r["outB"].to_file(out_onelines / f"{fp.stem}_B_oneline.geojson", driver="GeoJSON")
+        r["outC"].to_file(out_center / f"{fp.stem}_centerline.geojson", driver="GeoJSON")
+
+    return {k: v for k, v in r.items() if k not in ("outA", "outB", "outC")}
+
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--lines-dir", required=True, help="input lines dir (2-track mixed)")
@@ -390,6 +436,8 @@ def main():
     ap.add_argument("--simplify-m", type=float, default=6.0)
     ap.add_argument("--seg-min-m", type=float, default=12.0)
     ap.add_argument("--cluster-iters", type=int, default=5)
+    ap.add_argument("--converge-frac", type=float, default=0.0,
+                    help="stop refinement when the fraction of segments changing A/B is <= this (0 = exact fixpoint)")
     ap.add_argument("--sample-n", type=int, default=500)
 
     # seed pick tuning
@@ -403,6 +451,9 @@ def main():
     # centerline matching
     ap.add_argument("--center-match-max-d", type=float, default=600.0, help="max A-B distance to pair for centerline (m)")
 
+    # parallel
+    ap.add_argument("--jobs", type=int, default=1, help="worker processes (1 = serial)")
+
     args = ap.parse_args()
 
     lines_dir = Path(args.lines_dir)
@@ -412,32 +463,33 @@ def main():
     out_onelines.mkdir(parents=True, exist_ok=True)
     out_center.mkdir(parents=True, exist_ok=True)
 
+    params = dict(
+        simplify_m=args.simplify_m,
+        seg_min_m=args.seg_min_m,
+        cluster_iters=args.cluster_iters,
+        converge_frac=args.converge_frac,
+        sample_n=args.sample_n,
+        seed_min_d=args.seed_min_d,
+        seed_max_d=args.seed_max_d,
+        seed_max_angle_deg=args.seed_max_angle_deg,
+        snap_tol_m=args.snap_tol_m,
+        center_match_max_d=args.center_match_max_d,
+    )
+    files = sorted(lines_dir.glob(args.pattern))
     rows: List[Dict[str, Any]] = []
 
-    for fp in sorted(lines_dir.glob(args.pattern)):
-        try:
-            r = process_route(
-                fp,
-                simplify_m=args.simplify_m,
-                seg_min_m=args.seg_min_m,
-                cluster_iters=args.cluster_iters,
-                sample_n=args.sample_n,
-                seed_min_d=args.seed_min_d,
-                seed_max_d=args.seed_max_d,
-                seed_max_angle_deg=args.seed_max_angle_deg,
-                snap_tol_m=args.snap_tol_m,
-                center_match_max_d=args.center_match_max_d,
-            )
-        except Exception as e:
-            rows.append({"route": fp.stem, "file": str(fp), "status": f"ERROR: {type(e).__name__}: {e}"})
-            continue
-
-        if r.get("status") == "OK":
-            r["outA"].to_file(out_onelines / f"{fp.stem}_A_oneline.geojson", driver="GeoJSON")
-            r["outB"].to_file(out_onelines / f"{fp.stem}_B_oneline.geojson", driver="GeoJSON")
-            r["outC"].to_file(out_center / f"{fp.stem}_centerline.geojson", driver="GeoJSON")
-
-        rows.append({k: v for k, v in r.items() if k not in ("outA", "outB", "outC")})
+    if args.jobs <= 1:
+        for fp in files:
+            rows.append(run_route(fp, out_onelines, out_center, params))
+    else:
+        # ワーカーにはファイルパスだけ渡す。summaryは入力（ソート済み）順で集める
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            futures = [pool.submit(run_route, fp, out_onelines, out_center, params) for fp in files]
+            for fp, fut in zip(files, futures):
+                try:
+                    rows.append(fut.result())
+                except Exception as e:  # ワーカー異常終了など
+                    rows.append({"route": fp.stem, "file": str(fp), "status": f"ERROR: {type(e).__name__}: {e}"})
 
     df = pd.DataFrame(rows)
     df.to_csv(out_dir / "_summary_clusterab.csv", index=False, encoding="utf-8-sig")
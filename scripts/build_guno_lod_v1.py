@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+build_guno_lod_v1.py — 路線ラインの LOD（詳細度）ピラミッドを作る
+
+guno_lines_view/*_guno_line_smooth.geojson や lines/*.geojson は全ズームで同じ
+フル解像度の GeoJSON を読んでいる。ここでは路線ごとに simplify_deg の異なる
+複数レベルを smooth_guno_lines_v1.smooth_geometry で作り（ライン以外のジオメトリは
+simplify のみ）、manifest.json にまとめる。地図側はまず粗いレベルを読み、ズームインしたときだけ細かいレベルを取りに行ける。
+
+出力（--out-dir 以下）:
+  lod<k>/<入力ファイル名>   レベル k（0 が最も粗い）。座標桁数もレベルの許容誤差に合わせて丸める
+  manifest.json            レベル一覧（simplify_deg / 座標桁数 / 推奨ズーム範囲）と
+                           路線ごとのファイル・バイト数・頂点数・bbox。
+                           最後のレベルは元ファイルそのもの（source: true、コピーはしない）
+  _summary_lod.csv         路線×レベルのサイズと、元ファイルに対する比率
+
+パスは manifest.json からの相対パス（/ 区切り）。
+"""
+
+import argparse
+import json
+import math
+import os
+from pathlib import Path
+from typing import Any, Dict, List
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from smooth_guno_lines_v1 import smooth_geometry
+
+MANIFEST_VERSION = 1
+
+# ルート名はファイル名からこれらの接尾辞を除いたもの（lines/ はファイル名そのまま）
+ROUTE_SUFFIXES = ("_guno_line_smooth", "_guno_line", "_centerline")
+
+# Web メルカトルの赤道上ピクセルサイズ（ズーム0, 256px タイル）と緯度1度の長さ
+MERCATOR_M_PER_PX_Z0 = 156543.03392
+DEG_LAT_M = 111320.0
+
+
+def route_name(fp: Path) -> str:
+    stem = fp.stem
+    for suf in ROUTE_SUFFIXES:
+        if stem.endswith(suf):
+            return stem[: -len(suf)]
+    return stem
+
+
+def parse_levels(s: str) -> List[float]:
+    """'2e-4,5e-5' -> 粗い順に並べた simplify_deg のリスト"""
+    levels = sorted({float(v) for v in s.split(",") if v.strip()}, reverse=True)
+    if not levels or any(v <= 0 for v in levels):
+        raise ValueError(f"levels must be positive simplify_deg values: {s!r}")
+    return levels
+
+
+def coord_precision(simplify_deg: float) -> int:
+    """許容誤差より1桁細かい小数桁数（5〜7桁 = 約1m〜1cm）"""
+    return int(min(7, max(5, math.ceil(-math.log10(simplify_deg)) + 1)))
+
+
+def max_zoom_for(simplify_deg: float, lat: float) -> int:
+    """許容誤差が1ピクセル以下に収まる最大ズーム（緯度 lat 付近）"""
+    tol_m = simplify_deg * DEG_LAT_M
+    m_per_px_z0 = MERCATOR_M_PER_PX_Z0 * math.cos(math.radians(lat))
+    return max(0, int(math.floor(math.log2(m_per_px_z0 / tol_m))))
+
+
+def lod_geometry(geom, simplify_deg: float, iterations: int, min_seg_deg: float):
+    """ライン系は smooth_geometry、それ以外（lines/ の GeometryCollection / Polygon など）は simplify だけ。"""
+    if geom is None or geom.is_empty:
+        return geom
+    if geom.geom_type in ("LineString", "MultiLineString"):
+        return smooth_geometry(geom, iterations, simplify_deg, min_seg_deg)
+    return shapely.simplify(geom, simplify_deg, preserve_topology=True)
+
+
+def count_vertices(geoms) -> int:
+    return int(shapely.get_num_coordinates(np.asarray(geoms, dtype=object)).sum())
+
+
+def rel_path(fp: Path, root: Path) -> str:
+    return Path(os.path.relpath(fp, root)).as_posix()
+
+
+def build_route(fp: Path, out_dir: Path, levels: List[float], iterations: int,
+                min_seg_deg: float) -> Dict[str, Any]:
+    """1路線ぶん全レベルを書き、manifest 用の dict を返す。"""
+    gdf = gpd.read_file(fp)
+    if len(gdf) == 0:
+        return {"status": "EMPTY"}
+    if gdf.crs is None:
+        gdf = gdf.set_crs(epsg=4326)
+
+    entry: Dict[str, Any] = {
+        "source": rel_path(fp, out_dir),
+        "bytes": fp.stat().st_size,
+        "vertices": count_vertices(gdf.geometry.values),
+        "bbox": [round(float(v), 6) for v in gdf.total_bounds],
+        "levels": [],
+    }
+    for k, tol in enumerate(levels):
+        out = gdf.copy()
+        out["geometry"] = out["geometry"].apply(lambda g: lod_geometry(g, tol, iterations, min_seg_deg))
+        d = out_dir / f"lod{k}"
+        d.mkdir(parents=True, exist_ok=True)
+        out_fp = d / fp.name
+        out.to_file(out_fp, driver="GeoJSON", COORDINATE_PRECISION=coord_precision(tol), WRITE_NAME="NO")
+        entry["levels"].append({
+            "file": rel_path(out_fp, out_dir),
+            "bytes": out_fp.stat().st_size,
+            "vertices": count_vertices(out.geometry.values),
+        })
+    entry["status"] = "OK"
+    return entry
+
+
+def level_table(levels: List[float], lat: float) -> List[Dict[str, Any]]:
+    """manifest のレベル一覧。レベル k は前のレベルの max_zoom + 1 から自分の max_zoom まで。"""
+    table = []
+    min_zoom = 0
+    for k, tol in enumerate(levels):
+        zmax = max(min_zoom, max_zoom_for(tol, lat))
+        table.append({"level": k, "simplify_deg": tol, "precision": coord_precision(tol),
+                      "min_zoom": min_zoom, "max_zoom": zmax})
+        min_zoom = zmax + 1
+    table.append({"level": len(levels), "simplify_deg": None, "precision": None,
+                  "min_zoom": min_zoom, "max_zoom": None, "source": True})
+    return table
+
+
+def summary_rows(route: str, entry: Dict[str, Any], levels: List[float]) -> List[Dict[str, Any]]:
+    rows = []
+    for k, lv in enumerate(entry["levels"]):
+        rows.append({
+            "route": route,
+            "level": k,
+            "simplify_deg": levels[k],
+            "bytes": lv["bytes"],
+            "source_bytes": entry["bytes"],
+            "bytes_ratio": round(lv["bytes"] / entry["bytes"], 4) if entry["bytes"] else None,
+            "vertices": lv["vertices"],
+            "source_vertices": entry["vertices"],
+            "file": lv["file"],
+        })
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Build LOD levels (simplify_deg per level) + manifest for GUNO line layers.")
+    ap.add_argument("--in-dir", required=True, help="Input dir (e.g. assets/geojson/guno_lines_view or assets/geojson/lines)")
+    ap.add_argument("--out-dir", required=True, help="Output dir (lod<k>/ + manifest.json)")
+    ap.add_argument("--pattern", default="*.geojson", help="Glob pattern")
+    ap.add_argument("--levels", default="2e-4,5e-5",
+                    help="Comma separated simplify_deg per level, coarse first (the source file is the finest level)")
+    ap.add_argument("--iterations", type=int, default=0,
+                    help="Chaikin iterations per level (0: inputs are already smoothed / raw tracks)")
+    ap.add_argument("--min-seg-deg", type=float, default=2e-6, help="Remove tiny segments threshold in degrees")
+    args = ap.parse_args()
+
+    try:
+        levels = parse_levels(args.levels)
+    except ValueError as e:
+        ap.error(str(e))
+
+    in_dir = Path(args.in_dir)
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    routes: Dict[str, Dict[str, Any]] = {}
+    rows: List[Dict[str, Any]] = []
+    lats: List[float] = []
+    for fp in sorted(in_dir.glob(args.pattern)):
+        route = route_name(fp)
+        try:
+            entry = build_route(fp, out_dir, levels, args.iterations, args.min_seg_deg)
+        except Exception as e:
+            rows.append({"route": route, "status": f"ERROR: {type(e).__name__}: {e}", "file": str(fp)})
+            continue
+        if entry.pop("status") != "OK":
+            rows.append({"route": route, "status": "EMPTY", "file": str(fp)})
+            continue
+        routes[route] = entry
+        lats.append((entry["bbox"][1] + entry["bbox"][3]) / 2.0)
+        rows.extend(dict(r, status="OK") for r in summary_rows(route, entry, levels))
+
+    lat = float(np.mean(lats)) if lats else 0.0
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "levels": level_table(levels, lat),
+        "routes": routes,
+    }
+    with open(out_dir / "manifest.json", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    summary = pd.DataFrame(rows)
+    summary.to_csv(out_dir / "_summary_lod.csv", index=False, encoding="utf-8-sig")
+
+    # レベルごとの合計サイズ（元ファイル比）
+    ok = summary[summary["status"] == "OK"] if len(summary) else summary
+    if len(ok):
+        src_total = sum(e["bytes"] for e in routes.values())
+        for lv in manifest["levels"][:-1]:
+            part = ok[ok["level"] == lv["level"]]
+            print(f"[LOD{lv['level']}] simplify_deg={lv['simplify_deg']:g}  zoom {lv['min_zoom']}-{lv['max_zoom']}  "
+                  f"{int(part['bytes'].sum()):,} bytes ({part['bytes'].sum() / src_total:.1%} of source)  "
+                  f"{int(part['vertices'].sum()):,} vertices")
+        print(f"[SOURCE] zoom {manifest['levels'][-1]['min_zoom']}+  {src_total:,} bytes")
+    print("[OK] manifest:", out_dir / "manifest.json")
+    print("[OK] summary:", out_dir / "_summary_lod.csv")
+
+
+if __name__ == "__main__":
+    main()
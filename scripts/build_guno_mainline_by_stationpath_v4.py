@@ -2,110 +2,22 @@
 # -*- coding: utf-8 -*-
 
 import argparse
-import math
 from pathlib import Path
-from typing import Dict, List, Tuple, Optional
+from typing import Optional
 
 import geopandas as gpd
-from shapely.geometry import LineString, Point
+import pandas as pd
+from shapely.geometry import LineString
 from shapely.ops import unary_union, linemerge, snap
 
-# networkx が無ければ: pip install networkx
-import networkx as nx
-
-
-def is_geographic(gdf: gpd.GeoDataFrame) -> bool:
-    return bool(gdf.crs and getattr(gdf.crs, "is_geographic", False))
-
-
-def estimate_utm_epsg(lon: float, lat: float) -> int:
-    zone = int(math.floor((lon + 180) / 6) + 1)
-    return (32600 + zone) if lat >= 0 else (32700 + zone)
-
-
-def to_metric(gdf: gpd.GeoDataFrame) -> Tuple[gpd.GeoDataFrame, str]:
-    if gdf.crs is None:
-        gdf = gdf.set_crs(epsg=4326)
-    if not is_geographic(gdf):
-        return gdf, str(gdf.crs)
-
-    minx, miny, maxx, maxy = gdf.total_bounds
-    lon = (minx + maxx) / 2.0
-    lat = (miny + maxy) / 2.0
-    epsg = estimate_utm_epsg(lon, lat)
-    out = gdf.to_crs(epsg=epsg)
-    return out, str(out.crs)
-
-
-def explode_lines(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
-    g = gdf.explode(index_parts=True, ignore_index=True)
-    g = g[g.geometry.notna() & ~g.geometry.is_empty].copy()
-    g = g[g.geometry.geom_type.isin(["LineString", "MultiLineString"])].copy()
-    g = g.explode(index_parts=True, ignore_index=True)
-    g = g[g.geometry.geom_type == "LineString"].copy()
-    return g
-
-
-def densify_to_edges(line: LineString) -> List[Tuple[Tuple[float, float], Tuple[float, float], float]]:
-    coords = list(line.coords)
-    edges = []
-    for i in range(len(coords) - 1):
-        a = coords[i]
-        b = coords[i + 1]
-        seg = LineString([a, b])
-        edges.append((a, b, seg.length))
-    return edges
-
-
-def round_node(x: float, y: float, grid: float) -> Tuple[int, int]:
-    # meters space: grid=1.0 -> 1m quantize
-    return (int(round(x / grid)), int(round(y / grid)))
-
-
-def build_graph(lines_m: gpd.GeoDataFrame, node_grid_m: float) -> nx.Graph:
-    G = nx.Graph()
-    for geom in lines_m.geometry:
-        for (ax, ay), (bx, by), w in densify_to_edges(geom):
-            na = round_node(ax, ay, node_grid_m)
-            nb = round_node(bx, by, node_grid_m)
-            if na == nb:
-                continue
-            # keep shortest if duplicate
-            if G.has_edge(na, nb):
-                if w < G[na][nb]["weight"]:
-                    G[na][nb]["weight"] = w
-                    G[na][nb]["a"] = (ax, ay)
-                    G[na][nb]["b"] = (bx, by)
-            else:
-                G.add_edge(na, nb, weight=w, a=(ax, ay), b=(bx, by))
-    return G
-
-
-def nearest_graph_node(G: nx.Graph, pt: Point, node_grid_m: float, search_radius_cells: int = 50) -> Tuple[int, int]:
-    # brute-force around quantized cell
-    cx, cy = round_node(pt.x, pt.y, node_grid_m)
-    best = None
-    best_d2 = float("inf")
-
-    # try expanding square search (fast enough for metro scale)
-    for r in range(1, search_radius_cells + 1):
-        for dx in range(-r, r + 1):
-            for dy in range(-r, r + 1):
-                n = (cx + dx, cy + dy)
-                if n not in G:
-                    continue
-                x = n[0] * node_grid_m
-                y = n[1] * node_grid_m
-                d2 = (x - pt.x) ** 2 + (y - pt.y) ** 2
-                if d2 < best_d2:
-                    best_d2 = d2
-                    best = n
-        if best is not None and best_d2 <= (node_grid_m * r) ** 2:
-            break
-
-    if best is None:
-        raise RuntimeError("No nearby graph node found for station point")
-    return best
+from geodo_geom import explode_lines, to_metric
+from station_order import order_stations
+from track_graph import TrackGraph
+
+
+def build_graph(lines_m: gpd.GeoDataFrame, node_grid_m: float) -> TrackGraph:
+    # CSR（int32ノードID・float32重み）。重複エッジは最短を残す
+    return TrackGraph.from_lines(lines_m.geometry, node_grid_m)
 
 
 def guess_order_field(st_gdf: gpd.GeoDataFrame) -> Optional[str]:
@@ -117,33 +29,12 @@ def guess_order_field(st_gdf: gpd.GeoDataFrame) -> Optional[str]:
     return None
 
 
-def greedy_station_order(points: List[Point]) -> List[int]:
-    # fallback: nearest-neighbor ordering starting from leftmost
-    n = len(points)
-    if n == 0:
-        return []
-    start = min(range(n), key=lambda i: (points[i].x, points[i].y))
-    used = {start}
-    order = [start]
-    while len(order) < n:
-        last = order[-1]
-        best = None
-        best_d2 = float("inf")
-        for i in range(n):
-            if i in used:
-                continue
-            d2 = points[last].distance(points[i]) ** 2
-            if d2 < best_d2:
-                best_d2 = d2
-                best = i
-        used.add(best)
-        order.append(best)
-    return order
-
-
-def path_edges_to_linestring(path_nodes: List[Tuple[int, int]], node_grid_m: float) -> LineString:
-    coords = [(n[0] * node_grid_m, n[1] * node_grid_m) for n in path_nodes]
-    return LineString(coords)
+def guess_is_loop(st_gdf: gpd.GeoDataFrame) -> bool:
+    # stations carrying the line master's is_loop flag
+    if "is_loop" not in st_gdf.columns:
+        return False
+    v = st_gdf["is_loop"].dropna()
+    return bool(len(v)) and str(v.iloc[0]).strip().lower() in ("1", "true", "yes")
 
 
 def main():
@@ -155,6 +46,10 @@ def main():
     ap.add_argument("--snap-tol-m", type=float, default=5.0, help="Snap tolerance meters (default 5m)")
     ap.add_argument("--simplify-m", type=float, default=6.0, help="Simplify meters (default 6m)")
     ap.add_argument("--order-field", default="", help="Station order field name (if empty, auto-detect/guess)")
+    ap.add_argument("--station-snap", choices=["edge", "node"], default="edge",
+                    help="Snap stations to the nearest point on an edge (default) or the nearest graph node")
+    ap.add_argument("--legs-csv", default="", help="Optional QA csv: path vs straight-line length per station leg")
+    ap.add_argument("--loop", action="store_true", help="Loop line (also read from an is_loop station column)")
     args = ap.parse_args()
 
     line_fp = Path(args.line)
@@ -180,7 +75,7 @@ def main():
 
     lines = explode_lines(gdf_line)
 
-    lines_m, metric_crs = to_metric(lines)
+    lines_m, metric_crs = to_metric(lines, assume_wgs84=True)
     st_m = gdf_st.to_crs(lines_m.crs)
 
     # snap small gaps then merge
@@ -194,35 +89,42 @@ def main():
     tmp = explode_lines(tmp)
     G = build_graph(tmp, args.node_grid_m)
 
+    # snap all stations at once (STRtree); one resumable search tree per station
+    st_xy = [(pt.x, pt.y) for pt in st_m.geometry]
+    router = G.station_router(st_xy, snap=args.station_snap)
+
     # station ordering
     order_field = args.order_field.strip() or guess_order_field(gdf_st)
+    closed = False
     if order_field and order_field in gdf_st.columns:
-        st_ordered = gdf_st.sort_values(order_field).reset_index(drop=True)
-        st_m_ordered = st_ordered.to_crs(lines_m.crs)
+        idxs = gdf_st.reset_index(drop=True).sort_values(order_field).index.tolist()
     else:
-        # fallback: greedy order
-        pts = list(st_m.geometry)
-        idxs = greedy_station_order(pts)
-        st_m_ordered = st_m.iloc[idxs].reset_index(drop=True)
-        st_ordered = gdf_st.iloc[idxs].reset_index(drop=True)
-
-    # map stations to nearest graph nodes
-    nodes = []
-    for i, pt in enumerate(st_m_ordered.geometry):
-        n = nearest_graph_node(G, pt, args.node_grid_m)
-        nodes.append(n)
-
-    # compute shortest paths between consecutive stations
+        # fallback: track chainage / loop ring / 2-opt (station_order.py)
+        ordering = order_stations(st_xy, router, list(tmp.geometry), is_loop=args.loop or guess_is_loop(gdf_st))
+        idxs, closed = ordering.order, ordering.closed
+        print(f"[INFO] station order: {ordering.method} score={ordering.score:.3f} branches={ordering.branches}"
+              + (" (closed loop)" if closed else ""))
+
+    # shortest paths between consecutive stations (trees reused from the ordering)
+    legs = router.legs(idxs, closed=closed)
     path_lines = []
-    for i in range(len(nodes) - 1):
-        a = nodes[i]
-        b = nodes[i + 1]
-        try:
-            path_nodes = nx.shortest_path(G, a, b, weight="weight")
-        except nx.NetworkXNoPath:
+    for leg in legs:
+        if leg.xy is None:
             # skip gap but keep info
             continue
-        path_lines.append(path_edges_to_linestring(path_nodes, args.node_grid_m))
+        path_lines.append(LineString(leg.xy))
+
+    if args.legs_csv:
+        names = gdf_st["name"].tolist() if "name" in gdf_st.columns else list(range(len(st_xy)))
+        pd.DataFrame([{
+            "leg": k,
+            "from": names[leg.i],
+            "to": names[leg.j],
+            "path_m": round(leg.length, 1) if leg.xy is not None else None,
+            "straight_m": round(leg.straight, 1),
+            "detour": round(leg.detour, 3) if leg.xy is not None else None,
+        } for k, leg in enumerate(legs)]).to_csv(args.legs_csv, index=False, encoding="utf-8-sig")
+        print("[OK] legs:", args.legs_csv)
 
     if not path_lines:
         raise RuntimeError("No station-to-station paths could be built (graph too fragmented or stations far from track).")
@@ -2,101 +2,154 @@
 # -*- coding: utf-8 -*-
 
 import argparse
-import math
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import List, Tuple
 
 import geopandas as gpd
+import numpy as np
 import pandas as pd
 from shapely.geometry import LineString, Point
 from shapely.ops import unary_union, linemerge, snap
-import networkx as nx
 
-
-# ---------------- CRS helpers ----------------
-def estimate_utm_epsg(lon, lat):
-    zone = int(math.floor((lon + 180) / 6) + 1)
-    return 32600 + zone if lat >= 0 else 32700 + zone
-
-
-def to_metric(gdf):
-    if gdf.crs is None:
-        gdf = gdf.set_crs(epsg=4326)
-    if not gdf.crs.is_geographic:
-        return gdf, str(gdf.crs)
-
-    minx, miny, maxx, maxy = gdf.total_bounds
-    lon = (minx + maxx) / 2
-    lat = (miny + maxy) / 2
-    epsg = estimate_utm_epsg(lon, lat)
-    out = gdf.to_crs(epsg=epsg)
-    return out, f"EPSG:{epsg}"
+from geodo_geom import explode_lines, to_metric
+from graph_cache import DEFAULT_CACHE_DIR, GraphCache, graph_key
+from station_order import order_stations
+from track_graph import TrackGraph
 
 
 # ---------------- Geometry helpers ----------------
-def explode_lines(gdf):
-    g = gdf.explode(index_parts=True, ignore_index=True)
-    g = g[g.geometry.notna() & ~g.geometry.is_empty]
-    g = g[g.geometry.geom_type.isin(["LineString", "MultiLineString"])]
-    g = g.explode(index_parts=True, ignore_index=True)
-    g = g[g.geometry.geom_type == "LineString"]
-    return g
-
+def build_graph(lines_m, grid_m):
+    return TrackGraph.from_lines(lines_m.geometry, grid_m)
+
+
+def is_loop_stations(gdf_st):
+    if "is_loop" not in gdf_st.columns:
+        return False
+    v = gdf_st["is_loop"].dropna()
+    return bool(len(v)) and str(v.iloc[0]).strip().lower() in ("1", "true", "yes")
+
+
+def leg_rows(route, legs, names):
+    """QA rows: path length next to the straight-line distance of every leg."""
+    rows = []
+    for k, leg in enumerate(legs):
+        rows.append({
+            "route": route,
+            "leg": k,
+            "from": names[leg.i],
+            "to": names[leg.j],
+            "path_m": round(leg.length, 1) if leg.xy is not None else None,
+            "straight_m": round(leg.straight, 1),
+            "detour": round(leg.detour, 3) if leg.xy is not None else None,
+        })
+    return rows
+
+
+def build_route_graph(line_fp, grid_m, snap_tol_m):
+    """line file -> (snapped / merged track graph, metric CRS string, ring coordinate arrays)"""
+    gdf_line = gpd.read_file(line_fp)
+    lines = explode_lines(gdf_line)
+    lines_m, metric_crs = to_metric(lines, assume_wgs84=True)
+
+    # snap & merge
+    u = unary_union(list(lines_m.geometry))
+    u = snap(u, u, snap_tol_m)
+    merged = linemerge(u)
+
+    tmp = gpd.GeoDataFrame(geometry=[merged], crs=lines_m.crs)
+    tmp = explode_lines(tmp)
+    # closed lines of the merged track, for loop ordering (station_order.order_on_ring)
+    rings = [np.asarray(ln.coords)[:, :2] for ln in tmp.geometry if ln.is_ring]
+    return build_graph(tmp, grid_m), metric_crs, rings
+
+
+def load_or_build_graph(line_fp, grid_m, snap_tol_m, cache):
+    """Cached (graph, CRS, rings) for (line file content, grid, snap tol), built and stored on a miss."""
+    params = {"node_grid_m": grid_m, "snap_tol_m": snap_tol_m}
+    key = graph_key(line_fp, **params) if cache.enabled else None
+    hit = cache.get(key) if key else None
+    if hit is not None:
+        G, meta, rings = hit
+        return G, meta["crs"], rings, "cache"
+    G, metric_crs, rings = build_route_graph(line_fp, grid_m, snap_tol_m)
+    if key:
+        cache.put(key, G, line_fp, params, metric_crs, rings)
+    return G, metric_crs, rings, "built"
+
+
+def run_route(line_fp, stations_dir, out_lines_dir, opts):
+    """One route -> (summary row, leg QA rows). Runs in a pool worker with --jobs > 1."""
+    route = line_fp.stem
+    st_fp = stations_dir / f"{route}_stations.geojson"
+    if not st_fp.exists():
+        return {"route": route, "status": "NO_STATIONS"}, []
+
+    try:
+        cache = GraphCache(opts["cache_dir"], enabled=not opts["no_cache"])
+        t0 = time.perf_counter()
+        G, metric_crs, rings, graph_src = load_or_build_graph(line_fp, opts["node_grid_m"], opts["snap_tol_m"], cache)
+        graph_ms = round((time.perf_counter() - t0) * 1000.0, 1)
+
+        gdf_st = gpd.read_file(st_fp)
+
+        # stations → points
+        gdf_st = gdf_st[gdf_st.geometry.notna() & ~gdf_st.geometry.is_empty]
+        bad = ~gdf_st.geometry.geom_type.isin(["Point", "MultiPoint"])
+        if bad.any():
+            gdf_st.loc[bad, "geometry"] = gdf_st.loc[bad, "geometry"].centroid
+        st_m = gdf_st.to_crs(metric_crs)
+
+        # station snaps (one batched query); one search tree per station
+        st_xy = [(pt.x, pt.y) for pt in st_m.geometry]
+        router = G.station_router(st_xy, snap=opts["station_snap"])
+
+        # order: field if present, else track chainage / 2-opt (station_order.py)
+        closed = False
+        if opts["order_field"] in gdf_st.columns:
+            order = gdf_st.reset_index(drop=True).sort_values(opts["order_field"]).index.tolist()
+            order_method, order_score = "field", None
+        else:
+            ordering = order_stations(st_xy, router, [LineString(r) for r in rings],
+                                      is_loop=is_loop_stations(gdf_st))
+            order, closed = ordering.order, ordering.closed
+            order_method, order_score = ordering.method, round(ordering.score, 3)
+        legs = router.legs(order, closed=closed)
+        names = st_m["name"].tolist() if "name" in st_m.columns else list(range(len(st_xy)))
+        paths = []
+        gaps = 0
+        for leg in legs:
+            if leg.xy is None:
+                gaps += 1
+            else:
+                paths.append(LineString(leg.xy))
 
-def densify_edges(line):
-    coords = list(line.coords)
-    for i in range(len(coords) - 1):
-        a = coords[i]
-        b = coords[i + 1]
-        seg = LineString([a, b])
-        yield a, b, seg.length
+        if not paths:
+            return {"route": route, "status": "NO_PATH"}, leg_rows(route, legs, names)
 
+        geom = linemerge(unary_union(paths))
+        geom = geom.simplify(opts["simplify_m"], preserve_topology=True)
 
-def round_node(x, y, grid):
-    return (int(round(x / grid)), int(round(y / grid)))
+        out_gdf = gpd.GeoDataFrame([{"geometry": geom}], crs=metric_crs).to_crs(epsg=4326)
+        out_fp = out_lines_dir / f"{route}_guno_line.geojson"
+        out_gdf.to_file(out_fp, driver="GeoJSON")
 
+        return {
+            "route": route,
+            "status": "OK",
+            "stations": len(st_xy),
+            "gaps": gaps,
+            "metric_crs": metric_crs,
+            "out_file": str(out_fp),
+            "graph": graph_src,
+            "graph_ms": graph_ms,
+            "order": order_method,
+            "order_score": order_score,
+        }, leg_rows(route, legs, names)
 
-def build_graph(lines_m, grid_m):
-    G = nx.Graph()
-    for geom in lines_m.geometry:
-        for (ax, ay), (bx, by), w in densify_edges(geom):
-            na = round_node(ax, ay, grid_m)
-            nb = round_node(bx, by, grid_m)
-            if na == nb:
-                continue
-            if G.has_edge(na, nb):
-                if w < G[na][nb]["weight"]:
-                    G[na][nb]["weight"] = w
-            else:
-                G.add_edge(na, nb, weight=w)
-    return G
-
-
-def nearest_node(G, pt, grid_m, radius=50):
-    cx, cy = round_node(pt.x, pt.y, grid_m)
-    best = None
-    best_d2 = 1e18
-    for r in range(1, radius + 1):
-        for dx in range(-r, r + 1):
-            for dy in range(-r, r + 1):
-                n = (cx + dx, cy + dy)
-                if n not in G:
-                    continue
-                x = n[0] * grid_m
-                y = n[1] * grid_m
-                d2 = (x - pt.x) ** 2 + (y - pt.y) ** 2
-                if d2 < best_d2:
-                    best_d2 = d2
-                    best = n
-        if best is not None:
-            break
-    if best is None:
-        raise RuntimeError("No nearby graph node for station")
-    return best
-
-
-def nodes_to_linestring(nodes, grid_m):
-    return LineString([(n[0] * grid_m, n[1] * grid_m) for n in nodes])
+    except Exception as e:
+        return {"route": route, "status": f"ERROR: {e}"}, []
 
 
 # ---------------- Main batch ----------------
@@ -110,6 +163,10 @@ def main():
     ap.add_argument("--node-grid-m", type=float, default=2.0)
     ap.add_argument("--snap-tol-m", type=float, default=3.0)
     ap.add_argument("--simplify-m", type=float, default=6.0)
+    ap.add_argument("--station-snap", choices=["edge", "node"], default="edge")
+    ap.add_argument("--jobs", type=int, default=1, help="Worker processes (default 1)")
+    ap.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Track graph cache directory")
+    ap.add_argument("--no-cache", action="store_true", help="Always rebuild graphs (cache not read or written)")
     args = ap.parse_args()
 
     lines_dir = Path(args.lines_dir)
@@ -118,77 +175,26 @@ def main():
     out_lines_dir = out_dir / "guno_lines"
     out_lines_dir.mkdir(parents=True, exist_ok=True)
 
-    summary_rows = []
-
-    for line_fp in sorted(lines_dir.glob(args.pattern)):
-        route = line_fp.stem
-        st_fp = stations_dir / f"{route}_stations.geojson"
-        if not st_fp.exists():
-            summary_rows.append({"route": route, "status": "NO_STATIONS"})
-            continue
-
-        try:
-            gdf_line = gpd.read_file(line_fp)
-            gdf_st = gpd.read_file(st_fp)
-
-            # stations → points
-            gdf_st = gdf_st[gdf_st.geometry.notna() & ~gdf_st.geometry.is_empty]
-            bad = ~gdf_st.geometry.geom_type.isin(["Point", "MultiPoint"])
-            if bad.any():
-                gdf_st.loc[bad, "geometry"] = gdf_st.loc[bad, "geometry"].centroid
-            gdf_st = gdf_st.sort_values(args.order_field)
-
-            lines = explode_lines(gdf_line)
-            lines_m, metric_crs = to_metric(lines)
-            st_m = gdf_st.to_crs(lines_m.crs)
-
-            # snap & merge
-            u = unary_union(list(lines_m.geometry))
-            u = snap(u, u, args.snap_tol_m)
-            merged = linemerge(u)
-
-            tmp = gpd.GeoDataFrame(geometry=[merged], crs=lines_m.crs)
-            tmp = explode_lines(tmp)
-
-            G = build_graph(tmp, args.node_grid_m)
-
-            # station nodes
-            nodes = [nearest_node(G, pt, args.node_grid_m) for pt in st_m.geometry]
-
-            paths = []
-            gaps = 0
-            for i in range(len(nodes) - 1):
-                try:
-                    p = nx.shortest_path(G, nodes[i], nodes[i + 1], weight="weight")
-                    paths.append(nodes_to_linestring(p, args.node_grid_m))
-                except nx.NetworkXNoPath:
-                    gaps += 1
-
-            if not paths:
-                summary_rows.append({"route": route, "status": "NO_PATH"})
-                continue
-
-            geom = linemerge(unary_union(paths))
-            geom = geom.simplify(args.simplify_m, preserve_topology=True)
-
-            out_gdf = gpd.GeoDataFrame([{"geometry": geom}], crs=lines_m.crs).to_crs(epsg=4326)
-            out_fp = out_lines_dir / f"{route}_guno_line.geojson"
-            out_gdf.to_file(out_fp, driver="GeoJSON")
-
-            summary_rows.append({
-                "route": route,
-                "status": "OK",
-                "stations": len(nodes),
-                "gaps": gaps,
-                "metric_crs": metric_crs,
-                "out_file": str(out_fp)
-            })
-
-        except Exception as e:
-            summary_rows.append({"route": route, "status": f"ERROR: {e}"})
+    opts = vars(args)
+    files = sorted(lines_dir.glob(args.pattern))
+    if args.jobs > 1 and len(files) > 1:
+        # ワーカーにはパスだけ渡す（グラフはキャッシュを各自 memmap で開く）
+        with ProcessPoolExecutor(max_workers=args.jobs) as ex:
+            results = list(ex.map(run_route, files, [stations_dir] * len(files),
+                                  [out_lines_dir] * len(files), [opts] * len(files)))
+    else:
+        results = [run_route(fp, stations_dir, out_lines_dir, opts) for fp in files]
+
+    summary_rows = [row for row, _ in results]
+    legs_rows = [leg for _, legs in results for leg in legs]
 
     pd.DataFrame(summary_rows).to_csv(out_dir / "_summary_guno_v4_1.csv",
                                       index=False, encoding="utf-8-sig")
+    pd.DataFrame(legs_rows).to_csv(out_dir / "_legs_guno_v4_1.csv",
+                                   index=False, encoding="utf-8-sig")
+    built = sum(1 for r in summary_rows if r.get("graph") == "built")
+    cached = sum(1 for r in summary_rows if r.get("graph") == "cache")
+    print(f"[INFO] graphs: {cached} from cache, {built} built" + ("" if not args.no_cache else " (cache off)"))
     print("[OK] batch completed")
 
 
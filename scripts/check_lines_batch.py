@@ -16,7 +16,6 @@ Requires: geopandas, shapely
 
 import argparse
 import json
-import math
 import os
 from pathlib import Path
 from collections import Counter, defaultdict
@@ -26,29 +25,7 @@ import geopandas as gpd
 from shapely.geometry import Point
 from shapely.validation import explain_validity
 
-
-def is_geographic_crs(gdf: gpd.GeoDataFrame) -> bool:
-    try:
-        return bool(gdf.crs and gdf.crs.is_geographic)
-    except Exception:
-        return False
-
-
-def estimate_utm_epsg(lon: float, lat: float) -> int:
-    zone = int(math.floor((lon + 180) / 6) + 1)
-    return (32600 + zone) if lat >= 0 else (32700 + zone)
-
-
-def to_metric(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
-    if gdf.crs is None:
-        return gdf
-    if not is_geographic_crs(gdf):
-        return gdf
-    minx, miny, maxx, maxy = gdf.total_bounds
-    lon = (minx + maxx) / 2.0
-    lat = (miny + maxy) / 2.0
-    epsg = estimate_utm_epsg(lon, lat)
-    return gdf.to_crs(epsg=epsg)
+from geodo_geom import project_to_metric
 
 
 def explode_lines(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
@@ -170,7 +147,7 @@ def check_one(file_path: Path, short_m: float, node_tol_m: float, out_dir: Path)
     lines_ex = explode_lines(lines)
     lines_ex = lines_ex[lines_ex.geometry.geom_type == "LineString"].copy()
 
-    lines_m = to_metric(lines_ex)
+    lines_m, _ = project_to_metric(lines_ex)
     report["metric_crs"] = str(lines_m.crs)
     report["length"] = length_stats(lines_m, short_m=short_m)
 
@@ -17,7 +17,6 @@ Optional (recommended): pyproj
 
 import argparse
 import json
-import math
 from collections import Counter, defaultdict
 
 import geopandas as gpd
@@ -25,45 +24,14 @@ from shapely.geometry import LineString, MultiLineString, Point
 from shapely.ops import linemerge
 from shapely.validation import explain_validity
 
+from geodo_geom import project_to_metric
+
 try:
     from shapely import make_valid  # shapely>=2.0
 except Exception:
     make_valid = None
 
 
-def is_geographic_crs(gdf: gpd.GeoDataFrame) -> bool:
-    try:
-        return bool(gdf.crs and gdf.crs.is_geographic)
-    except Exception:
-        return False
-
-
-def estimate_utm_epsg(lon: float, lat: float) -> int:
-    # Rough UTM zone EPSG for Japan/anywhere
-    zone = int(math.floor((lon + 180) / 6) + 1)
-    if lat >= 0:
-        return 32600 + zone  # WGS84 / UTM north
-    else:
-        return 32700 + zone  # south
-
-
-def to_metric(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
-    """Project to a metric CRS if currently geographic (lon/lat)."""
-    if gdf.crs is None:
-        # unknown; return as-is (lengths may be nonsense)
-        return gdf
-
-    if not is_geographic_crs(gdf):
-        return gdf
-
-    # Use centroid of bounds to pick UTM
-    minx, miny, maxx, maxy = gdf.total_bounds
-    lon = (minx + maxx) / 2.0
-    lat = (miny + maxy) / 2.0
-    epsg = estimate_utm_epsg(lon, lat)
-    return gdf.to_crs(epsg=epsg)
-
-
 def explode_lines(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
     """Explode MultiLineString into single parts (keeps other types)."""
     return gdf.explode(index_parts=True, ignore_index=False)
@@ -229,7 +197,7 @@ def main():
     lines_ex = lines_ex[lines_ex.geometry.geom_type == "LineString"].copy()
 
     # Metric projection for length/degree checks
-    lines_m = to_metric(lines_ex)
+    lines_m, _ = project_to_metric(lines_ex)
     report["metric_crs"] = str(lines_m.crs)
 
     # Length stats + short segment density
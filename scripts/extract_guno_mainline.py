@@ -2,51 +2,15 @@
 # -*- coding: utf-8 -*-
 
 import argparse
-import math
 from pathlib import Path
-from typing import Optional, List, Tuple, Dict
+from typing import Optional, List, Dict
 
 import geopandas as gpd
 import pandas as pd
 from shapely.geometry import LineString
 from shapely.ops import unary_union, linemerge, snap
 
-
-def is_geographic_crs(gdf: gpd.GeoDataFrame) -> bool:
-    try:
-        return bool(gdf.crs and gdf.crs.is_geographic)
-    except Exception:
-        return False
-
-
-def estimate_utm_epsg(lon: float, lat: float) -> int:
-    zone = int(math.floor((lon + 180) / 6) + 1)
-    return (32600 + zone) if lat >= 0 else (32700 + zone)
-
-
-def to_metric_crs(gdf: gpd.GeoDataFrame) -> Tuple[gpd.GeoDataFrame, Optional[str]]:
-    """Project to a local metric CRS (UTM) if input is geographic."""
-    if gdf.crs is None:
-        return gdf, None
-    if not is_geographic_crs(gdf):
-        return gdf, str(gdf.crs)
-
-    minx, miny, maxx, maxy = gdf.total_bounds
-    lon = (minx + maxx) / 2.0
-    lat = (miny + maxy) / 2.0
-    epsg = estimate_utm_epsg(lon, lat)
-    out = gdf.to_crs(epsg=epsg)
-    return out, str(out.crs)
-
-
-def explode_lines_only(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
-    """Keep only line geometries, explode MultiLineString to LineString rows."""
-    g = gdf.explode(index_parts=True, ignore_index=True)
-    g = g[g.geometry.notna() & ~g.geometry.is_empty].copy()
-    g = g[g.geometry.geom_type.isin(["LineString", "MultiLineString"])].copy()
-    g = g.explode(index_parts=True, ignore_index=True)
-    g = g[g.geometry.geom_type == "LineString"].copy()
-    return g
+from geodo_geom import explode_lines, project_to_metric
 
 
 def geom_to_lines(geom) -> List[LineString]:
@@ -76,11 +40,11 @@ def extract_mainline(
     if gdf4326.crs is None:
         gdf4326 = gdf4326.set_crs(epsg=4326)
 
-    lines = explode_lines_only(gdf4326)
+    lines = explode_lines(gdf4326)
     if len(lines) == 0:
         return {"status": "NO_LINES"}
 
-    lines_m, metric_crs = to_metric_crs(lines)
+    lines_m, metric_crs = project_to_metric(lines)
     if metric_crs is None:
         return {"status": "NO_CRS"}
 
@@ -1,49 +1,18 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import argparse, math
+import argparse
 from pathlib import Path
 from typing import Optional, List, Tuple
 
 import geopandas as gpd
+import numpy as np
 import pandas as pd
-from shapely.geometry import LineString, Point
+import shapely
+from shapely.geometry import LineString
 from shapely.ops import unary_union, linemerge, snap
 
-
-def is_geographic_crs(gdf: gpd.GeoDataFrame) -> bool:
-    try:
-        return bool(gdf.crs and gdf.crs.is_geographic)
-    except Exception:
-        return False
-
-
-def estimate_utm_epsg(lon: float, lat: float) -> int:
-    zone = int(math.floor((lon + 180) / 6) + 1)
-    return (32600 + zone) if lat >= 0 else (32700 + zone)
-
-
-def to_metric_crs(gdf: gpd.GeoDataFrame) -> Tuple[gpd.GeoDataFrame, Optional[str]]:
-    if gdf.crs is None:
-        return gdf, None
-    if not is_geographic_crs(gdf):
-        return gdf, str(gdf.crs)
-
-    minx, miny, maxx, maxy = gdf.total_bounds
-    lon = (minx + maxx) / 2.0
-    lat = (miny + maxy) / 2.0
-    epsg = estimate_utm_epsg(lon, lat)
-    out = gdf.to_crs(epsg=epsg)
-    return out, str(out.crs)
-
-
-def explode_lines_only(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
-    g = gdf.explode(index_parts=True, ignore_index=True)
-    g = g[g.geometry.notna() & ~g.geometry.is_empty].copy()
-    g = g[g.geometry.geom_type.isin(["LineString", "MultiLineString"])].copy()
-    g = g.explode(index_parts=True, ignore_index=True)
-    g = g[g.geometry.geom_type == "LineString"].copy()
-    return g
+from geodo_geom import explode_lines, project_to_metric
 
 
 def geom_to_lines(geom) -> List[LineString]:
@@ -63,68 +32,69 @@ def choose_longest_line(geom) -> Optional[LineString]:
     return max(lines, key=lambda x: x.length)
 
 
-def endpoints(line: LineString) -> Tuple[Point, Point]:
-    c = list(line.coords)
-    return Point(c[0]), Point(c[-1])
+def pair_endpoints(pts: np.ndarray, comp: np.ndarray, tol: float, max_links: int = 200) -> List[Tuple[int, int, float]]:
+    """
+    別componentの端点ペアを近い順に貪欲に結ぶ（各端点は1回まで）。
+    候補は STRtree の tol 窓検索で一度だけ集め、(距離, 端点番号) で整列して先頭から採用する。
+    毎回「未使用端点の最近ペア」を全探索していた従来版と同じペア・同じ順序になる
+    （同距離は端点リストで先のペアを優先）。
+    戻り値: [(端点a, 端点b, 距離)]  a < b
+    """
+    n = len(pts)
+    geoms = shapely.points(pts)
+    # 窓は少し広めに取り、境界は Point.distance と同じ式の距離で判定する
+    a, b = shapely.STRtree(geoms).query(geoms, predicate="dwithin", distance=tol + 1e-9 * max(1.0, tol))
+    m = (a < b) & (comp[a] != comp[b])
+    a, b = a[m], b[m]
+    dx = pts[b, 0] - pts[a, 0]
+    dy = pts[b, 1] - pts[a, 1]
+    d = np.sqrt(dx * dx + dy * dy)
+    ok = d <= tol
+    a, b, d = a[ok], b[ok], d[ok]
+
+    used = np.zeros(n, dtype=bool)
+    links = []
+    remaining = n
+    for k in np.lexsort((b, a, d)).tolist():
+        if len(links) >= max_links:
+            break
+        i, j = int(a[k]), int(b[k])
+        if used[i] or used[j]:
+            continue
+        used[i] = used[j] = True
+        links.append((i, j, float(d[k])))
+        remaining -= 2
+        if remaining < 4:
+            break
+    return links
 
 
-def connect_components(lines: List[LineString], connect_tol_m: float, max_links: int = 200) -> List[LineString]:
+def connect_components(lines: List[LineString], connect_tol_m: float, max_links: int = 200) -> Tuple[List[LineString], float]:
     """
     components間の端点が近いものを橋渡し線で接続する（誤接続防止で距離閾値あり）。
+    戻り値: (lines + 橋渡し線, 橋渡し総延長[m])
     """
     if len(lines) <= 1:
-        return lines
-
-    # 端点リスト
-    ends = []
-    for i, ln in enumerate(lines):
-        a, b = endpoints(ln)
-        ends.append((i, 0, a))
-        ends.append((i, 1, b))
-
-    connectors = []
-    used = set()
-
-    # 近い端点ペアを貪欲に結ぶ（同じcomponent同士は除外）
-    for _ in range(max_links):
-        best = None
-        best_d = 1e18
-        for i, si, pi in ends:
-            for j, sj, pj in ends:
-                if i == j:
-                    continue
-                key = tuple(sorted([(i, si), (j, sj)]))
-                if key in used:
-                    continue
-                d = pi.distance(pj)
-                if d < best_d:
-                    best_d = d
-                    best = (i, si, pi, j, sj, pj, key)
-        if best is None or best_d > connect_tol_m:
-            break
-
-        i, si, pi, j, sj, pj, key = best
-        used.add(key)
-        connectors.append(LineString([(pi.x, pi.y), (pj.x, pj.y)]))
+        return lines, 0.0
 
-        # 一度つないだ端点を二重に使いすぎないように（軽い制限）
-        ends = [(ii, ss, pp) for (ii, ss, pp) in ends if (ii, ss) not in [(i, si), (j, sj)]]
-
-        if len(ends) < 4:
-            break
+    # 端点リスト: 線iの始点 = 2i, 終点 = 2i+1
+    pts = np.array([c for ln in lines for c in (ln.coords[0][:2], ln.coords[-1][:2])], dtype=np.float64)
+    comp = np.repeat(np.arange(len(lines)), 2)
 
-    return lines + connectors
+    links = pair_endpoints(pts, comp, connect_tol_m, max_links)
+    connectors = [LineString([tuple(pts[i]), tuple(pts[j])]) for i, j, _ in links]
+    return lines + connectors, float(sum(d for _, _, d in links))
 
 
 def extract_mainline(gdf4326: gpd.GeoDataFrame, snap_tol_m: float, connect_tol_m: float, simplify_m: float):
     if gdf4326.crs is None:
         gdf4326 = gdf4326.set_crs(epsg=4326)
 
-    lines = explode_lines_only(gdf4326)
+    lines = explode_lines(gdf4326)
     if len(lines) == 0:
         return {"status": "NO_LINES"}
 
-    lines_m, metric_crs = to_metric_crs(lines)
+    lines_m, metric_crs = project_to_metric(lines)
     if metric_crs is None:
         return {"status": "NO_CRS"}
 
@@ -137,10 +107,12 @@ def extract_mainline(gdf4326: gpd.GeoDataFrame, snap_tol_m: float, connect_tol_m
 
     # 分断が残る場合は端点ギャップで接続して再マージ
     if connect_tol_m and connect_tol_m > 0 and len(comps) > 1:
-        comps2 = connect_components(comps, connect_tol_m=connect_tol_m)
+        comps2, bridged_m = connect_components(comps, connect_tol_m=connect_tol_m)
+        bridges = len(comps2) - len(comps)
         merged2 = linemerge(unary_union(comps2))
     else:
         merged2 = merged
+        bridges, bridged_m = 0, 0.0
 
     main = choose_longest_line(merged2)
     if main is None or main.length == 0:
@@ -157,6 +129,8 @@ def extract_mainline(gdf4326: gpd.GeoDataFrame, snap_tol_m: float, connect_tol_m
         "length_m": float(main.length),
         "total_components_len_m": total_len,
         "ratio_main_to_total": float(main.length) / total_len if total_len > 0 else None,
+        "bridges": bridges,
+        "bridged_m": bridged_m,
         "out": out,
     }
 
@@ -191,6 +165,8 @@ def main():
                     "length_m": r["length_m"],
                     "total_components_len_m": r["total_components_len_m"],
                     "ratio_main_to_total": r["ratio_main_to_total"],
+                    "bridges": r["bridges"],
+                    "bridged_m": round(r["bridged_m"], 1),
                     "metric_crs": r["metric_crs"],
                     "out_file": str(out_fp),
                 })
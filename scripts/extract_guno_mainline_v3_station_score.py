@@ -2,55 +2,20 @@
 # -*- coding: utf-8 -*-
 
 import argparse
-import math
 from pathlib import Path
 from typing import Optional, List, Tuple, Dict
 
 import geopandas as gpd
+import numpy as np
 import pandas as pd
+import shapely
 from shapely.geometry import LineString, MultiLineString
 from shapely.ops import unary_union, linemerge, snap
 
-
-# ---------- CRS helpers ----------
-def is_geographic_crs(gdf: gpd.GeoDataFrame) -> bool:
-    try:
-        return bool(gdf.crs and gdf.crs.is_geographic)
-    except Exception:
-        return False
-
-
-def estimate_utm_epsg(lon: float, lat: float) -> int:
-    zone = int(math.floor((lon + 180) / 6) + 1)
-    return (32600 + zone) if lat >= 0 else (32700 + zone)
-
-
-def to_metric_crs(gdf: gpd.GeoDataFrame) -> Tuple[gpd.GeoDataFrame, Optional[str]]:
-    """Project to local UTM if input is geographic."""
-    if gdf.crs is None:
-        return gdf, None
-    if not is_geographic_crs(gdf):
-        return gdf, str(gdf.crs)
-
-    minx, miny, maxx, maxy = gdf.total_bounds
-    lon = (minx + maxx) / 2.0
-    lat = (miny + maxy) / 2.0
-    epsg = estimate_utm_epsg(lon, lat)
-    out = gdf.to_crs(epsg=epsg)
-    return out, str(out.crs)
+from geodo_geom import WGS84_EPSG, RouteGeometry, reproject
 
 
 # ---------- Geometry helpers ----------
-def explode_lines_only(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
-    """Keep only line geometries; explode MultiLineString into LineString rows."""
-    g = gdf.explode(index_parts=True, ignore_index=True)
-    g = g[g.geometry.notna() & ~g.geometry.is_empty].copy()
-    g = g[g.geometry.geom_type.isin(["LineString", "MultiLineString"])].copy()
-    g = g.explode(index_parts=True, ignore_index=True)
-    g = g[g.geometry.geom_type == "LineString"].copy()
-    return g
-
-
 def geom_to_lines(geom) -> List[LineString]:
     if geom is None or geom.is_empty:
         return []
@@ -61,6 +26,15 @@ def geom_to_lines(geom) -> List[LineString]:
     return []
 
 
+def copy_first_props(out: gpd.GeoDataFrame, src: gpd.GeoDataFrame) -> None:
+    """Copy all non-geometry properties of src's first feature onto every row of out."""
+    if len(src) == 0:
+        return
+    for k in src.columns:
+        if k != "geometry":
+            out[k] = src.iloc[0][k]
+
+
 def find_station_file(stations_dir: Path, route_stem: str) -> Optional[Path]:
     """Prefer exact <route>_stations.geojson, else try fuzzy match."""
     exact = stations_dir / f"{route_stem}_stations.geojson"
@@ -71,11 +45,64 @@ def find_station_file(stations_dir: Path, route_stem: str) -> Optional[Path]:
     return hits[0] if hits else None
 
 
+def station_points(stations_m: gpd.GeoDataFrame) -> np.ndarray:
+    """
+    One point per station. MultiPoint (and any other non-Point) stations are
+    reduced to their centroid: dwithin on a MultiPoint would count the station
+    as soon as any of its points is near the line.
+    """
+    pts = np.asarray(stations_m.geometry.values, dtype=object)
+    multi = shapely.get_type_id(pts) != shapely.GeometryType.POINT
+    if multi.any():
+        pts = pts.copy()
+        pts[multi] = shapely.centroid(pts[multi])
+    return pts
+
+
 def score_line_by_stations(line: LineString, stations_m: gpd.GeoDataFrame, hit_dist_m: float) -> int:
     """Count stations within hit_dist_m from the line."""
-    # Fast-ish: buffer then within()
-    buf = line.buffer(hit_dist_m)
-    return int(stations_m.within(buf).sum())
+    return int(shapely.dwithin(station_points(stations_m), line, hit_dist_m).sum())
+
+
+def _popcount(bits: int) -> int:
+    return bin(bits).count("1")
+
+
+class StationCoverage:
+    """
+    Station coverage of every component, computed once.
+
+    One STRtree over the components answers all (station, component) pairs
+    within hit_dist_m in a single dwithin query, and query_nearest gives each
+    station's nearest-component distance. Coverage per component is kept as a
+    bitset (Python int, bit i = station i), so the greedy selection is just
+    OR / AND-NOT / popcount on ints instead of buffering each component and
+    running point-in-polygon tests against it.
+
+      masks      bitset of stations within hit_dist_m, per component
+      nearest_m  distance from each station to its nearest component
+      reachable  bitset of stations within hit_dist_m of any component
+    """
+
+    def __init__(self, lines: List[LineString], stations: np.ndarray, hit_dist_m: float):
+        self.n_stations = len(stations)
+        tree = shapely.STRtree(lines)
+        st_idx, ln_idx = tree.query(stations, predicate="dwithin", distance=hit_dist_m)
+        masks = [0] * len(lines)
+        for s, j in zip(st_idx.tolist(), ln_idx.tolist()):
+            masks[j] |= 1 << s
+        self.masks = masks
+        self.counts = [_popcount(m) for m in masks]
+        (s_near, _), dist = tree.query_nearest(stations, return_distance=True, all_matches=False)
+        self.nearest_m = np.full(self.n_stations, np.inf)
+        self.nearest_m[s_near] = dist
+        self.reachable = 0
+        for s in np.flatnonzero(self.nearest_m <= hit_dist_m).tolist():
+            self.reachable |= 1 << s
+
+    def gain(self, covered: int, j: int) -> int:
+        """Stations component j adds to the covered set."""
+        return _popcount(self.masks[j] & ~covered)
 
 
 def merge_top_components(
@@ -100,30 +127,29 @@ def merge_top_components(
         best = max(lines, key=lambda g: g.length)
         return best, 0, 0.0
 
-    # Precompute station hits per line
-    # Represent coverage as boolean mask
-    masks = []
-    for ln in lines:
-        buf = ln.buffer(hit_dist_m)
-        masks.append(stations_m.within(buf).values)
+    # Station hits per line, as bitsets (see StationCoverage)
+    cov = StationCoverage(lines, station_points(stations_m), hit_dist_m)
 
     # 1) best single
-    best_i = max(range(len(lines)), key=lambda i: (masks[i].sum(), lines[i].length))
+    best_i = max(range(len(lines)), key=lambda i: (cov.counts[i], lines[i].length))
     chosen = [best_i]
-    covered = masks[best_i].copy()
+    covered = cov.masks[best_i]
 
     # 2) add components if it increases coverage
     while len(chosen) < max_components:
-        current_ratio = covered.sum() / total
+        current_ratio = _popcount(covered) / total
         if current_ratio >= target_ratio:
             break
+        # every station within reach of some component is already covered
+        if covered == cov.reachable:
+            break
 
         best_gain = 0
         best_j = None
         for j in range(len(lines)):
             if j in chosen:
                 continue
-            gain = ((covered | masks[j]).sum() - covered.sum())
+            gain = cov.gain(covered, j)
             if gain > best_gain:
                 best_gain = gain
                 best_j = j
@@ -132,12 +158,12 @@ def merge_top_components(
             break
 
         chosen.append(best_j)
-        covered = (covered | masks[best_j])
+        covered |= cov.masks[best_j]
 
     # Merge chosen components
     picked = [lines[i] for i in chosen]
     merged = linemerge(unary_union(picked))
-    hit_count = int(covered.sum())
+    hit_count = _popcount(covered)
     hit_ratio = hit_count / total if total else 0.0
     return merged, hit_count, hit_ratio
 
@@ -150,29 +176,32 @@ def extract_guno_line_v3(
     station_hit_m: float,
     target_station_ratio: float,
     max_components: int,
+    rg: Optional[RouteGeometry] = None,
 ) -> Dict:
-    """Main extraction: station-score driven component selection."""
-    if line_gdf4326.crs is None:
-        line_gdf4326 = line_gdf4326.set_crs(epsg=4326)
+    """
+    Main extraction: station-score driven component selection.
+    rg: the route already read/exploded/projected (pipeline); built from line_gdf4326 if None.
+    """
+    if rg is None:
+        rg = RouteGeometry(line_gdf4326)
     if stations_gdf4326.crs is None:
         stations_gdf4326 = stations_gdf4326.set_crs(epsg=4326)
 
     # Ensure stations are points
     stations_gdf4326 = stations_gdf4326[stations_gdf4326.geometry.notna() & ~stations_gdf4326.geometry.is_empty].copy()
-    # If any station is polygon/linestring, use centroid
-    bad = ~stations_gdf4326.geometry.geom_type.isin(["Point", "MultiPoint"])
+    # If any station is multipoint/polygon/linestring, use centroid
+    bad = stations_gdf4326.geometry.geom_type != "Point"
     if bad.any():
         stations_gdf4326.loc[bad, "geometry"] = stations_gdf4326.loc[bad, "geometry"].centroid
 
-    lines = explode_lines_only(line_gdf4326)
-    if len(lines) == 0:
+    if len(rg) == 0:
         return {"status": "NO_LINES"}
 
-    lines_m, metric_crs = to_metric_crs(lines)
+    lines_m, metric_crs = rg.metric, rg.metric_crs
     if metric_crs is None:
         return {"status": "NO_CRS"}
 
-    stations_m = stations_gdf4326.to_crs(lines_m.crs)
+    stations_m = reproject(stations_gdf4326, lines_m.crs)
 
     # Merge network lightly (no bridging). Snap helps close tiny gaps only.
     u = unary_union(list(lines_m.geometry))
@@ -206,7 +235,7 @@ def extract_guno_line_v3(
     if simplify_m and simplify_m > 0:
         chosen_line = chosen_line.simplify(simplify_m, preserve_topology=True)
 
-    out = gpd.GeoDataFrame([{"geometry": chosen_line}], crs=lines_m.crs).to_crs(epsg=4326)
+    out = gpd.GeoDataFrame([{"geometry": rg.to_wgs84(chosen_line)}], crs=WGS84_EPSG)
 
     return {
         "status": "OK",
@@ -271,11 +300,8 @@ def main():
             if r["status"] == "OK":
                 out = r["out"]
 
-                if args.keep_props_from == "first" and len(gdf_line) > 0:
-                    # copy all non-geometry properties from first feature
-                    for k in gdf_line.columns:
-                        if k != "geometry":
-                            out[k] = gdf_line.iloc[0][k]
+                if args.keep_props_from == "first":
+                    copy_first_props(out, gdf_line)
 
                 out_fp = out_lines_dir / f"{route_stem}_guno_line.geojson"
                 out.to_file(out_fp, driver="GeoJSON")
@@ -10,10 +10,23 @@ Improvements over v1:
   - Robust stop deduplication with name-based ordering
 
 Usage:
-  python3 fetch_line_v2.py <route_id> <csv_path> <output_dir> [--force]
+  python3 fetch_line_v2.py <route_id> <csv_path> <output_dir> [--force] [cache options]
+  python3 fetch_line_v2.py <id,id,...|all> <csv_path> <output_dir> --concurrency N [--rate R]
+  python3 fetch_line_v2.py all <csv_path> <output_dir> --refresh
 
 Options:
-  --force   Overwrite existing files even if they already have data
+  --force             Overwrite existing files even if they already have data
+  --refresh           Check the OSM versions of the relations recorded in result_{slug}.json
+                      (`out meta`, no geometry) and re-download only relations that changed
+  --concurrency N     Fetch the given routes in parallel with up to N queries in flight
+                      (asyncio scheduler, see overpass_scheduler.py)
+  --rate R            Requests per second allowed to the Overpass host (default 1.0)
+  --offline           Replay Overpass responses from the cache only (no network)
+  --no-cache          Always query Overpass, never read or write the cache
+  --cache-dir DIR     Response cache directory (shared with fetch_oedo.py)
+  --cache-ttl HOURS   Cache entry lifetime (default 168, 0 = never expire)
+  --cache-max-mb MB   Cache size budget before LRU eviction (default 512)
+  --pack              Also write a quantized .gdpk next to each GeoJSON (see geodo_pack.py)
 """
 
 import sys
@@ -23,8 +36,19 @@ import re
 import requests
 import csv
 import os
+import threading
 
-OVERPASS_URL = "https://overpass-api.de/api/interpreter"
+from concurrent.futures import ThreadPoolExecutor
+
+from geodo_pack import pack_path, write_pack
+from overpass_cache import OverpassCache, cache_from_argv
+from track_chain import chain_track, flatten_parts, geometry_parts, parts_geometry
+from track_projection import project_points
+from overpass_stream import read_response_compact
+from overpass_scheduler import OverpassScheduler, PRIO_STOPS, PRIO_GEOM, PRIO_CANDIDATES
+
+# GEODO_OVERPASS_URL points the fetchers at a mirror or at overpass_stub_server.py
+OVERPASS_URL = os.environ.get("GEODO_OVERPASS_URL", "https://overpass-api.de/api/interpreter")
 HEADERS = {"User-Agent": "geodo.earth-builder/1.0 (https://geodo.earth)"}
 
 # Japanese operator keywords to filter OSM results to Japan
@@ -43,18 +67,74 @@ UP_KEYWORDS   = ["上り", "内回り", "外回り（上り）", "inbound"]
 DOWN_KEYWORDS = ["下り", "外回り", "outbound"]
 LOOP_KEYWORDS = ["外回り", "内回り"]  # 環状線
 
-def overpass_query(query, retries=5, wait=8):
-    """POST a query to Overpass API with retry logic."""
+# Stations further than this from the track are flagged in result_{slug}.json
+STATION_OFFSET_WARN_M = 300.0
+
+# Response cache (replaced from command-line flags in main())
+CACHE = OverpassCache()
+# Request scheduler, only set when running with --concurrency
+SCHEDULER = None
+# --pack: write a .gdpk next to every GeoJSON output
+PACK = False
+# Per-thread (= per-route) count of queries the offline cache could not answer
+_ROUTE_STATE = threading.local()
+
+def reset_offline_misses():
+    _ROUTE_STATE.offline_misses = 0
+
+def offline_misses():
+    return getattr(_ROUTE_STATE, "offline_misses", 0)
+
+def note_offline_miss(n=1):
+    _ROUTE_STATE.offline_misses = offline_misses() + n
+
+def polite_sleep(seconds):
+    """
+    Pause between Overpass calls, unless the last answer came from the cache
+    or the scheduler is pacing requests.
+    """
+    if SCHEDULER is None and not CACHE.last_hit:
+        time.sleep(seconds)
+
+def overpass_query(query, retries=5, wait=8, priority=PRIO_CANDIDATES, fresh=False, stream=False):
+    """
+    POST a query to Overpass API with retry logic (served from CACHE when possible).
+    fresh: skip the cache lookup (the answer is still stored), for version checks
+    and re-downloads of relations known to have changed.
+    stream: parse the body incrementally into the compact form of overpass_stream.py
+    (member geometries as "coords" arrays), for large `out geom` responses.
+    An offline cache miss returns None and is counted for the current route
+    (offline_misses()), so partial replays are never written out.
+    """
+    if SCHEDULER is not None:
+        data = SCHEDULER.request(query, priority, fresh=fresh, stream=stream)
+    elif not fresh or CACHE.offline:
+        data = CACHE.get(query, OVERPASS_URL, compact=stream)
+        if data is None and not CACHE.offline:
+            data = _post_query(query, retries, wait, stream)
+    else:
+        data = _post_query(query, retries, wait, stream)
+    if data is None and CACHE.offline:
+        note_offline_miss()
+    return data
+
+def _post_query(query, retries, wait, stream):
+    """Send one query to Overpass (no cache lookup), retrying on errors."""
     for attempt in range(retries):
         try:
             resp = requests.post(
                 OVERPASS_URL,
                 data={"data": query},
                 headers=HEADERS,
-                timeout=120
+                timeout=120,
+                stream=stream
             )
             if resp.status_code == 200:
-                return resp.json()
+                if stream:
+                    return read_response_compact(resp, CACHE, query, OVERPASS_URL)
+                data = resp.json()
+                CACHE.put(query, data, OVERPASS_URL)
+                return data
             elif resp.status_code == 429:
                 print(f"  [rate limit] waiting {wait}s...", flush=True)
                 time.sleep(wait)
@@ -149,13 +229,55 @@ def name_match_score(osm_name, official_name):
         return 3
     return 1 if overlap > 0 else 0
 
+ROUTE_TYPES = ("train", "subway", "light_rail", "monorail", "tram")
+
+def candidates_from_elements(elements, official_name=None):
+    """
+    Turn Overpass relation elements (out tags) into candidate dicts,
+    keeping only Japanese railway routes. Adds a name score when official_name is given.
+    """
+    candidates = []
+    for e in elements:
+        tags = e.get("tags", {})
+        if tags.get("route") not in ROUTE_TYPES:
+            continue
+        if not is_japan_operator(tags):
+            continue
+        c = {
+            "id": e["id"],
+            "name": tags.get("name", ""),
+            "direction": classify_direction(tags),
+            "tags": tags,
+        }
+        if official_name is not None:
+            c["score"] = name_match_score(tags.get("name", ""), official_name)
+        candidates.append(c)
+    return candidates
+
+def filter_by_name_score(candidates, line_code):
+    """Keep ref-matched candidates whose name score is close to the best one."""
+    print(f"  Found {len(candidates)} candidates by ref={line_code}", flush=True)
+    for c in candidates:
+        print(f"    id={c['id']}  name={c['name']}  dir={c['direction']}  score={c['score']}", flush=True)
+
+    # Filter by name score: keep only those with score >= max_score * 0.8
+    # This ensures '中央線快速'(score=20) excludes '中央線'(score=10) etc.
+    max_score = max(c["score"] for c in candidates)
+    if max_score >= 3:
+        threshold = max(3, max_score * 0.8)
+        filtered = [c for c in candidates if c["score"] >= threshold]
+        if filtered:
+            print(f"  After name filter: {len(filtered)} candidates (max_score={max_score}, threshold={threshold})", flush=True)
+            return filtered
+    return candidates
+
 def find_relation_candidates(line_code, official_name, operator_hint=""):
     """
     Find OSM relation IDs for this line.
     Returns a list of dicts: {id, name, direction, tags}
     Applies name-based filtering to avoid mixing unrelated lines that share ref codes.
     """
-    route_types = "train|subway|light_rail|monorail|tram"
+    route_types = "|".join(ROUTE_TYPES)
 
     # Strategy 1: ref code + Japan operator
     query = f"""
@@ -164,65 +286,27 @@ relation["ref"="{line_code}"]["route"~"{route_types}"];
 out tags;
 """
     data = overpass_query(query)
-    time.sleep(3)
+    polite_sleep(3)
 
     candidates = []
     if data:
-        for e in data.get("elements", []):
-            tags = e.get("tags", {})
-            if tags.get("route") not in ("train", "subway", "light_rail", "monorail", "tram"):
-                continue
-            if not is_japan_operator(tags):
-                continue
-            direction = classify_direction(tags)
-            candidates.append({
-                "id": e["id"],
-                "name": tags.get("name", ""),
-                "direction": direction,
-                "tags": tags,
-                "score": name_match_score(tags.get("name", ""), official_name)
-            })
+        candidates = candidates_from_elements(data.get("elements", []), official_name)
 
     if candidates:
-        print(f"  Found {len(candidates)} candidates by ref={line_code}", flush=True)
-        for c in candidates:
-            print(f"    id={c['id']}  name={c['name']}  dir={c['direction']}  score={c['score']}", flush=True)
-
-        # Filter by name score: keep only those with score >= max_score * 0.8
-        # This ensures '中央線快速'(score=20) excludes '中央線'(score=10) etc.
-        max_score = max(c["score"] for c in candidates)
-        if max_score >= 3:
-            threshold = max(3, max_score * 0.8)
-            filtered = [c for c in candidates if c["score"] >= threshold]
-            if filtered:
-                print(f"  After name filter: {len(filtered)} candidates (max_score={max_score}, threshold={threshold})", flush=True)
-                return filtered
-        return candidates
+        return filter_by_name_score(candidates, line_code)
 
     # Strategy 2: fallback by name search
     print(f"  ref={line_code} found nothing, trying name search...", flush=True)
-    for name_variant in [official_name, official_name.replace("線", "")]:
+    for name_variant in name_variants(official_name):
         query = f"""
 [out:json][timeout:60];
 relation["name"~"{name_variant}"]["route"~"{route_types}"];
 out tags;
 """
         data = overpass_query(query)
-        time.sleep(3)
+        polite_sleep(3)
         if data:
-            for e in data.get("elements", []):
-                tags = e.get("tags", {})
-                if tags.get("route") not in ("train", "subway", "light_rail", "monorail", "tram"):
-                    continue
-                if not is_japan_operator(tags):
-                    continue
-                direction = classify_direction(tags)
-                candidates.append({
-                    "id": e["id"],
-                    "name": tags.get("name", ""),
-                    "direction": direction,
-                    "tags": tags
-                })
+            candidates.extend(candidates_from_elements(data.get("elements", [])))
         if candidates:
             break
 
@@ -231,11 +315,30 @@ out tags;
         print(f"    id={c['id']}  name={c['name']}  dir={c['direction']}", flush=True)
     return candidates
 
-def select_direction_pair(candidates, official_name):
+def name_variants(official_name):
+    """Name search fallbacks, in the order they are tried."""
+    return [official_name, official_name.replace("線", "")]
+
+def up_pair_name(candidates):
+    """
+    If only a down relation was found, return the name its up pair should have
+    (下り→上り), else None.
+    """
+    downs = [c for c in candidates if c["direction"] == "down"]
+    ups   = [c for c in candidates if c["direction"] == "up"]
+    if not downs or ups:
+        return None
+    down_name = downs[0]["name"]
+    up_name = down_name.replace("下り", "上り").replace("（下り）", "（上り）")
+    return up_name if up_name != down_name else None
+
+def select_direction_pair(candidates, official_name, up_pairs=None):
     """
     From a list of candidates, select the best up/down (or outer/inner) pair.
     Returns (rel_id_a, rel_id_b) — two IDs for double track.
     Falls back to single relation if only one is found.
+    up_pairs: optional {up_name: rel_id} prefetched by the batch driver; when given,
+    no extra Overpass query is made for a missing up relation.
     """
     # Separate by direction
     downs  = [c for c in candidates if c["direction"] == "down"]
@@ -257,17 +360,20 @@ def select_direction_pair(candidates, official_name):
     # Only one direction found — try to find the pair by name pattern
     if downs and not ups:
         # Try to find the up relation by replacing 下り→上り in name
-        down_name = downs[0]["name"]
-        up_name = down_name.replace("下り", "上り").replace("（下り）", "（上り）")
-        if up_name != down_name:
+        up_name = up_pair_name(candidates)
+        if up_name and up_pairs is not None:
+            if up_name in up_pairs:
+                print(f"  Found up pair: id={up_pairs[up_name]}", flush=True)
+                return downs[0]["id"], up_pairs[up_name]
+        elif up_name:
             print(f"  Only down found, searching for up: {up_name}", flush=True)
             query = f"""
 [out:json][timeout:60];
 relation["name"="{up_name}"]["route"~"train|subway|light_rail|monorail|tram"];
 out tags;
 """
-            data = overpass_query(query)
-            time.sleep(3)
+            data = overpass_query(query, priority=PRIO_GEOM)
+            polite_sleep(3)
             if data:
                 for e in data.get("elements", []):
                     tags = e.get("tags", {})
@@ -288,16 +394,40 @@ out tags;
 
     return None, None
 
-def fetch_relation_geom(rel_id):
-    """Fetch full geometry (ways with coordinates) for a relation."""
+def fetch_relation_geom(rel_id, fresh=False):
+    """Fetch full geometry (ways with coordinates) for a relation, with its version."""
     query = f"""
 [out:json][timeout:120];
 relation({rel_id});
-out geom qt;
+out meta geom qt;
 """
-    return overpass_query(query)
+    return overpass_query(query, priority=PRIO_GEOM, fresh=fresh, stream=True)
 
-def fetch_relation_stops(rel_id):
+def fetch_relation_versions(rel_ids, chunk=200):
+    """
+    Current OSM versions of relations, {rel_id: version}, from `out meta` only
+    (no geometry). Relations missing from the answer were deleted.
+    Returns None if Overpass could not be asked (offline / failed query).
+    """
+    versions = {}
+    ids = sorted(set(rel_ids))
+    for i in range(0, len(ids), chunk):
+        id_list = ",".join(str(x) for x in ids[i:i + chunk])
+        query = f"""
+[out:json][timeout:60];
+relation(id:{id_list});
+out meta;
+"""
+        data = overpass_query(query, priority=PRIO_GEOM, fresh=True)
+        if data is None:
+            return None
+        for e in data.get("elements", []):
+            if e.get("type") == "relation":
+                versions[e["id"]] = e.get("version")
+        polite_sleep(3)
+    return versions
+
+def fetch_relation_stops(rel_id, fresh=False):
     """Fetch stop nodes with full tags for a relation."""
     # Try role=stop first
     query = f"""
@@ -306,11 +436,11 @@ relation({rel_id});
 node(r:"stop");
 out body;
 """
-    data = overpass_query(query)
+    data = overpass_query(query, priority=PRIO_STOPS, fresh=fresh)
     if data and data.get("elements"):
         return data["elements"]
 
-    time.sleep(3)
+    polite_sleep(3)
     # Try stop_entry_only
     query = f"""
 [out:json][timeout:60];
@@ -318,17 +448,22 @@ relation({rel_id});
 node(r:"stop_entry_only");
 out body;
 """
-    data = overpass_query(query)
+    data = overpass_query(query, priority=PRIO_STOPS, fresh=fresh)
     if data and data.get("elements"):
         return data["elements"]
 
     return []
 
-def extract_track_coords(data):
+def extract_track_coords(data, report=None):
     """
-    Extract ordered way coordinates from relation geom response.
-    Ways are chained in order: each way's end point connects to the next way's start.
-    If a way is reversed, its coordinates are flipped.
+    Extract ordered way coordinates from relation geom response (plain or the
+    streamed compact form, where way members carry a "coords" array).
+    Ways are chained through an endpoint index (see track_chain.py): each way's end
+    point connects to the next way's start, reversed ways are flipped, and
+    disconnected pieces become separate chains ordered nearest-end-first; short
+    gaps are bridged, long ones split the track.
+    Returns the track parts (lists of [lon, lat]), [] if there are no ways.
+    If report (dict) is given it receives chain / gap counts and gap lengths per part.
     """
     for el in data.get("elements", []):
         if el.get("type") != "relation":
@@ -342,6 +477,10 @@ def extract_track_coords(data):
             if role in ("platform", "platform_entry_only", "platform_exit_only",
                         "stop_area", "hail_and_ride", "forward", "backward"):
                 continue
+            if "coords" in member:
+                if len(member["coords"]):
+                    ways.append(member["coords"])
+                continue
             geom = member.get("geometry", [])
             if geom:
                 pts = [[pt["lon"], pt["lat"]] for pt in geom]
@@ -349,38 +488,10 @@ def extract_track_coords(data):
         if not ways:
             return []
 
-        # Chain ways by matching endpoints
-        def pt_eq(a, b, tol=1e-6):
-            return abs(a[0]-b[0]) < tol and abs(a[1]-b[1]) < tol
-
-        chained = [ways[0][:]]
-        remaining = ways[1:]
-        max_iter = len(remaining) * 2 + 1
-        itr = 0
-        while remaining and itr < max_iter:
-            itr += 1
-            tail = chained[-1][-1]
-            matched = False
-            for i, w in enumerate(remaining):
-                if pt_eq(tail, w[0]):
-                    chained.append(w[:])
-                    remaining.pop(i)
-                    matched = True
-                    break
-                elif pt_eq(tail, w[-1]):
-                    chained.append(list(reversed(w)))
-                    remaining.pop(i)
-                    matched = True
-                    break
-            if not matched:
-                # Gap in chain — just append remaining in order
-                chained.append(remaining.pop(0))
-
-        coords = []
-        for i, w in enumerate(chained):
-            start = 1 if i > 0 else 0  # skip duplicate junction point
-            coords.extend(w[start:])
-        return coords
+        parts, chain_info = chain_track(ways)
+        if report is not None:
+            report.update(chain_info)
+        return [p.tolist() if hasattr(p, "tolist") else p for p in parts]
     return []
 
 def extract_stops_from_geom(data):
@@ -419,56 +530,56 @@ def parse_stop_nodes(nodes):
         stops.append({"name": name, "lon": node["lon"], "lat": node["lat"]})
     return stops
 
+def relation_record(rel_id, geom_data, stops):
+    """
+    What result_{slug}.json keeps about one relation for incremental refresh:
+    its id, the OSM version/timestamp the geometry was built from, and the names
+    of the stops it contributed.
+    """
+    rel = {}
+    for el in (geom_data or {}).get("elements", []):
+        if el.get("type") == "relation" and el.get("id") == rel_id:
+            rel = el
+            break
+    return {
+        "id": rel_id,
+        "version": rel.get("version"),
+        "timestamp": rel.get("timestamp"),
+        "stops": [s["name"] for s in stops],
+    }
+
 def sort_stations_along_track(stations, track_coords):
     """
     Sort stations by projecting each station onto the nearest point on the track,
     then ordering by cumulative distance along the track from the start.
     This correctly handles diagonal and curved lines.
+
+    All stations are projected in one batch (track_projection.TrackProjector).
+    Each station gets "track_offset_m", its perpendicular distance to the track.
     """
     if not track_coords or not stations:
         return stations
 
-    def dist2(ax, ay, bx, by):
-        dx = ax - bx; dy = ay - by
-        return dx*dx + dy*dy
-
-    def project_onto_track(lon, lat, track):
-        """Return cumulative distance along track to the nearest projected point."""
-        best_t = 0.0
-        best_dist2 = float('inf')
-        cum = 0.0
-        best_cum = 0.0
-        for i in range(len(track) - 1):
-            ax, ay = track[i][0], track[i][1]
-            bx, by = track[i+1][0], track[i+1][1]
-            seg_len2 = dist2(ax, ay, bx, by)
-            if seg_len2 == 0:
-                t = 0.0
-            else:
-                t = ((lon - ax) * (bx - ax) + (lat - ay) * (by - ay)) / seg_len2
-                t = max(0.0, min(1.0, t))
-            px = ax + t * (bx - ax)
-            py = ay + t * (by - ay)
-            d2 = dist2(lon, lat, px, py)
-            seg_len = seg_len2 ** 0.5
-            if d2 < best_dist2:
-                best_dist2 = d2
-                best_cum = cum + t * seg_len
-            cum += seg_len
-        return best_cum
-
-    for s in stations:
-        s["_track_pos"] = project_onto_track(s["lon"], s["lat"], track_coords)
+    chain, offset, _ = project_points([(s["lon"], s["lat"]) for s in stations], track_coords)
+    for s, c, d in zip(stations, chain, offset):
+        s["_track_pos"] = float(c)
+        s["track_offset_m"] = round(float(d), 1)
 
     stations.sort(key=lambda s: s["_track_pos"])
     for s in stations:
         s.pop("_track_pos", None)
     return stations
 
+def far_off_track_stations(stations, max_offset_m=STATION_OFFSET_WARN_M):
+    """Stations whose projection onto the track is further than max_offset_m."""
+    return [{"name": s["name"], "offset_m": s["track_offset_m"]}
+            for s in stations if s.get("track_offset_m", 0.0) > max_offset_m]
+
 def build_line_geojson(row, coords_list):
     """
     Build line GeoJSON with GeometryCollection.
-    coords_list: list of coordinate arrays (one per direction).
+    coords_list: track parts per direction; a direction is a LineString, or a
+    MultiLineString where the track has a gap too long to bridge.
     """
     props = {
         "type": "relation",
@@ -489,10 +600,7 @@ def build_line_geojson(row, coords_list):
         "line_code": row["line_code"],
         "railway": row["railway"]
     }
-    geometries = [
-        {"type": "LineString", "coordinates": c}
-        for c in coords_list if c
-    ]
+    geometries = [parts_geometry(c) for c in coords_list if c]
     return {
         "type": "FeatureCollection",
         "name": row["line_slug"],
@@ -538,116 +646,71 @@ def build_stations_geojson(row, stations):
         "features": features
     }
 
-def main():
-    if len(sys.argv) < 4:
-        print("Usage: fetch_line_v2.py <route_id> <csv_path> <output_dir> [--force]")
-        sys.exit(1)
-
-    route_id = sys.argv[1]
-    csv_path = sys.argv[2]
-    output_dir = sys.argv[3]
-    force = "--force" in sys.argv
-
-    rows = {}
-    with open(csv_path, encoding="utf-8-sig") as f:
-        reader = csv.DictReader(f)
-        for r in reader:
-            rows[r["route_id"]] = r
-
-    if route_id not in rows:
-        print(f"route_id {route_id} not found in CSV")
-        sys.exit(1)
-
-    row = rows[route_id]
-    slug = row["line_slug"]
-    line_code = row["line_code"]
-    print(f"\n[{route_id}] {row['official_name']} ({slug}, code={line_code})", flush=True)
-
-    lines_dir = os.path.join(output_dir, "lines")
-    stations_dir = os.path.join(output_dir, "stations")
-    os.makedirs(lines_dir, exist_ok=True)
-    os.makedirs(stations_dir, exist_ok=True)
-
-    line_path = os.path.join(lines_dir, f"{slug}.geojson")
-    stations_path = os.path.join(stations_dir, f"{slug}_stations.geojson")
-
-    # Skip if already exists and not forced
-    if not force and os.path.exists(line_path) and os.path.exists(stations_path):
-        with open(stations_path) as f:
-            sdata = json.load(f)
-        if sdata.get("features"):
-            n = len(sdata["features"])
-            print(f"  Already exists ({n} stations). Use --force to overwrite.", flush=True)
-            sys.exit(0)
-
-    # Step 1: Find candidates
-    print(f"  Searching OSM for ref={line_code}...", flush=True)
-    candidates = find_relation_candidates(line_code, row["official_name"], row["operator"])
-
-    if not candidates:
-        print(f"  WARNING: No relations found. Writing empty files.", flush=True)
-        line_geojson = build_line_geojson(row, [])
-        stations_geojson = build_stations_geojson(row, [])
-        with open(line_path, "w", encoding="utf-8") as f:
-            json.dump(line_geojson, f, ensure_ascii=False, separators=(",", ": "))
-        with open(stations_path, "w", encoding="utf-8") as f:
-            json.dump(stations_geojson, f, ensure_ascii=False, separators=(",", ": "))
-        print(f"  Written empty files.", flush=True)
-        sys.exit(0)
-
-    # Step 2: Select direction pair (up + down, or outer + inner)
-    rel_a, rel_b = select_direction_pair(candidates, row["official_name"])
-    print(f"  Selected: rel_a={rel_a}, rel_b={rel_b}", flush=True)
-
-    if not rel_a:
-        print(f"  WARNING: Could not determine primary relation.", flush=True)
-        sys.exit(1)
-
-    # Step 3: Fetch geometry and stops for each relation
-    coords_a, coords_b = [], []
+def merge_stops(*stop_lists):
+    """Concatenate stop lists, dropping later duplicates by name."""
     all_stops = []
     seen_stop_names = set()
-
-    def fetch_and_collect(rel_id, label):
-        """Fetch geom + stops for one relation, return (coords, stops)."""
-        time.sleep(3)
-        print(f"  [{label}] Fetching geom for relation {rel_id}...", flush=True)
-        geom_data = fetch_relation_geom(rel_id)
-        coords = []
-        stops = []
-        if geom_data:
-            coords = extract_track_coords(geom_data)
-            # Try to get stop names from geom (may be empty)
-            stops = [s for s in extract_stops_from_geom(geom_data) if s["name"]]
-
-        if not stops:
-            time.sleep(3)
-            print(f"  [{label}] Fetching stops for relation {rel_id}...", flush=True)
-            stop_nodes = fetch_relation_stops(rel_id)
-            stops = parse_stop_nodes(stop_nodes)
-
-        print(f"  [{label}] {len(coords)} track pts, {len(stops)} stops", flush=True)
-        return coords, stops
-
-    coords_a, stops_a = fetch_and_collect(rel_a, "dir-A")
-    for s in stops_a:
-        if s["name"] not in seen_stop_names:
-            seen_stop_names.add(s["name"])
-            all_stops.append(s)
-
-    if rel_b:
-        coords_b, stops_b = fetch_and_collect(rel_b, "dir-B")
-        for s in stops_b:
+    for stops in stop_lists:
+        for s in stops:
             if s["name"] not in seen_stop_names:
                 seen_stop_names.add(s["name"])
                 all_stops.append(s)
+    return all_stops
+
+def route_output_paths(output_dir, slug):
+    """Return (line_path, stations_path), creating the lines/ and stations/ dirs."""
+    lines_dir = os.path.join(output_dir, "lines")
+    stations_dir = os.path.join(output_dir, "stations")
+    os.makedirs(lines_dir, exist_ok=True)
+    os.makedirs(stations_dir, exist_ok=True)
+    return (os.path.join(lines_dir, f"{slug}.geojson"),
+            os.path.join(stations_dir, f"{slug}_stations.geojson"))
+
+def has_existing_output(output_dir, slug):
+    """True if both files exist and the stations file already has features."""
+    line_path, stations_path = route_output_paths(output_dir, slug)
+    if not (os.path.exists(line_path) and os.path.exists(stations_path)):
+        return False
+    with open(stations_path) as f:
+        sdata = json.load(f)
+    return bool(sdata.get("features"))
+
+def write_geojson(path, data):
+    """Write one GeoJSON output (and its .gdpk with --pack)."""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ": "))
+    if PACK:
+        write_pack(data, pack_path(path))
+
+def write_empty_outputs(row, output_dir):
+    """Write line/stations GeoJSON with no geometry (route not found in OSM)."""
+    line_path, stations_path = route_output_paths(output_dir, row["line_slug"])
+    write_geojson(line_path, build_line_geojson(row, []))
+    write_geojson(stations_path, build_stations_geojson(row, []))
+    print(f"  Written empty files.", flush=True)
+
+def write_route_outputs(row, output_dir, coords_a, coords_b, all_stops, extra=None,
+                        relations=None):
+    """
+    Sort stations along the track, write line/stations GeoJSON and result_{slug}.json.
+    extra: optional fields merged into the result (e.g. chaining reports).
+    relations: optional {"dir-A": relation_record(), "dir-B": ...}; stored with the
+    index of each direction's LineString so --refresh can reuse unchanged ones.
+    Returns the result dict.
+    """
+    slug = row["line_slug"]
+    line_path, stations_path = route_output_paths(output_dir, slug)
 
     # Step 4: Sort stations by projecting onto the track geometry
     # This handles diagonal/curved lines correctly (e.g. Hibiya line)
     # Use coords_b (down direction) if available, otherwise coords_a
-    sort_track = coords_b if coords_b else coords_a
+    sort_track = flatten_parts(coords_b if coords_b else coords_a)
+    far_stations = []
     if all_stops and sort_track:
         all_stops = sort_stations_along_track(all_stops, sort_track)
+        far_stations = far_off_track_stations(all_stops)
+        for fs in far_stations:
+            print(f"  WARNING: station {fs['name']} is {fs['offset_m']:.0f} m off the track", flush=True)
 
     # Step 5: Build GeoJSON
     coords_list = [c for c in [coords_a, coords_b] if c]
@@ -655,30 +718,291 @@ def main():
     stations_geojson = build_stations_geojson(row, all_stops)
 
     # Step 6: Write files
-    with open(line_path, "w", encoding="utf-8") as f:
-        json.dump(line_geojson, f, ensure_ascii=False, separators=(",", ": "))
+    write_geojson(line_path, line_geojson)
     print(f"  Written: {line_path}", flush=True)
 
-    with open(stations_path, "w", encoding="utf-8") as f:
-        json.dump(stations_geojson, f, ensure_ascii=False, separators=(",", ": "))
+    write_geojson(stations_path, stations_geojson)
     print(f"  Written: {stations_path}", flush=True)
 
     # Summary
-    total_pts = sum(len(c) for c in coords_list)
+    total_pts = sum(len(p) for c in coords_list for p in c)
     n_geoms = len(coords_list)
     result = {
-        "route_id": route_id,
+        "route_id": row["route_id"],
         "slug": slug,
         "name": row["official_name"],
         "geometries": n_geoms,
         "track_points": total_pts,
         "station_count": len(all_stops),
-        "status": "ok" if all_stops else "empty"
+        "status": "ok" if all_stops else "empty",
+        "far_stations": far_stations,
+        "cache": dict(CACHE.stats),
     }
+    if extra:
+        result.update(extra)
+    if relations:
+        idx = 0
+        for label, coords in (("dir-A", coords_a), ("dir-B", coords_b)):
+            if label in relations:
+                relations[label]["line_index"] = idx if coords else None
+            if coords:
+                idx += 1
+        result["relations"] = relations
     result_path = os.path.join(output_dir, f"result_{slug}.json")
     with open(result_path, "w") as f:
         json.dump(result, f)
-    print(f"\n  ✓ Done: {n_geoms} LineStrings, {total_pts} track pts, {len(all_stops)} stations", flush=True)
+    print(f"\n  ✓ Done: {n_geoms} geometries, {total_pts} track pts, {len(all_stops)} stations", flush=True)
+    return result
+
+def fetch_route(row, output_dir, force=False):
+    """Fetch and write one route. Returns a process exit code (0 = ok / skipped)."""
+    route_id = row["route_id"]
+    slug = row["line_slug"]
+    line_code = row["line_code"]
+    print(f"\n[{route_id}] {row['official_name']} ({slug}, code={line_code})", flush=True)
+
+    # Skip if already exists and not forced
+    if not force and has_existing_output(output_dir, slug):
+        print(f"  Already exists. Use --force to overwrite.", flush=True)
+        return 0
+
+    # Step 1: Find candidates
+    reset_offline_misses()
+    print(f"  Searching OSM for ref={line_code}...", flush=True)
+    candidates = find_relation_candidates(line_code, row["official_name"], row["operator"])
+
+    if not candidates and CACHE.offline:
+        # A cache miss in replay mode says nothing about OSM; keep existing files
+        print(f"  WARNING: No cached candidates (offline). Nothing written.", flush=True)
+        return 1
+
+    if not candidates:
+        print(f"  WARNING: No relations found. Writing empty files.", flush=True)
+        write_empty_outputs(row, output_dir)
+        return 0
+
+    # Step 2: Select direction pair (up + down, or outer + inner)
+    rel_a, rel_b = select_direction_pair(candidates, row["official_name"])
+    print(f"  Selected: rel_a={rel_a}, rel_b={rel_b}", flush=True)
+
+    if not rel_a:
+        print(f"  WARNING: Could not determine primary relation.", flush=True)
+        return 1
+
+    # Step 3: Fetch geometry and stops for each relation
+    chain_reports = {}
+    coords_a, stops_a, rec_a = fetch_relation_data(rel_a, "dir-A", chain_reports)
+    relations = {"dir-A": rec_a}
+    coords_b, stops_b = [], []
+    if rel_b:
+        coords_b, stops_b, relations["dir-B"] = fetch_relation_data(rel_b, "dir-B", chain_reports)
+
+    if offline_gap():
+        return 1
+    write_route_outputs(row, output_dir, coords_a, coords_b, merge_stops(stops_a, stops_b),
+                        extra={"chaining": chain_reports}, relations=relations)
+    return 0
+
+def offline_gap():
+    """True (with a warning) if any offline lookup of the current route missed the cache."""
+    n = offline_misses()
+    if n:
+        # geometry / stops missing from the cache would write empty or partial files
+        print(f"  WARNING: {n} queries not in the cache (offline). Nothing written.", flush=True)
+    return n > 0
+
+def fetch_relation_data(rel_id, label, chain_reports, fresh=False):
+    """Fetch geom + stops for one relation, return (coords, stops, relation_record)."""
+    polite_sleep(3)
+    print(f"  [{label}] Fetching geom for relation {rel_id}...", flush=True)
+    geom_data = fetch_relation_geom(rel_id, fresh=fresh)
+    coords = []
+    stops = []
+    if geom_data:
+        coords = extract_track_coords(geom_data, chain_reports.setdefault(label, {}))
+        # Try to get stop names from geom (may be empty)
+        stops = [s for s in extract_stops_from_geom(geom_data) if s["name"]]
+
+    if not stops:
+        polite_sleep(3)
+        print(f"  [{label}] Fetching stops for relation {rel_id}...", flush=True)
+        stop_nodes = fetch_relation_stops(rel_id, fresh=fresh)
+        stops = parse_stop_nodes(stop_nodes)
+
+    print(f"  [{label}] {sum(len(p) for p in coords)} track pts, {len(stops)} stops", flush=True)
+    rep = chain_reports.get(label)
+    if rep and (rep.get("gaps") or rep.get("split_gaps_m")):
+        print(f"  [{label}] {rep['chains']} chains -> {rep['parts']} parts, bridged gaps per part: "
+              f"{rep['gap_lengths_m']} m, split at: {rep['split_gaps_m']} m", flush=True)
+    return coords, stops, relation_record(rel_id, geom_data, stops)
+
+def load_result(output_dir, slug):
+    """Previously written result_{slug}.json, or None."""
+    path = os.path.join(output_dir, f"result_{slug}.json")
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except ValueError:
+        return None
+
+def relation_ids_to_check(rows, output_dir):
+    """Relation ids stored in the result files of the given routes."""
+    ids = []
+    for row in rows:
+        result = load_result(output_dir, row["line_slug"]) or {}
+        ids.extend(rec["id"] for rec in result.get("relations", {}).values())
+    return ids
+
+def refresh_route(row, output_dir, versions):
+    """
+    Incremental refresh of one route against current OSM relation versions
+    ({rel_id: version} from fetch_relation_versions()).
+      - all stored versions current:  nothing is downloaded
+      - some relations changed:       only those are re-downloaded; the other
+                                      direction's LineString and stops are reused
+      - relation deleted / no stored versions / no output yet:  full fetch
+    Returns a process exit code.
+    """
+    slug = row["line_slug"]
+    result = load_result(output_dir, slug) or {}
+    relations = result.get("relations")
+    if not relations or not has_existing_output(output_dir, slug):
+        print(f"\n[{row['route_id']}] no stored relation versions, full fetch", flush=True)
+        return fetch_route(row, output_dir, force=True)
+    if any(rec["id"] not in versions for rec in relations.values()):
+        print(f"\n[{row['route_id']}] relation no longer in OSM, full fetch", flush=True)
+        return fetch_route(row, output_dir, force=True)
+
+    changed = [label for label, rec in relations.items()
+               if rec.get("version") is None or versions[rec["id"]] != rec["version"]]
+    if not changed:
+        print(f"[{row['route_id']}] {row['official_name']}: up to date "
+              + ", ".join(f"{rec['id']}@v{rec['version']}" for rec in relations.values()), flush=True)
+        return 0
+
+    print(f"\n[{row['route_id']}] {row['official_name']}: changed "
+          + ", ".join(f"{relations[l]['id']} v{relations[l]['version']}->v{versions[relations[l]['id']]}"
+                      for l in changed), flush=True)
+    line_path, stations_path = route_output_paths(output_dir, slug)
+    with open(line_path, encoding="utf-8") as f:
+        geoms = json.load(f)["features"][0]["geometry"]["geometries"]
+    with open(stations_path, encoding="utf-8") as f:
+        old_stations = {ft["properties"]["name"]: ft["geometry"]["coordinates"]
+                        for ft in json.load(f)["features"]}
+
+    chain_reports = result.get("chaining", {})
+    coords = {}
+    stops = {}
+    reset_offline_misses()
+    for label, rec in relations.items():
+        if label in changed:
+            coords[label], stops[label], relations[label] = fetch_relation_data(
+                rec["id"], label, chain_reports, fresh=True)
+        else:
+            idx = rec.get("line_index")
+            coords[label] = geometry_parts(geoms[idx]) if idx is not None else []
+            stops[label] = [{"name": n, "lon": old_stations[n][0], "lat": old_stations[n][1]}
+                            for n in rec["stops"] if n in old_stations]
+
+    if offline_gap():
+        return 1
+    write_route_outputs(row, output_dir, coords.get("dir-A", []), coords.get("dir-B", []),
+                        merge_stops(stops.get("dir-A", []), stops.get("dir-B", [])),
+                        extra={"chaining": chain_reports}, relations=relations)
+    return 0
+
+def fetch_routes_concurrently(rows, output_dir, force, concurrency, rate, versions=None):
+    """
+    Run fetch_route() for many routes in worker threads while a single asyncio
+    scheduler keeps up to `concurrency` Overpass queries in flight.
+    Stop-node follow-ups are served before new candidate searches.
+    versions: run refresh_route() against these relation versions instead.
+    """
+    global SCHEDULER
+    SCHEDULER = OverpassScheduler(OVERPASS_URL, headers=HEADERS, concurrency=concurrency,
+                                  rate=rate, burst=concurrency, cache=CACHE).start()
+    def run(row):
+        try:
+            if versions is not None:
+                return refresh_route(row, output_dir, versions)
+            return fetch_route(row, output_dir, force)
+        except Exception as e:  # one broken route must not stop the others
+            print(f"  [{row['route_id']}] ERROR: {type(e).__name__}: {e}", flush=True)
+            return 1
+
+    try:
+        # more route threads than query slots, so the priority queue has a choice
+        with ThreadPoolExecutor(max_workers=max(2, concurrency * 2)) as pool:
+            codes = list(pool.map(run, rows))
+    finally:
+        SCHEDULER.stop()
+        print(f"\n  {SCHEDULER.summary()}", flush=True)
+        SCHEDULER = None
+    for r, code in zip(rows, codes):
+        if code:
+            print(f"  FAILED: {r['route_id']} {r['official_name']}", flush=True)
+    return max(codes) if codes else 0
+
+def main():
+    global CACHE, PACK
+    if len(sys.argv) < 4:
+        print("Usage: fetch_line_v2.py <route_id> <csv_path> <output_dir> [--force] [--refresh] [--offline] [--no-cache] [--concurrency N] [--pack]")
+        sys.exit(1)
+
+    def opt(name, default):
+        if name in sys.argv:
+            i = sys.argv.index(name)
+            if i + 1 < len(sys.argv):
+                return sys.argv[i + 1]
+        return default
+
+    route_arg = sys.argv[1]
+    csv_path = sys.argv[2]
+    output_dir = sys.argv[3]
+    force = "--force" in sys.argv
+    refresh = "--refresh" in sys.argv
+    PACK = "--pack" in sys.argv
+    concurrency = int(opt("--concurrency", 0))
+    rate = float(opt("--rate", 1.0))
+    CACHE = cache_from_argv(sys.argv)
+
+    rows = {}
+    with open(csv_path, encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        for r in reader:
+            rows[r["route_id"]] = r
+
+    route_ids = list(rows) if route_arg == "all" else [x for x in route_arg.split(",") if x]
+    for route_id in route_ids:
+        if route_id not in rows:
+            print(f"route_id {route_id} not found in CSV")
+            sys.exit(1)
+
+    versions = None
+    if refresh:
+        # One cheap `out meta` round for every stored relation, before any geometry
+        check = relation_ids_to_check([rows[i] for i in route_ids], output_dir)
+        print(f"Checking versions of {len(check)} relations...", flush=True)
+        versions = fetch_relation_versions(check)
+        if versions is None:
+            print("Could not fetch relation versions (offline or Overpass failure).", flush=True)
+            sys.exit(1)
+
+    if concurrency > 0:
+        code = fetch_routes_concurrently([rows[i] for i in route_ids], output_dir, force,
+                                         concurrency, rate, versions=versions)
+    else:
+        code = 0
+        for route_id in route_ids:
+            if versions is not None:
+                code = max(code, refresh_route(rows[route_id], output_dir, versions))
+            else:
+                code = max(code, fetch_route(rows[route_id], output_dir, force))
+    print(f"  {CACHE.summary()}", flush=True)
+    sys.exit(code)
+
 
 if __name__ == "__main__":
     main()
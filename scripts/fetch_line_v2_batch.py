@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+fetch_line_v2_batch.py — Fetch many routes from the route master in a few Overpass calls.
+
+Replaces running fetch_line_v2.py once per route_id. The route-master CSV is read
+once and the per-route round trips are grouped into union queries:
+
+  1. candidates   relation["ref"~"^(A|B|C)$"]      one query per --ref-chunk line codes
+                  relation["name"~"X|Y"]           name fallback for codes with no hit
+  2. up pairs     relation["name"~"^(..上り..)$"]    one query for every "down only" route
+  3. geometry     relation(id:...) out meta geom    one query per --rel-chunk relations,
+                  + node(r:"stop") out body         stop nodes with tags in the same pass
+
+Candidate filtering, direction pairing, station sorting and the written files
+(lines/, stations/, result_{slug}.json) are exactly those of fetch_line_v2.py, including
+the relation versions used by `fetch_line_v2.py all ... --refresh`.
+
+Usage:
+  python3 fetch_line_v2_batch.py <csv_path> <output_dir> [--routes ID,ID,...] [--force]
+                                 [--ref-chunk 40] [--rel-chunk 12] [--pack] [cache options]
+"""
+
+import argparse
+import csv
+import os
+import sys
+
+import fetch_line_v2 as fl
+from overpass_cache import (OverpassCache, DEFAULT_CACHE_DIR, DEFAULT_TTL_HOURS,
+                            DEFAULT_MAX_MB)
+
+ROUTE_TYPES_RE = "|".join(fl.ROUTE_TYPES)
+
+# Counts Overpass calls issued by this run (cache hits included)
+QUERY_COUNT = 0
+
+
+def chunked(seq, n):
+    for i in range(0, len(seq), n):
+        yield seq[i:i + n]
+
+
+def ql_regex_alt(values):
+    """Join literal values into an Overpass regex alternation, escaping metacharacters."""
+    out = []
+    for v in values:
+        esc = ""
+        for ch in v:
+            if ch in "\\.^$|?*+()[]{}":
+                esc += "\\\\" + ch  # one backslash for QL string, one for the regex
+            elif ch == '"':
+                esc += '\\"'
+            else:
+                esc += ch
+        out.append(esc)
+    return "|".join(out)
+
+
+def run_query(query, stream=False):
+    global QUERY_COUNT
+    QUERY_COUNT += 1
+    data = fl.overpass_query(query, stream=stream)
+    fl.polite_sleep(3)
+    return data
+
+
+# ---------------- Step 1: candidates ----------------
+def fetch_candidates_batch(rows, ref_chunk):
+    """Return {route_id: candidates} using union ref queries, then union name queries."""
+    by_ref = {}
+    codes = sorted({r["line_code"] for r in rows if r["line_code"]})
+    for chunk in chunked(codes, ref_chunk):
+        print(f"  [candidates] ref~{len(chunk)} codes...", flush=True)
+        query = f"""
+[out:json][timeout:180];
+relation["ref"~"^({ql_regex_alt(chunk)})$"]["route"~"{ROUTE_TYPES_RE}"];
+out tags;
+"""
+        data = run_query(query)
+        for e in (data or {}).get("elements", []):
+            by_ref.setdefault(e.get("tags", {}).get("ref", ""), []).append(e)
+
+    result = {}
+    missing = []
+    for r in rows:
+        print(f"\n[{r['route_id']}] {r['official_name']} ({r['line_slug']}, code={r['line_code']})", flush=True)
+        cands = fl.candidates_from_elements(by_ref.get(r["line_code"], []), r["official_name"])
+        if cands:
+            result[r["route_id"]] = fl.filter_by_name_score(cands, r["line_code"])
+        else:
+            print(f"  ref={r['line_code']} found nothing, queued for name search", flush=True)
+            missing.append(r)
+
+    # Strategy 2: name fallback, one union query per chunk of missing routes
+    for chunk in chunked(missing, ref_chunk):
+        variants = sorted({v for r in chunk for v in fl.name_variants(r["official_name"]) if v})
+        print(f"\n  [candidates] name~{len(variants)} variants...", flush=True)
+        query = f"""
+[out:json][timeout:180];
+relation["name"~"{ql_regex_alt(variants)}"]["route"~"{ROUTE_TYPES_RE}"];
+out tags;
+"""
+        data = run_query(query)
+        elements = (data or {}).get("elements", [])
+        for r in chunk:
+            cands = []
+            for v in fl.name_variants(r["official_name"]):
+                hits = [e for e in elements if v and v in e.get("tags", {}).get("name", "")]
+                cands.extend(fl.candidates_from_elements(hits))
+                if cands:
+                    break
+            print(f"  [{r['route_id']}] Found {len(cands)} candidates by name", flush=True)
+            result[r["route_id"]] = cands
+    return result
+
+
+# ---------------- Step 2: direction pairs ----------------
+def fetch_up_pairs_batch(candidates_by_route):
+    """Look up every missing 上り relation in one query. Returns {up_name: rel_id}."""
+    names = sorted({n for n in (fl.up_pair_name(c) for c in candidates_by_route.values()) if n})
+    if not names:
+        return {}
+    print(f"\n  [up pairs] name~{len(names)} names...", flush=True)
+    query = f"""
+[out:json][timeout:120];
+relation["name"~"^({ql_regex_alt(names)})$"]["route"~"{ROUTE_TYPES_RE}"];
+out tags;
+"""
+    data = run_query(query)
+    up_pairs = {}
+    for e in (data or {}).get("elements", []):
+        tags = e.get("tags", {})
+        name = tags.get("name", "")
+        if name in names and name not in up_pairs and fl.is_japan_operator(tags):
+            up_pairs[name] = e["id"]
+    return up_pairs
+
+
+# ---------------- Step 3: geometry + stops ----------------
+def stop_nodes_for(rel, nodes_by_id):
+    """Stop nodes of a relation, as fetch_relation_stops() would return them."""
+    for role in ("stop", "stop_entry_only"):
+        refs = {m["ref"] for m in rel.get("members", [])
+                if m.get("type") == "node" and m.get("role") == role}
+        found = sorted((nodes_by_id[i] for i in refs if i in nodes_by_id), key=lambda n: n["id"])
+        if found:
+            return found
+    return []
+
+
+def fetch_geoms_batch(rel_ids, rel_chunk):
+    """
+    Return ({rel_id: (coords, stops, chain_report, relation_record)}, missed)
+    with one `out meta geom` query per chunk. missed holds the relation ids of
+    chunks whose query was not in the cache (offline).
+    """
+    out = {}
+    missed = set()
+    ids = sorted(set(rel_ids))
+    for n, chunk in enumerate(chunked(ids, rel_chunk), 1):
+        print(f"  [geom] chunk {n}/{(len(ids) + rel_chunk - 1) // rel_chunk} ({len(chunk)} relations)...", flush=True)
+        id_list = ",".join(str(i) for i in chunk)
+        query = f"""
+[out:json][timeout:300];
+relation(id:{id_list})->.r;
+.r out meta geom qt;
+node(r.r:"stop");
+out body;
+node(r.r:"stop_entry_only");
+out body;
+"""
+        fl.reset_offline_misses()
+        data = run_query(query, stream=True)
+        if fl.offline_misses():
+            missed.update(chunk)
+        elements = (data or {}).get("elements", [])
+        nodes_by_id = {e["id"]: e for e in elements if e.get("type") == "node"}
+        for rel in elements:
+            if rel.get("type") != "relation":
+                continue
+            single = {"elements": [rel]}
+            report = {}
+            coords = fl.extract_track_coords(single, report)
+            stops = [s for s in fl.extract_stops_from_geom(single) if s["name"]]
+            if not stops:
+                stops = fl.parse_stop_nodes(stop_nodes_for(rel, nodes_by_id))
+            out[rel["id"]] = (coords, stops, report, fl.relation_record(rel["id"], single, stops))
+    return out, missed
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Batch fetch railway GeoJSON for many routes via union Overpass queries.")
+    ap.add_argument("csv_path", help="Route master CSV")
+    ap.add_argument("output_dir", help="Output root (lines/, stations/, result_*.json)")
+    ap.add_argument("--routes", default="", help="Comma-separated route_ids (default: all rows)")
+    ap.add_argument("--force", action="store_true", help="Overwrite routes that already have data")
+    ap.add_argument("--ref-chunk", type=int, default=40, help="Line codes per candidate query")
+    ap.add_argument("--rel-chunk", type=int, default=12, help="Relations per geometry query")
+    ap.add_argument("--pack", action="store_true", help="Also write a quantized .gdpk next to each GeoJSON")
+    ap.add_argument("--offline", action="store_true", help="Replay from the response cache only")
+    ap.add_argument("--no-cache", action="store_true", help="Bypass the response cache")
+    ap.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    ap.add_argument("--cache-ttl", type=float, default=DEFAULT_TTL_HOURS, help="hours (0 = never expire)")
+    ap.add_argument("--cache-max-mb", type=float, default=DEFAULT_MAX_MB)
+    args = ap.parse_args()
+
+    fl.PACK = args.pack
+    fl.CACHE = OverpassCache(cache_dir=args.cache_dir, ttl_hours=args.cache_ttl,
+                             max_mb=args.cache_max_mb, offline=args.offline,
+                             enabled=not args.no_cache)
+
+    with open(args.csv_path, encoding="utf-8-sig") as f:
+        all_rows = list(csv.DictReader(f))
+
+    wanted = {x.strip() for x in args.routes.split(",") if x.strip()}
+    rows = [r for r in all_rows if not wanted or r["route_id"] in wanted]
+    if wanted - {r["route_id"] for r in rows}:
+        print(f"route_id not found in CSV: {sorted(wanted - {r['route_id'] for r in rows})}")
+        sys.exit(1)
+
+    if not args.force:
+        skipped = [r for r in rows if fl.has_existing_output(args.output_dir, r["line_slug"])]
+        if skipped:
+            print(f"Skipping {len(skipped)} routes with existing data (use --force to overwrite)", flush=True)
+        rows = [r for r in rows if r not in skipped]
+    print(f"Batch: {len(rows)} routes", flush=True)
+
+    summary = []
+    if rows:
+        candidates = fetch_candidates_batch(rows, args.ref_chunk)
+        up_pairs = fetch_up_pairs_batch(candidates)
+
+        pairs = {}
+        for r in rows:
+            cands = candidates.get(r["route_id"], [])
+            if not cands:
+                continue
+            print(f"\n[{r['route_id']}] selecting direction pair", flush=True)
+            pairs[r["route_id"]] = fl.select_direction_pair(cands, r["official_name"], up_pairs=up_pairs)
+            print(f"  Selected: rel_a={pairs[r['route_id']][0]}, rel_b={pairs[r['route_id']][1]}", flush=True)
+
+        print("", flush=True)
+        rel_ids = [rid for ab in pairs.values() for rid in ab if rid]
+        geoms, geoms_missed = fetch_geoms_batch(rel_ids, args.rel_chunk)
+
+        for r in rows:
+            rid = r["route_id"]
+            print(f"\n[{rid}] {r['official_name']}", flush=True)
+            if not candidates.get(rid):
+                if fl.CACHE.offline:
+                    print(f"  WARNING: No cached candidates (offline). Nothing written.", flush=True)
+                    summary.append({"route_id": rid, "slug": r["line_slug"], "status": "offline_miss"})
+                    continue
+                print(f"  WARNING: No relations found. Writing empty files.", flush=True)
+                fl.write_empty_outputs(r, args.output_dir)
+                summary.append({"route_id": rid, "slug": r["line_slug"], "status": "not_found"})
+                continue
+            rel_a, rel_b = pairs[rid]
+            if not rel_a:
+                print(f"  WARNING: Could not determine primary relation.", flush=True)
+                summary.append({"route_id": rid, "slug": r["line_slug"], "status": "no_relation"})
+                continue
+            if geoms_missed & {rel_a, rel_b}:
+                # geometry / stops missing from the cache would write empty or partial files
+                print(f"  WARNING: Geometry query not in the cache (offline). Nothing written.", flush=True)
+                summary.append({"route_id": rid, "slug": r["line_slug"], "status": "offline_miss"})
+                continue
+            missing = ([], [], {}, None)
+            coords_a, stops_a, rep_a, rec_a = geoms.get(rel_a, missing)
+            coords_b, stops_b, rep_b, rec_b = geoms.get(rel_b, missing) if rel_b else missing
+            chaining = {"dir-A": rep_a}
+            relations = {"dir-A": rec_a or fl.relation_record(rel_a, None, stops_a)}
+            if rel_b:
+                chaining["dir-B"] = rep_b
+                relations["dir-B"] = rec_b or fl.relation_record(rel_b, None, stops_b)
+            result = fl.write_route_outputs(r, args.output_dir, coords_a, coords_b,
+                                            fl.merge_stops(stops_a, stops_b),
+                                            extra={"chaining": chaining}, relations=relations)
+            result.pop("cache", None)
+            result.pop("relations", None)
+            result.update({"rel_a": rel_a, "rel_b": rel_b})
+            summary.append(result)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    summary_path = os.path.join(args.output_dir, "_summary_fetch_batch.csv")
+    for res in summary:
+        res["gaps"] = sum(rep.get("gaps", 0) for rep in res.get("chaining", {}).values())
+    fields = ["route_id", "slug", "name", "status", "rel_a", "rel_b",
+              "geometries", "track_points", "station_count", "gaps"]
+    with open(summary_path, "w", newline="", encoding="utf-8-sig") as f:
+        w = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+        w.writeheader()
+        w.writerows(summary)
+
+    print(f"\n✓ Batch done: {len(summary)} routes, {QUERY_COUNT} Overpass queries", flush=True)
+    print(f"  {fl.CACHE.summary()}", flush=True)
+    print(f"  summary: {summary_path}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,10 +4,22 @@
 - 線路way: railway=subway + operator=東京都交通局 + name~大江戸 の115本を座標付き取得
 - 駅ノード: リレーション 3355612 (光が丘→都庁前) の stop ノードを取得
 - 路線形状: way-chaining で2方向 (都庁前→光が丘, 光が丘→都庁前) に分割
+- Overpass応答は fetch_line_v2.py と共通のキャッシュ (overpass_cache.py) を使用
+  --offline / --no-cache / --cache-dir DIR / --cache-ttl HOURS / --cache-max-mb MB
+- --concurrency N [--rate R]: asyncioスケジューラ (overpass_scheduler.py) で
+  way取得・駅取得・方向別形状取得を並行実行（駅ノード取得を優先）
+- --pack: fetch_line_v2.py と同じく各 GeoJSON の横に量子化 .gdpk も書き出す (geodo_pack.py)
 """
-import json, csv, os, sys, time, requests
+import csv, os, sys, time, requests
+from concurrent.futures import ThreadPoolExecutor
 
-OVERPASS_URL = "https://overpass-api.de/api/interpreter"
+import fetch_line_v2 as fl
+from overpass_cache import OverpassCache, cache_from_argv
+from overpass_scheduler import OverpassScheduler, PRIO_STOPS, PRIO_GEOM
+from track_chain import chain_track, parts_geometry
+from track_projection import project_points
+
+OVERPASS_URL = os.environ.get("GEODO_OVERPASS_URL", "https://overpass-api.de/api/interpreter")
 HEADERS = {"User-Agent": "geodo.earth-builder/1.0"}
 CSV_PATH = "/home/ubuntu/upload/route_master_final_100_with_slug.csv"
 OUTPUT_DIR = "/tmp/geojson_oedo"
@@ -46,16 +58,62 @@ CORRECT_STATION_ORDER = [
     "代々木", "新宿", "都庁前"
 ]
 
-def overpass_query(query, retries=5):
+# レスポンスキャッシュ（main() でコマンドライン引数から差し替え）
+CACHE = OverpassCache()
+# --concurrency 指定時のみ使うリクエストスケジューラ
+SCHEDULER = None
+
+def polite_sleep(seconds):
+    """直前の応答がキャッシュから、またはスケジューラが流量制御しているなら待機しない"""
+    if SCHEDULER is None and not CACHE.last_hit:
+        time.sleep(seconds)
+
+def run_jobs(jobs, pause=3):
+    """
+    (func, arg) のリストを実行して結果リストを返す。
+    スケジューラ有効時はスレッドで並行実行、無効時は従来どおり間隔を空けて順次実行。
+    オフラインのキャッシュミス数はワーカースレッドから呼び出し元スレッドへ合算する。
+    """
+    if SCHEDULER is not None:
+        def run(job):
+            fl.reset_offline_misses()
+            return job[0](job[1]), fl.offline_misses()
+        with ThreadPoolExecutor(max_workers=max(2, len(jobs))) as pool:
+            done = list(pool.map(run, jobs))
+        fl.note_offline_miss(sum(m for _, m in done))
+        return [r for r, _ in done]
+    results = []
+    for i, (func, arg) in enumerate(jobs):
+        if i > 0:
+            polite_sleep(pause)
+        results.append(func(arg))
+    return results
+
+def overpass_query(query, retries=5, priority=PRIO_GEOM):
+    """オフラインでキャッシュにない問い合わせは None を返し、fl.offline_misses() に数える"""
+    if SCHEDULER is not None:
+        data = SCHEDULER.request(query, priority)
+    else:
+        data = CACHE.get(query, OVERPASS_URL)
+        if data is None and not CACHE.offline:
+            data = _post_query(query, retries)
+    if data is None and CACHE.offline:
+        fl.note_offline_miss()
+    return data
+
+def _post_query(query, retries):
     for attempt in range(retries):
         try:
             resp = requests.post(OVERPASS_URL, data={"data": query},
                                  headers=HEADERS, timeout=120)
             if resp.status_code == 200:
                 try:
-                    return resp.json()
+                    data = resp.json()
                 except Exception:
-                    pass
+                    data = None
+                if data is not None:
+                    CACHE.put(query, data, OVERPASS_URL)
+                    return data
             wait = 8 * (attempt + 1)
             print(f"  [HTTP {resp.status_code}] waiting {wait}s...", flush=True)
             time.sleep(wait)
@@ -69,12 +127,16 @@ def fetch_ways_with_geom(way_ids):
     """Fetch way geometries in batches."""
     all_ways = {}
     batch_size = 30
-    for i in range(0, len(way_ids), batch_size):
+    n_batches = (len(way_ids)+batch_size-1)//batch_size
+
+    def fetch_batch(i):
         batch = way_ids[i:i+batch_size]
         ids_str = ",".join(str(x) for x in batch)
         query = f"[out:json][timeout:60];way(id:{ids_str});out geom;"
-        print(f"  Fetching ways batch {i//batch_size + 1}/{(len(way_ids)+batch_size-1)//batch_size} ({len(batch)} ways)...", flush=True)
-        data = overpass_query(query)
+        print(f"  Fetching ways batch {i//batch_size + 1}/{n_batches} ({len(batch)} ways)...", flush=True)
+        return overpass_query(query, priority=PRIO_GEOM)
+
+    for data in run_jobs([(fetch_batch, i) for i in range(0, len(way_ids), batch_size)]):
         if data:
             for el in data.get("elements", []):
                 if el["type"] == "way":
@@ -82,66 +144,50 @@ def fetch_ways_with_geom(way_ids):
                     if geom:
                         pts = [[pt["lon"], pt["lat"]] for pt in geom]
                         all_ways[el["id"]] = pts
-        time.sleep(3)
+    polite_sleep(3)
     return all_ways
 
+def fetch_relation_ways(rel_id):
+    """リレーションの線路way（platform系を除く）を座標付きで取得"""
+    query = f"""
+[out:json][timeout:120];
+relation({rel_id});
+way(r);
+out geom;
+"""
+    data = overpass_query(query, priority=PRIO_GEOM)
+    ways = {}
+    if data:
+        for el in data.get("elements", []):
+            if el["type"] == "way":
+                role = el.get("role", "")
+                if role in ("platform", "platform_entry_only", "platform_exit_only"):
+                    continue
+                geom = el.get("geometry", [])
+                if geom:
+                    ways[el["id"]] = [[pt["lon"], pt["lat"]] for pt in geom]
+    return ways
+
 def chain_ways(ways_dict):
     """
-    Chain ways by matching endpoints to form a continuous polyline.
-    Returns list of coordinate arrays (may be multiple segments if gaps exist).
+    Chain ways by matching endpoints into track parts.
+    Endpoint-index chaining (track_chain.py), starting from the longest way;
+    disconnected pieces are ordered nearest-end-first, short gaps bridged and
+    long ones split into separate parts. Returns the list of parts.
     """
     if not ways_dict:
         return []
 
-    def pt_eq(a, b, tol=1e-6):
-        return abs(a[0]-b[0]) < tol and abs(a[1]-b[1]) < tol
-
-    remaining = [pts[:] for pts in ways_dict.values()]
-
+    ways = [pts[:] for pts in ways_dict.values()]
     # Start with the longest way
-    remaining.sort(key=lambda w: -len(w))
-    chained = [remaining.pop(0)]
-
-    max_iter = len(remaining) * 3 + 1
-    itr = 0
-    while remaining and itr < max_iter:
-        itr += 1
-        head = chained[0][0]
-        tail = chained[-1][-1]
-        matched = False
-        for i, w in enumerate(remaining):
-            if pt_eq(tail, w[0]):
-                chained.append(w[:])
-                remaining.pop(i)
-                matched = True
-                break
-            elif pt_eq(tail, w[-1]):
-                chained.append(list(reversed(w)))
-                remaining.pop(i)
-                matched = True
-                break
-            elif pt_eq(head, w[-1]):
-                chained.insert(0, w[:])
-                remaining.pop(i)
-                matched = True
-                break
-            elif pt_eq(head, w[0]):
-                chained.insert(0, list(reversed(w)))
-                remaining.pop(i)
-                matched = True
-                break
-        if not matched:
-            # Gap — start new segment
-            chained.append(remaining.pop(0))
-
-    # Merge into coordinate list (skip duplicate junction points)
-    coords = []
-    for i, w in enumerate(chained):
-        start = 1 if i > 0 else 0
-        coords.extend(w[start:])
+    order = sorted(range(len(ways)), key=lambda i: -len(ways[i]))
+    parts, report = chain_track(ways, order=order, extend_head=True)
 
-    print(f"  Chained {len(ways_dict)} ways -> {len(coords)} pts ({len(remaining)} unmatched)", flush=True)
-    return coords
+    print(f"  Chained {len(ways_dict)} ways -> {sum(report['part_points'])} pts "
+          f"({report['chains']} chains, {report['parts']} parts, {report['gaps']} bridged gaps)", flush=True)
+    if report["gaps"] or report["split_gaps_m"]:
+        print(f"    bridged gaps per part (m): {report['gap_lengths_m']}, split at (m): {report['split_gaps_m']}", flush=True)
+    return parts
 
 def fetch_stops_from_relation(rel_id):
     """Fetch stop nodes with tags from a relation."""
@@ -151,16 +197,16 @@ relation({rel_id});
 node(r:"stop");
 out body;
 """
-    data = overpass_query(query)
+    data = overpass_query(query, priority=PRIO_STOPS)
     if not data or not data.get("elements"):
-        time.sleep(3)
+        polite_sleep(3)
         query2 = f"""
 [out:json][timeout:60];
 relation({rel_id});
 node(r:"stop_entry_only");
 out body;
 """
-        data = overpass_query(query2)
+        data = overpass_query(query2, priority=PRIO_STOPS)
     stops = []
     seen = set()
     if data:
@@ -184,31 +230,29 @@ def sort_by_correct_order(stations, correct_order):
 
 def project_onto_track(lon, lat, track):
     """Return cumulative distance along track to nearest projected point."""
-    def dist2(ax, ay, bx, by):
-        dx = ax - bx; dy = ay - by
-        return dx*dx + dy*dy
-    best_dist2 = float('inf')
-    cum = 0.0
-    best_cum = 0.0
-    for i in range(len(track) - 1):
-        ax, ay = track[i][0], track[i][1]
-        bx, by = track[i+1][0], track[i+1][1]
-        seg_len2 = dist2(ax, ay, bx, by)
-        if seg_len2 == 0:
-            t = 0.0
-        else:
-            t = ((lon-ax)*(bx-ax) + (lat-ay)*(by-ay)) / seg_len2
-            t = max(0.0, min(1.0, t))
-        px = ax + t*(bx-ax); py = ay + t*(by-ay)
-        d2 = dist2(lon, lat, px, py)
-        seg_len = seg_len2**0.5
-        if d2 < best_dist2:
-            best_dist2 = d2
-            best_cum = cum + t*seg_len
-        cum += seg_len
-    return best_cum
+    chain, _, _ = project_points([(lon, lat)], track)
+    return float(chain[0])
 
 def main():
+    global CACHE, SCHEDULER
+    CACHE = cache_from_argv(sys.argv)
+    fl.PACK = "--pack" in sys.argv
+    concurrency = int(sys.argv[sys.argv.index("--concurrency") + 1]) if "--concurrency" in sys.argv else 0
+    rate = float(sys.argv[sys.argv.index("--rate") + 1]) if "--rate" in sys.argv else 1.0
+    if concurrency > 0:
+        SCHEDULER = OverpassScheduler(OVERPASS_URL, headers=HEADERS, concurrency=concurrency,
+                                      rate=rate, burst=concurrency, cache=CACHE).start()
+    try:
+        code = build_oedo()
+    finally:
+        if SCHEDULER is not None:
+            SCHEDULER.stop()
+            print(f"  {SCHEDULER.summary()}", flush=True)
+    print(f"  {CACHE.summary()}", flush=True)
+    sys.exit(code or 0)
+
+def build_oedo():
+    fl.reset_offline_misses()
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     os.makedirs(os.path.join(OUTPUT_DIR, "lines"), exist_ok=True)
     os.makedirs(os.path.join(OUTPUT_DIR, "stations"), exist_ok=True)
@@ -225,28 +269,31 @@ def main():
         sys.exit(1)
     print(f"Route: {row['official_name']} ({row['line_slug']}, code={row['line_code']})", flush=True)
 
+    # Step 1-4 の取得処理（--concurrency 指定時は並行実行）
+    # 大江戸線は「6の字」形状なので、都庁前を境に環状部と放射部を分ける
+    # 都庁前の座標: 約 (139.6919, 35.6899)
+    # 方向A: 光が丘→都庁前（放射部）
+    # 方向B: 都庁前→光が丘（環状部+放射部）
+    # 実際には2リレーションをそのまま使う
+    # rel 3355612 (光が丘→都庁前) と rel 8019883 (都庁前→光が丘) の形状を個別取得
+    print(f"\nFetching {len(OEDO_WAY_IDS)} track ways, stops and per-direction geometry...", flush=True)
+    ways_dict, stops_a, stops_b, ways_a, ways_b = run_jobs([
+        (fetch_ways_with_geom, OEDO_WAY_IDS),
+        (fetch_stops_from_relation, 3355612),
+        (fetch_stops_from_relation, 8019883),
+        (fetch_relation_ways, 3355612),
+        (fetch_relation_ways, 8019883),
+    ], pause=5)
+
     # Step 1: 線路wayを座標付きで取得
-    print(f"\nStep 1: Fetching {len(OEDO_WAY_IDS)} track ways...", flush=True)
-    ways_dict = fetch_ways_with_geom(OEDO_WAY_IDS)
-    print(f"  Got geometry for {len(ways_dict)}/{len(OEDO_WAY_IDS)} ways", flush=True)
+    print(f"\nStep 1: Got geometry for {len(ways_dict)}/{len(OEDO_WAY_IDS)} ways", flush=True)
 
     # Step 2: way-chaining で路線形状を構築
     print(f"\nStep 2: Chaining ways...", flush=True)
     coords_all = chain_ways(ways_dict)
 
-    # 大江戸線は「6の字」形状なので、都庁前を境に環状部と放射部を分ける
-    # 都庁前の座標: 約 (139.6919, 35.6899)
-    # 方向A: 光が丘→都庁前（放射部）
-    # 方向B: 都庁前→光が丘（環状部+放射部）
-    # 実際には2リレーションをそのまま使う
-    print(f"\nStep 3: Fetching stops from relation 3355612...", flush=True)
-    time.sleep(5)
-    stops_a = fetch_stops_from_relation(3355612)
+    print(f"\nStep 3: Stops from relations", flush=True)
     print(f"  Got {len(stops_a)} stops from rel 3355612", flush=True)
-
-    time.sleep(5)
-    print(f"  Fetching stops from relation 8019883...", flush=True)
-    stops_b = fetch_stops_from_relation(8019883)
     print(f"  Got {len(stops_b)} stops from rel 8019883", flush=True)
 
     # 駅を統合（重複除去）
@@ -264,50 +311,10 @@ def main():
     for i, s in enumerate(all_stops):
         print(f"    [{i+1:2d}] {s['name']}", flush=True)
 
-    # Step 4: 2方向のトラック座標を取得
-    # rel 3355612 (光が丘→都庁前) と rel 8019883 (都庁前→光が丘) の形状を個別取得
-    print(f"\nStep 4: Fetching track geometry for each direction...", flush=True)
-    time.sleep(5)
-
-    # 方向A: rel 3355612 のway
-    query_a = f"""
-[out:json][timeout:120];
-relation(3355612);
-way(r);
-out geom;
-"""
-    data_a = overpass_query(query_a)
-    ways_a = {}
-    if data_a:
-        for el in data_a.get("elements", []):
-            if el["type"] == "way":
-                role = el.get("role", "")
-                if role in ("platform", "platform_entry_only", "platform_exit_only"):
-                    continue
-                geom = el.get("geometry", [])
-                if geom:
-                    ways_a[el["id"]] = [[pt["lon"], pt["lat"]] for pt in geom]
+    # Step 4: 2方向のトラック座標
+    print(f"\nStep 4: Chaining track geometry for each direction...", flush=True)
     print(f"  Dir-A: {len(ways_a)} track ways", flush=True)
     coords_a = chain_ways(ways_a) if ways_a else coords_all
-
-    time.sleep(5)
-    query_b = f"""
-[out:json][timeout:120];
-relation(8019883);
-way(r);
-out geom;
-"""
-    data_b = overpass_query(query_b)
-    ways_b = {}
-    if data_b:
-        for el in data_b.get("elements", []):
-            if el["type"] == "way":
-                role = el.get("role", "")
-                if role in ("platform", "platform_entry_only", "platform_exit_only"):
-                    continue
-                geom = el.get("geometry", [])
-                if geom:
-                    ways_b[el["id"]] = [[pt["lon"], pt["lat"]] for pt in geom]
     print(f"  Dir-B: {len(ways_b)} track ways", flush=True)
     coords_b = chain_ways(ways_b) if ways_b else coords_all
 
@@ -315,7 +322,11 @@ out geom;
     if not coords_a and not coords_b:
         print("  No way geometry from relations, using all 115 ways", flush=True)
         coords_a = coords_all
-        coords_b = list(reversed(coords_all))
+        coords_b = [p[::-1] for p in reversed(coords_all)]
+
+    # オフラインでキャッシュにない問い合わせがあれば、空・部分的なファイルで上書きしない
+    if fl.offline_gap():
+        return 1
 
     # Step 5: GeoJSON構築
     print(f"\nStep 5: Building GeoJSON...", flush=True)
@@ -340,7 +351,7 @@ out geom;
             "type": "Feature", "properties": props,
             "geometry": {
                 "type": "GeometryCollection",
-                "geometries": [{"type": "LineString", "coordinates": c} for c in coords_list]
+                "geometries": [parts_geometry(c) for c in coords_list]
             }
         }]
     }
@@ -367,13 +378,11 @@ out geom;
     line_path = os.path.join(OUTPUT_DIR, "lines", f"{row['line_slug']}.geojson")
     stations_path = os.path.join(OUTPUT_DIR, "stations", f"{row['line_slug']}_stations.geojson")
 
-    with open(line_path, "w", encoding="utf-8") as f:
-        json.dump(line_geojson, f, ensure_ascii=False, separators=(",", ": "))
-    with open(stations_path, "w", encoding="utf-8") as f:
-        json.dump(stations_geojson, f, ensure_ascii=False, separators=(",", ": "))
+    fl.write_geojson(line_path, line_geojson)
+    fl.write_geojson(stations_path, stations_geojson)
 
-    total_pts = sum(len(c) for c in coords_list)
-    print(f"\n✓ Done: {len(coords_list)} LineStrings, {total_pts} track pts, {len(all_stops)} stations", flush=True)
+    total_pts = sum(len(p) for c in coords_list for p in c)
+    print(f"\n✓ Done: {len(coords_list)} geometries, {total_pts} track pts, {len(all_stops)} stations", flush=True)
     print(f"  {line_path}", flush=True)
     print(f"  {stations_path}", flush=True)
 
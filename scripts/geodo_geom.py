@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+geodo_geom.py — Geometry helpers shared by the GUNO line scripts
+(build_guno_centerlines*, extract_guno_mainline*, check_lines_*,
+build_guno_mainline_by_stationpath_v4*).
+
+CRS:
+  - estimate_utm_epsg / project_to_metric (alias to_metric): auto UTM projection.
+    Transformers come from a per-process pool keyed by (src, dst) EPSG
+    (get_transformer), and coordinates are transformed as raw NumPy arrays:
+    transform_planar (in place), transform_xy ((n, 2) arrays) and
+    transform_geoms (one call for a whole array of geometries).
+  - RouteGeometry: one route's line rows with their metric view, projected once
+    and shared by every stage that needs metres.
+
+Lines:
+  - explode_lines: keep LineString rows only (MultiLineString exploded).
+  - sample_midline(): NumPy midline engine. All n + 1 stations along `a` are
+    interpolated at once, projected onto `b` in one batch (track_projection's
+    segment-projection kernel) and near-duplicate midpoints are dropped with
+    array masks, instead of a per-point interpolate() / nearest_points() loop.
+"""
+
+import math
+from functools import cached_property, lru_cache
+from typing import Optional, Tuple
+
+import geopandas as gpd
+import numpy as np
+import shapely
+from pyproj import CRS, Transformer
+from shapely.geometry import LineString, Point
+
+from track_projection import TrackProjector
+
+WGS84_EPSG = 4326
+
+
+# ---------------- CRS ----------------
+def is_geographic_crs(gdf: gpd.GeoDataFrame) -> bool:
+    try:
+        return bool(gdf.crs and gdf.crs.is_geographic)
+    except Exception:
+        return False
+
+
+def estimate_utm_epsg(lon: float, lat: float) -> int:
+    zone = int(math.floor((lon + 180) / 6) + 1)
+    return (32600 + zone) if lat >= 0 else (32700 + zone)
+
+
+@lru_cache(maxsize=None)
+def get_transformer(src_epsg: int, dst_epsg: int) -> Transformer:
+    """
+    Process-wide transformer pool keyed by (src, dst) EPSG: PROJ setup happens
+    once per pair per process, every later route reuses it.
+    """
+    return Transformer.from_crs(src_epsg, dst_epsg, always_xy=True)
+
+
+def _planar_ok(a) -> bool:
+    return isinstance(a, np.ndarray) and a.dtype == np.float64 and a.flags.c_contiguous and a.flags.writeable
+
+
+def transform_planar(x: np.ndarray, y: np.ndarray, src_epsg: int, dst_epsg: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Transform x / y coordinate arrays in place (no copies) and return them.
+    Both must be writable C-contiguous float64: pyproj silently copies anything
+    else, which would leave the caller's arrays untouched.
+    """
+    if not (_planar_ok(x) and _planar_ok(y)):
+        raise ValueError("transform_planar needs writable C-contiguous float64 arrays")
+    get_transformer(src_epsg, dst_epsg).transform(x, y, inplace=True)
+    return x, y
+
+
+def transform_xy(xy: np.ndarray, src_epsg: int, dst_epsg: int) -> np.ndarray:
+    """
+    (n, 2) coordinates -> transformed (n, 2) array. The columns are copied once
+    into a planar (2, n) buffer that PROJ transforms in place; the result is a
+    view of that buffer.
+    """
+    buf = np.array(np.asarray(xy, dtype=np.float64)[:, :2].T, order="C")
+    transform_planar(buf[0], buf[1], src_epsg, dst_epsg)
+    return buf.T
+
+
+def transform_geoms(geoms, src_epsg: int, dst_epsg: int) -> np.ndarray:
+    """Reproject an array of shapely geometries (all coordinates in one transform_xy call)."""
+    return shapely.transform(np.asarray(geoms, dtype=object), lambda xy: transform_xy(xy, src_epsg, dst_epsg))
+
+
+def reproject(gdf: gpd.GeoDataFrame, crs) -> gpd.GeoDataFrame:
+    """
+    gdf.to_crs(crs) for an EPSG code or CRS, through the transformer pool when
+    both ends have an EPSG code (plain to_crs otherwise).
+    """
+    dst = crs if isinstance(crs, int) else CRS.from_user_input(crs).to_epsg()
+    src = gdf.crs.to_epsg() if gdf.crs is not None else None
+    if src is None or dst is None:
+        return gdf.to_crs(crs)
+    if src == dst:
+        return gdf
+    geom = gpd.GeoSeries(transform_geoms(gdf.geometry.values, src, dst), index=gdf.index, crs=dst)
+    return gdf.set_geometry(geom)
+
+
+def project_to_metric(gdf: gpd.GeoDataFrame, assume_wgs84: bool = False) -> Tuple[gpd.GeoDataFrame, Optional[str]]:
+    """
+    Project a geographic frame to the UTM zone at the centre of its bounds.
+    Returns (projected_gdf, metric_crs_str); a frame without CRS is returned
+    as (gdf, None) unless assume_wgs84 is set, a projected one unchanged.
+    """
+    if gdf.crs is None:
+        if not assume_wgs84:
+            return gdf, None
+        gdf = gdf.set_crs(epsg=WGS84_EPSG)
+    if not is_geographic_crs(gdf):
+        return gdf, str(gdf.crs)
+
+    minx, miny, maxx, maxy = gdf.total_bounds
+    lon = (minx + maxx) / 2.0
+    lat = (miny + maxy) / 2.0
+    epsg = estimate_utm_epsg(lon, lat)
+    out = reproject(gdf, epsg)
+    return out, str(out.crs)
+
+
+to_metric = project_to_metric
+
+
+# ---------------- Lines ----------------
+def explode_lines(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """Keep only line geometries; explode MultiLineString into LineString rows."""
+    g = gdf.explode(index_parts=True, ignore_index=True)
+    g = g[g.geometry.notna() & ~g.geometry.is_empty].copy()
+    g = g[g.geometry.geom_type.isin(["LineString", "MultiLineString"])].copy()
+    g = g.explode(index_parts=True, ignore_index=True)
+    g = g[g.geometry.geom_type == "LineString"].copy()
+    return g
+
+
+class RouteGeometry:
+    """
+    One route's LineString rows with a metric (UTM) view, projected on first use
+    and then shared by every stage of the pipeline.
+
+      source      the frame as read (WGS84 if no CRS was set)
+      lines       exploded LineString rows in the source CRS
+      metric      the same rows in the local UTM zone
+      metric_crs  "EPSG:326xx" (None if the source CRS could not be projected)
+    """
+
+    def __init__(self, gdf: gpd.GeoDataFrame):
+        if gdf.crs is None:
+            gdf = gdf.set_crs(epsg=WGS84_EPSG)
+        self.source = gdf
+        self.lines = explode_lines(gdf)
+
+    @classmethod
+    def read(cls, path) -> "RouteGeometry":
+        return cls(gpd.read_file(path))
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    @cached_property
+    def _projected(self) -> Tuple[gpd.GeoDataFrame, Optional[str]]:
+        return project_to_metric(self.lines)
+
+    @property
+    def metric(self) -> gpd.GeoDataFrame:
+        return self._projected[0]
+
+    @property
+    def metric_crs(self) -> Optional[str]:
+        return self._projected[1]
+
+    @cached_property
+    def metric_lines(self) -> list:
+        return list(self.metric.geometry)
+
+    @cached_property
+    def wgs84(self) -> gpd.GeoDataFrame:
+        return reproject(self.lines, WGS84_EPSG)
+
+    def to_wgs84(self, geoms):
+        """Metric geometry (or array of geometries) back to lon/lat."""
+        arr = np.atleast_1d(np.asarray(geoms, dtype=object))
+        src = self.metric.crs.to_epsg()
+        if src is None:
+            out = np.asarray(gpd.GeoSeries(arr, crs=self.metric.crs).to_crs(epsg=WGS84_EPSG).values)
+        else:
+            out = transform_geoms(arr, src, WGS84_EPSG)
+        return out if np.ndim(geoms) else out[0]
+
+
+# ---------------- Midline ----------------
+def line_xy(line: LineString) -> np.ndarray:
+    """(n, 2) float64 vertex array of a LineString (z dropped)."""
+    return np.asarray(line.coords, dtype=np.float64)[:, :2]
+
+
+def orient_same_direction(a: LineString, b: LineString) -> Tuple[LineString, LineString]:
+    """Reverse b if its endpoints match a's endpoints better that way round."""
+    a0, a1 = Point(a.coords[0]), Point(a.coords[-1])
+    b0, b1 = Point(b.coords[0]), Point(b.coords[-1])
+    d_same = a0.distance(b0) + a1.distance(b1)
+    b_rev = LineString(list(reversed(list(b.coords))))
+    d_rev = a0.distance(Point(b_rev.coords[0])) + a1.distance(Point(b_rev.coords[-1]))
+    return (a, b_rev) if d_rev < d_same else (a, b)
+
+
+def interpolate_normalized(xy: np.ndarray, t: np.ndarray) -> np.ndarray:
+    """Points at normalized distances t (0..1) along the polyline xy, like interpolate(normalized=True)."""
+    d = np.diff(xy, axis=0)
+    seg_len = np.sqrt(d[:, 0] * d[:, 0] + d[:, 1] * d[:, 1])
+    cum = np.concatenate(([0.0], np.cumsum(seg_len)))
+    s = np.clip(t, 0.0, 1.0) * cum[-1]
+    i = np.clip(np.searchsorted(cum, s, side="right") - 1, 0, len(seg_len) - 1)
+    f = np.divide(s - cum[i], seg_len[i], out=np.zeros(len(s)), where=seg_len[i] > 0)
+    return xy[i] + np.minimum(f, 1.0)[:, None] * d[i]
+
+
+def dedupe_consecutive(pts: np.ndarray, min_step: float) -> np.ndarray:
+    """
+    Drop points closer than min_step to the last kept point.
+    Steps between neighbours are tested as one array mask; only where a point was
+    dropped is the next one compared against the last kept point instead.
+    """
+    if len(pts) < 2:
+        return pts
+    thr2 = min_step * min_step
+    step = np.diff(pts, axis=0)
+    keep = np.ones(len(pts), dtype=bool)
+    keep[1:] = (step[:, 0] ** 2 + step[:, 1] ** 2) > thr2
+    if keep.all():
+        return pts
+    first = int(np.argmin(keep))
+    last = first - 1
+    for i in range(first, len(pts)):
+        if i - 1 != last:
+            dx, dy = pts[i] - pts[last]
+            keep[i] = dx * dx + dy * dy > thr2
+        if keep[i]:
+            last = i
+    return pts[keep]
+
+
+def sample_midline(a: LineString, b: LineString, n: int, dedupe_m: Optional[float] = 0.5) -> Optional[LineString]:
+    """
+    Midline between two roughly parallel lines: n + 1 evenly spaced stations on a,
+    each paired with its nearest point on b, midpoints joined into a LineString.
+    dedupe_m: drop midpoints that moved no more than this from the last kept one
+    (None keeps every point).
+    """
+    if a is None or b is None:
+        return None
+    if a.length == 0 or b.length == 0:
+        return None
+    a, b = orient_same_direction(a, b)
+
+    pa = interpolate_normalized(line_xy(a), np.arange(n + 1) / n)
+    _, _, pb = TrackProjector(line_xy(b)).nearest(pa)
+    pts = (pa + pb) / 2.0
+    if len(pts) < 2:
+        return None
+
+    # remove near-duplicates
+    if dedupe_m is not None:
+        pts = dedupe_consecutive(pts, dedupe_m)
+    if len(pts) < 2:
+        return None
+    return LineString(pts)
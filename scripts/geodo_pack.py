@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+"""
+geodo_pack.py — Compact quantized binary form of the line / station GeoJSON assets.
+
+A .gdpk file sits next to its .geojson and carries the same FeatureCollection:
+coordinates are quantized to integers (1 / scale degrees, scale = 10**digits)
+and stored as zigzag varint deltas from the previous coordinate in file order,
+so consecutive track vertices cost one or two bytes per axis instead of ~20
+characters. Properties are stored as a table: every distinct key and every
+distinct value appears once in the header, and each feature is a list of
+(key, value) index pairs, so the per-feature OSM tags and line metadata
+repeated on every feature cost a few bytes each. Encoding and decoding of the
+varint streams are NumPy array operations (no per-value Python loop).
+
+Layout (little-endian):
+  b"GDPK" | u8 version | 3 reserved bytes
+  u32 len | header     UTF-8 JSON: {"scale", "n_features", "n_coords",
+                       "collection": {members other than type / features},
+                       "keys": [...], "values": [...],
+                       "members": [other feature members, e.g. "id"] (if any)}
+  u32 len | structure  varints: per feature a geometry type code
+                       (0 null, 1 Point, 2 LineString, 3 Polygon, 4 MultiPoint,
+                       5 MultiLineString, 6 MultiPolygon, 7 GeometryCollection)
+                       followed by the part / ring / vertex counts it needs
+  u32 len | props      varints: per feature 0 (no properties member), 1 (null)
+                       or n + 2 followed by n (key index, value index) pairs
+  u32 len | coords     zigzag varint deltas, x0 y0 x1 y1 ...
+
+Round trip: every decoded coordinate is within 0.5 / scale degrees of the
+source on each axis (digits=7: 5e-8 deg, about 6 mm); everything else is
+exact. Only x / y are kept (the assets are 2D).
+
+  python geodo_pack.py --in-dir assets/geojson/lines            # write + validate
+  python geodo_pack.py --in-dir assets/geojson/stations --validate-only
+"""
+
+import argparse
+import copy
+import gzip
+import json
+import struct
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+MAGIC = b"GDPK"
+FORMAT_VERSION = 1
+DEFAULT_DIGITS = 7
+SUFFIX = ".gdpk"
+
+GEOM_CODES = {
+    None: 0, "Point": 1, "LineString": 2, "Polygon": 3,
+    "MultiPoint": 4, "MultiLineString": 5, "MultiPolygon": 6, "GeometryCollection": 7,
+}
+GEOM_TYPES = {v: k for k, v in GEOM_CODES.items()}
+# nesting depth of the coordinate arrays (0 = a single position)
+GEOM_DEPTH = {"Point": 0, "LineString": 1, "MultiPoint": 1, "Polygon": 2, "MultiLineString": 2, "MultiPolygon": 3}
+
+
+class PackError(ValueError):
+    """Malformed or unsupported .gdpk data."""
+
+
+# ---------------- varints ----------------
+def zigzag(v: np.ndarray) -> np.ndarray:
+    v = np.asarray(v, dtype=np.int64)
+    return ((v << 1) ^ (v >> 63)).astype(np.uint64)
+
+
+def unzigzag(u: np.ndarray) -> np.ndarray:
+    u = np.asarray(u, dtype=np.uint64)
+    return ((u >> np.uint64(1)).astype(np.int64)) ^ -((u & np.uint64(1)).astype(np.int64))
+
+
+def encode_varints(u) -> bytes:
+    """Unsigned LEB128 of every value, all values at once (one pass per byte position)."""
+    u = np.asarray(u, dtype=np.uint64)
+    if u.size == 0:
+        return b""
+    nbytes = np.ones(len(u), dtype=np.int64)
+    for k in range(1, 10):
+        nbytes += u >= np.uint64(1 << (7 * k))
+    start = np.concatenate(([0], np.cumsum(nbytes)[:-1]))
+    out = np.empty(int(nbytes.sum()), dtype=np.uint8)
+    for j in range(int(nbytes.max())):
+        m = nbytes > j
+        b = (u[m] >> np.uint64(7 * j)) & np.uint64(0x7F)
+        b |= np.where(nbytes[m] - 1 > j, np.uint64(0x80), np.uint64(0))
+        out[start[m] + j] = b.astype(np.uint8)
+    return out.tobytes()
+
+
+def decode_varints(buf: bytes) -> np.ndarray:
+    b = np.frombuffer(buf, dtype=np.uint8)
+    if b.size == 0:
+        return np.zeros(0, dtype=np.uint64)
+    last = (b & 0x80) == 0
+    if not last[-1]:
+        raise PackError("truncated varint stream")
+    ends = np.flatnonzero(last)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    pos = np.arange(b.size) - np.repeat(starts, ends - starts + 1)
+    if pos.max() > 9:
+        raise PackError("varint longer than 64 bits")
+    vals = (b & 0x7F).astype(np.uint64) << (7 * pos).astype(np.uint64)
+    return np.add.reduceat(vals, starts)
+
+
+# ---------------- geometry flattening ----------------
+def _flatten(geom: Optional[Dict[str, Any]], structure: List[int], coords: List) -> None:
+    if geom is None:
+        structure.append(GEOM_CODES[None])
+        return
+    gtype = geom.get("type")
+    if gtype not in GEOM_CODES:
+        raise PackError(f"unsupported geometry type: {gtype!r}")
+    structure.append(GEOM_CODES[gtype])
+    if gtype == "GeometryCollection":
+        parts = geom.get("geometries") or []
+        structure.append(len(parts))
+        for g in parts:
+            _flatten(g, structure, coords)
+        return
+
+    def walk(c, depth):
+        if depth == 0:
+            coords.append(c[:2])
+            return
+        structure.append(len(c))
+        for x in c:
+            walk(x, depth - 1)
+
+    walk(geom["coordinates"], GEOM_DEPTH[gtype])
+
+
+def _rebuild(it, xy: np.ndarray, cursor: List[int]) -> Optional[Dict[str, Any]]:
+    code = next(it)
+    if code not in GEOM_TYPES:
+        raise PackError(f"unknown geometry type code {code}")
+    gtype = GEOM_TYPES[code]
+    if gtype is None:
+        return None
+    if gtype == "GeometryCollection":
+        return {"type": gtype, "geometries": [_rebuild(it, xy, cursor) for _ in range(next(it))]}
+
+    def walk(depth):
+        if depth == 0:
+            i = cursor[0]
+            cursor[0] += 1
+            return xy[i]
+        n = next(it)
+        if depth == 1:
+            i = cursor[0]
+            cursor[0] += n
+            return xy[i:i + n]
+        return [walk(depth - 1) for _ in range(n)]
+
+    return {"type": gtype, "coordinates": walk(GEOM_DEPTH[gtype])}
+
+
+# ---------------- properties table ----------------
+def _encode_properties(feature: Dict[str, Any], out: List[int], keys: Dict[str, int], values: Dict[str, int]) -> None:
+    if "properties" not in feature:
+        out.append(0)
+        return
+    props = feature["properties"]
+    if props is None:
+        out.append(1)
+        return
+    out.append(len(props) + 2)
+    for k, v in props.items():
+        # values are told apart by their JSON text (1, 1.0 and true stay distinct)
+        vj = json.dumps(v, ensure_ascii=False, separators=(",", ":"))
+        out.append(keys.setdefault(k, len(keys)))
+        out.append(values.setdefault(vj, len(values)))
+
+
+def _decode_properties(it, keys: List[str], values: List[Any], feature: Dict[str, Any]) -> None:
+    n = next(it)
+    if n == 0:
+        return
+    if n == 1:
+        feature["properties"] = None
+        return
+    props = {}
+    for _ in range(n - 2):
+        k = keys[next(it)]
+        props[k] = copy.deepcopy(values[next(it)])
+    feature["properties"] = props
+
+
+# ---------------- pack / unpack ----------------
+def pack(fc: Dict[str, Any], digits: int = DEFAULT_DIGITS) -> bytes:
+    """FeatureCollection dict -> .gdpk bytes."""
+    if fc.get("type") != "FeatureCollection":
+        raise PackError("only FeatureCollections can be packed")
+    scale = 10 ** int(digits)
+    structure: List[int] = []
+    coords: List = []
+    props: List[int] = []
+    keys: Dict[str, int] = {}
+    values: Dict[str, int] = {}
+    members = []
+    features = fc.get("features") or []
+    for f in features:
+        _flatten(f.get("geometry"), structure, coords)
+        _encode_properties(f, props, keys, values)
+        members.append({k: v for k, v in f.items() if k not in ("type", "geometry", "properties")})
+
+    xy = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    q = np.rint(xy * scale).astype(np.int64)
+    deltas = np.diff(q, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+    header = {
+        "scale": scale,
+        "n_features": len(features),
+        "n_coords": len(q),
+        "collection": {k: v for k, v in fc.items() if k not in ("type", "features")},
+        "keys": list(keys),
+        "values": [json.loads(v) for v in values],
+    }
+    if any(members):
+        header["members"] = members
+    sections = [
+        json.dumps(header, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+        encode_varints(np.asarray(structure, dtype=np.uint64)),
+        encode_varints(np.asarray(props, dtype=np.uint64)),
+        encode_varints(zigzag(deltas.ravel())),
+    ]
+    out = [MAGIC, struct.pack("<B3x", FORMAT_VERSION)]
+    for s in sections:
+        out += [struct.pack("<I", len(s)), s]
+    return b"".join(out)
+
+
+def _sections(data: bytes) -> List[bytes]:
+    if data[:4] != MAGIC:
+        raise PackError("not a .gdpk file")
+    (version,) = struct.unpack_from("<B", data, 4)
+    if version != FORMAT_VERSION:
+        raise PackError(f"unsupported format version {version}")
+    pos = 8
+    out = []
+    for _ in range(4):
+        if pos + 4 > len(data):
+            raise PackError("truncated file")
+        (n,) = struct.unpack_from("<I", data, pos)
+        pos += 4
+        if pos + n > len(data):
+            raise PackError("truncated file")
+        out.append(data[pos:pos + n])
+        pos += n
+    if pos != len(data):
+        raise PackError("trailing bytes after the coordinate stream")
+    return out
+
+
+# header fields read by the decoder and their JSON types
+HEADER_FIELDS = {"scale": (int, float), "n_features": int, "n_coords": int,
+                 "collection": dict, "keys": list, "values": list}
+
+
+def _header(header_b: bytes) -> Dict[str, Any]:
+    try:
+        header = json.loads(header_b.decode("utf-8"))
+    except ValueError as e:  # UnicodeDecodeError / JSONDecodeError
+        raise PackError(f"unreadable header: {e}") from None
+    if not isinstance(header, dict):
+        raise PackError("header is not a JSON object")
+    for k, t in HEADER_FIELDS.items():
+        if not isinstance(header.get(k), t) or isinstance(header[k], bool):
+            raise PackError(f"header field {k!r} missing or malformed")
+    if header["scale"] <= 0 or header["n_features"] < 0 or header["n_coords"] < 0:
+        raise PackError("header scale / counts out of range")
+    members = header.get("members")
+    if members is not None and (not isinstance(members, list) or len(members) != header["n_features"]
+                                or not all(isinstance(m, dict) for m in members)):
+        raise PackError("header field 'members' malformed")
+    return header
+
+
+def unpack_xy(data: bytes) -> Tuple[Dict[str, Any], np.ndarray, np.ndarray, np.ndarray]:
+    """.gdpk bytes -> (header, structure varints, properties varints, (n, 2) decoded coordinates)."""
+    header_b, structure_b, props_b, coords_b = _sections(data)
+    header = _header(header_b)
+    deltas = unzigzag(decode_varints(coords_b))
+    if deltas.size != 2 * header["n_coords"]:
+        raise PackError(f"coordinate stream holds {deltas.size // 2} positions, header says {header['n_coords']}")
+    q = np.cumsum(deltas.reshape(-1, 2), axis=0)
+    return header, decode_varints(structure_b), decode_varints(props_b), q / header["scale"]
+
+
+def unpack(data: bytes) -> Dict[str, Any]:
+    """.gdpk bytes -> FeatureCollection dict (coordinates as lists)."""
+    header, structure, props, xy = unpack_xy(data)
+    it = iter(structure.tolist())
+    pit = iter(props.tolist())
+    cursor = [0]
+    features = []
+    xy_list = xy.tolist()
+    n = header["n_features"]
+    members = header.get("members") or [{}] * n
+    try:
+        for i in range(n):
+            f = {"type": "Feature", **members[i]}
+            _decode_properties(pit, header["keys"], header["values"], f)
+            f["geometry"] = _rebuild(it, xy_list, cursor)
+            features.append(f)
+    except (StopIteration, IndexError, TypeError):
+        # TypeError: a key table entry that cannot be a property name
+        raise PackError("structure / properties stream ended early or points outside the tables") from None
+    if next(it, None) is not None or next(pit, None) is not None or cursor[0] != len(xy_list):
+        raise PackError("structure / properties / coordinate counts do not match the features")
+    return {"type": "FeatureCollection", **header["collection"], "features": features}
+
+
+def write_pack(fc: Dict[str, Any], path, digits: int = DEFAULT_DIGITS) -> int:
+    """Write fc as .gdpk to path; returns the file size."""
+    data = pack(fc, digits)
+    with open(path, "wb") as f:
+        f.write(data)
+    return len(data)
+
+
+def read_pack(path) -> Dict[str, Any]:
+    with open(path, "rb") as f:
+        return unpack(f.read())
+
+
+def pack_path(geojson_path) -> Path:
+    """<name>.geojson -> <name>.gdpk next to it."""
+    return Path(geojson_path).with_suffix(SUFFIX)
+
+
+# ---------------- validation ----------------
+def _strip_geometry(fc: Dict[str, Any]) -> Tuple[Dict[str, Any], List]:
+    """(fc without geometries, per-feature (structure, coords) for comparison)."""
+    rest = {k: v for k, v in fc.items() if k != "features"}
+    feats, geoms = [], []
+    for f in fc.get("features") or []:
+        feats.append({k: v for k, v in f.items() if k != "geometry"})
+        structure, coords = [], []
+        _flatten(f.get("geometry"), structure, coords)
+        geoms.append((structure, coords))
+    rest["features"] = feats
+    return rest, geoms
+
+
+def validate(fc: Dict[str, Any], data: bytes) -> Dict[str, Any]:
+    """
+    Check a .gdpk payload against its source FeatureCollection: identical
+    properties and geometry structure, every coordinate within the round-trip
+    bound 0.5 / scale. Returns a report; report["ok"] is the verdict.
+    """
+    decoded = unpack(data)
+    scale = unpack_xy(data)[0]["scale"]
+    src_rest, src_geoms = _strip_geometry(fc)
+    dec_rest, dec_geoms = _strip_geometry(decoded)
+    errors = []
+    if src_rest != dec_rest:
+        errors.append("properties / collection members differ")
+    if [s for s, _ in src_geoms] != [s for s, _ in dec_geoms]:
+        errors.append("geometry structure differs")
+    a = np.asarray([c for _, cs in src_geoms for c in cs], dtype=np.float64).reshape(-1, 2)
+    b = np.asarray([c for _, cs in dec_geoms for c in cs], dtype=np.float64).reshape(-1, 2)
+    bound = 0.5 / scale
+    max_err = float(np.abs(a - b).max()) if len(a) and a.shape == b.shape else 0.0
+    if a.shape != b.shape:
+        errors.append("coordinate count differs")
+    # 1e-12: float rounding of q / scale on top of the quantization bound
+    elif max_err > bound + 1e-12:
+        errors.append(f"coordinate error {max_err:.3g} exceeds bound {bound:.3g}")
+    return {"ok": not errors, "errors": errors, "coords": len(a), "max_err_deg": max_err, "bound_deg": bound}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Write / validate quantized .gdpk files next to GeoJSON assets.")
+    ap.add_argument("--in-dir", required=True, help="Dir with .geojson files (e.g. assets/geojson/lines)")
+    ap.add_argument("--pattern", default="*.geojson", help="Glob pattern")
+    ap.add_argument("--digits", type=int, default=DEFAULT_DIGITS,
+                    help="Decimal digits kept (scale 10**digits, round-trip error <= 0.5 / scale deg)")
+    ap.add_argument("--validate-only", action="store_true", help="Only check existing .gdpk files against the GeoJSON")
+    args = ap.parse_args()
+
+    totals = {"geojson": 0, "geojson_gz": 0, "gdpk": 0, "gdpk_gz": 0}
+    n = failed = 0
+    for fp in sorted(Path(args.in_dir).glob(args.pattern)):
+        raw = fp.read_bytes()
+        fc = json.loads(raw.decode("utf-8"))
+        out_fp = pack_path(fp)
+        try:
+            if args.validate_only:
+                data = out_fp.read_bytes()
+            else:
+                data = pack(fc, args.digits)
+                out_fp.write_bytes(data)
+            rep = validate(fc, data)
+        except (OSError, PackError) as e:
+            rep = {"ok": False, "errors": [f"{type(e).__name__}: {e}"]}
+        n += 1
+        if not rep["ok"]:
+            failed += 1
+            print(f"[NG] {fp.name}: {'; '.join(rep['errors'])}")
+            continue
+        sizes = {"geojson": len(raw), "geojson_gz": len(gzip.compress(raw)),
+                 "gdpk": len(data), "gdpk_gz": len(gzip.compress(data))}
+        for k, v in sizes.items():
+            totals[k] += v
+        print(f"[OK] {out_fp.name}  {sizes['geojson']:,} -> {sizes['gdpk']:,} bytes "
+              f"({sizes['geojson'] / max(1, sizes['gdpk']):.1f}x)  max_err={rep['max_err_deg']:.2g} deg")
+
+    if totals["gdpk"]:
+        print(f"[TOTAL] {n - failed} files  geojson {totals['geojson']:,} -> gdpk {totals['gdpk']:,} bytes "
+              f"({totals['geojson'] / totals['gdpk']:.1f}x); gzip {totals['geojson_gz']:,} -> {totals['gdpk_gz']:,} "
+              f"({totals['geojson_gz'] / totals['gdpk_gz']:.1f}x)")
+    if failed:
+        raise SystemExit(f"[ERROR] {failed} of {n} files failed validation")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+graph_cache.py — On-disk cache of built track graphs (track_graph.TrackGraph).
+
+Used by build_guno_mainline_by_stationpath_v4_1_batch.py. Building a route's
+graph (read, project, snap, merge, quantize) depends only on the line file and
+the graph parameters, so the result is stored under a key made of the file's
+content hash and those parameters. Station files and output options
+(--simplify-m, --station-snap) are not part of the key: changing them reuses
+the cached graph.
+
+Layout:
+  <cache_dir>/<key[:2]>/<key>/
+    meta.json                      {"key", "source", "params", "crs", "n_nodes", "n_edges", "n_rings", "built_at"}
+    cells.npy xy.npy indptr.npy indices.npy weights.npy
+    rings_xy.npy rings_indptr.npy  closed lines of the merged track (loop ordering),
+                                   ring k = rings_xy[rings_indptr[k]:rings_indptr[k + 1]]
+
+Arrays are plain .npy files (not .npz) so they can be memory-mapped: pool
+workers map the same files read-only instead of receiving pickled graphs.
+Entries are written to a temporary directory and renamed into place, so a
+concurrent reader never sees a half-written graph.
+
+Environment:
+  GEODO_GRAPH_CACHE   default cache directory (~/.cache/geodo/track_graph)
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from track_graph import TrackGraph
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "GEODO_GRAPH_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "geodo", "track_graph"),
+)
+# bump when graph construction changes so stale entries are not reused
+FORMAT_VERSION = 2
+
+
+def file_sha256(path, chunk=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def graph_key(path, **params):
+    """Content address of a graph: sha256 of the input file hash + sorted parameters."""
+    h = hashlib.sha256()
+    h.update(f"v{FORMAT_VERSION}\0".encode("utf-8"))
+    h.update(file_sha256(path).encode("ascii"))
+    h.update(b"\0")
+    h.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+def save_rings(dirpath, rings):
+    """Write ring coordinate arrays ((n, 2) each) as rings_xy.npy + rings_indptr.npy."""
+    xy = [np.asarray(r, dtype=np.float64).reshape(-1, 2) for r in rings]
+    indptr = np.cumsum([0] + [len(a) for a in xy], dtype=np.int64)
+    np.save(os.path.join(dirpath, "rings_xy.npy"), np.concatenate(xy) if xy else np.zeros((0, 2)))
+    np.save(os.path.join(dirpath, "rings_indptr.npy"), indptr)
+
+
+def load_rings(dirpath, mmap=True):
+    """Rings written by save_rings(), as a list of (n, 2) arrays."""
+    mode = "r" if mmap else None
+    xy = np.load(os.path.join(dirpath, "rings_xy.npy"), mmap_mode=mode)
+    indptr = np.load(os.path.join(dirpath, "rings_indptr.npy"))
+    return [xy[a:b] for a, b in zip(indptr[:-1], indptr[1:])]
+
+
+class GraphCache:
+    """TrackGraph (+ ring lines) store keyed by graph_key()."""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, enabled=True, mmap=True):
+        self.cache_dir = str(cache_dir)
+        self.enabled = enabled
+        self.mmap = mmap
+
+    def _dir(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, key):
+        """(TrackGraph, meta, rings) for key, or None on miss / unreadable entry."""
+        if not self.enabled:
+            return None
+        d = self._dir(key)
+        try:
+            with open(os.path.join(d, "meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            graph = TrackGraph.load(d, meta["params"]["node_grid_m"], mmap=self.mmap)
+            rings = load_rings(d, mmap=self.mmap)
+        except (OSError, ValueError, KeyError):
+            return None
+        return graph, meta, rings
+
+    def put(self, key, graph, source, params, crs, rings=()):
+        """
+        Store a built graph and the ring lines of its merged track (coordinate
+        arrays); an entry written meanwhile by another process wins.
+        """
+        if not self.enabled:
+            return
+        d = self._dir(key)
+        os.makedirs(os.path.dirname(d), exist_ok=True)
+        tmp = f"{d}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        graph.save(tmp)
+        save_rings(tmp, rings)
+        meta = {
+            "key": key,
+            "source": str(source),
+            "params": params,
+            "crs": crs,
+            "n_nodes": graph.n_nodes,
+            "n_edges": graph.n_edges,
+            "n_rings": len(rings),
+            "built_at": time.time(),
+        }
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        try:
+            os.rename(tmp, d)
+        except OSError:
+            # already stored by a concurrent worker
+            shutil.rmtree(tmp, ignore_errors=True)
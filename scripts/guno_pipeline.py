@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+guno_pipeline.py — 路線ジオメトリの多段処理を1パスで実行するランナー
+
+これまで assets/geojson/* の生成は
+  build_guno_centerlines_clusterab_v3_3.py → extract_guno_mainline_v3_station_score.py
+  → smooth_guno_lines_v1.py ...
+と順に実行し、各スクリプトが GeoJSON を読み直し・再投影・再展開していた。
+
+ここでは各段を「路線ジオメトリに対するメモリ上の変換（Stage）」として宣言し、
+  - 路線ごとに GeoJSON を1回だけ読み込み（RouteGeometry: 展開・UTM投影も1回）
+  - 中間結果（レイヤ）はメモリに保持して次段へ渡し
+  - 指定された最終レイヤ（--layers）と、--debug 時は中間レイヤだけを書き出す
+必要な Stage は要求レイヤから依存関係をたどって決まる。
+
+レイヤ（出力先は各スクリプトと同じ命名）:
+  oneline_A / oneline_B  onelines_ab/<route>_{A,B}_oneline.geojson      (clusterab)
+  centerline             centerlines_guno/<route>_centerline.geojson     (clusterab)
+  guno_line              guno_lines/<route>_guno_line.geojson            (mainline)
+  guno_line_smooth       guno_lines_view/<route>_guno_line_smooth.geojson (smooth)
+
+路線ごと・Stageごとの所要時間（ms）は _summary_pipeline.csv に出力する。
+"""
+
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import geopandas as gpd
+import pandas as pd
+
+from geodo_geom import RouteGeometry
+import build_guno_centerlines_clusterab_v3_3 as clusterab
+import extract_guno_mainline_v3_station_score as mainline
+import smooth_guno_lines_v1 as smooth
+
+
+# ---------------- Layers ----------------
+# layer -> (出力サブディレクトリ, ファイル名テンプレート)
+LAYERS: Dict[str, Tuple[str, str]] = {
+    "oneline_A": ("onelines_ab", "{route}_A_oneline.geojson"),
+    "oneline_B": ("onelines_ab", "{route}_B_oneline.geojson"),
+    "centerline": ("centerlines_guno", "{route}_centerline.geojson"),
+    "guno_line": ("guno_lines", "{route}_guno_line.geojson"),
+    "guno_line_smooth": ("guno_lines_view", "{route}_guno_line_smooth.geojson"),
+}
+
+
+class RouteRun:
+    """1路線ぶんの処理状態: 読み込み済みジオメトリ・レイヤ・summary行。"""
+
+    def __init__(self, line_fp: Path, stations_dir: Optional[Path]):
+        self.route = line_fp.stem
+        self.line_fp = line_fp
+        self.stations_dir = stations_dir
+        self.rg = RouteGeometry.read(line_fp)
+        self.layers: Dict[str, gpd.GeoDataFrame] = {}
+        self.row: Dict[str, Any] = {"route": self.route, "file": str(line_fp)}
+
+
+class Stage:
+    """
+    メモリ上の変換1段。fn(run, params) は provides のレイヤを run.layers に置き、
+    summary に載せる値の dict（"status" を含む）を返す。
+    """
+
+    def __init__(self, name: str, fn: Callable[[RouteRun, Dict[str, Any]], Dict[str, Any]],
+                 needs: Tuple[str, ...], provides: Tuple[str, ...]):
+        self.name = name
+        self.fn = fn
+        self.needs = needs
+        self.provides = provides
+
+
+# ---------------- Stages ----------------
+def run_clusterab(run: RouteRun, params: Dict[str, Any]) -> Dict[str, Any]:
+    r = clusterab.process_route(run.line_fp, rg=run.rg, **params["clusterab"])
+    if r.get("status") == "OK":
+        run.layers["oneline_A"] = r["outA"]
+        run.layers["oneline_B"] = r["outB"]
+        run.layers["centerline"] = r["outC"]
+    return {k: r[k] for k in ("status", "segs", "mid_length_m", "cluster_iters_used") if k in r}
+
+
+def run_mainline(run: RouteRun, params: Dict[str, Any]) -> Dict[str, Any]:
+    if run.stations_dir is None:
+        return {"status": "NO_STATIONS_DIR"}
+    st_fp = mainline.find_station_file(run.stations_dir, run.route)
+    if st_fp is None:
+        return {"status": "NO_STATIONS_FILE"}
+    r = mainline.extract_guno_line_v3(run.rg.source, gpd.read_file(st_fp), rg=run.rg, **params["mainline"])
+    if r["status"] == "OK":
+        out = r["out"]
+        if params["keep_props_from"] == "first":
+            mainline.copy_first_props(out, run.rg.source)
+        run.layers["guno_line"] = out
+    return {k: r[k] for k in ("status", "hit_ratio", "length_m") if k in r}
+
+
+def run_smooth(run: RouteRun, params: Dict[str, Any]) -> Dict[str, Any]:
+    p = params["smooth"]
+    out = run.layers["guno_line"].copy()
+    out["geometry"] = out["geometry"].apply(
+        lambda g: smooth.smooth_geometry(g, p["iterations"], p["simplify_deg"], p["min_seg_deg"])
+    )
+    run.layers["guno_line_smooth"] = out
+    return {"status": "OK"}
+
+
+STAGES: List[Stage] = [
+    Stage("clusterab", run_clusterab, needs=(), provides=("oneline_A", "oneline_B", "centerline")),
+    Stage("mainline", run_mainline, needs=(), provides=("guno_line",)),
+    Stage("smooth", run_smooth, needs=("guno_line",), provides=("guno_line_smooth",)),
+]
+
+
+def plan_stages(layers: List[str]) -> List[Stage]:
+    """要求レイヤを作るのに必要な Stage を、依存関係をたどって STAGES の順で返す。"""
+    by_layer = {l: st for st in STAGES for l in st.provides}
+    unknown = [l for l in layers if l not in by_layer]
+    if unknown:
+        raise ValueError(f"unknown layer(s): {', '.join(unknown)} (choose from {', '.join(LAYERS)})")
+    need = set()
+    todo = list(layers)
+    while todo:
+        st = by_layer[todo.pop()]
+        if st.name not in need:
+            need.add(st.name)
+            todo.extend(st.needs)
+    return [st for st in STAGES if st.name in need]
+
+
+# ---------------- Per-route run ----------------
+def write_layer(run: RouteRun, layer: str, root: Path) -> None:
+    sub, name = LAYERS[layer]
+    d = root / sub
+    d.mkdir(parents=True, exist_ok=True)
+    run.layers[layer].to_file(d / name.format(route=run.route), driver="GeoJSON")
+
+
+def run_route(line_fp: Path, stations_dir: Optional[Path], out_dir: Path,
+              layers: List[str], debug: bool, params: Dict[str, Any]) -> Dict[str, Any]:
+    """1路線を全Stageに通して要求レイヤを書き、summary行を返す（ワーカープロセスからも呼ばれる）。"""
+    t_route = time.perf_counter()
+    try:
+        t0 = time.perf_counter()
+        run = RouteRun(line_fp, stations_dir)
+        run.rg.metric  # 投影もここで1回（以降の Stage は共有）
+        read_ms = (time.perf_counter() - t0) * 1000.0
+    except Exception as e:
+        return {"route": line_fp.stem, "file": str(line_fp), "status": f"ERROR: {type(e).__name__}: {e}"}
+    row = run.row
+    row["read_ms"] = round(read_ms, 1)
+
+    status = "OK"
+    for st in plan_stages(layers):
+        if any(l not in run.layers for l in st.needs):
+            row[f"{st.name}_status"] = "SKIPPED"
+            status = "PARTIAL"
+            continue
+        t0 = time.perf_counter()
+        try:
+            r = st.fn(run, params)
+        except Exception as e:
+            r = {"status": f"ERROR: {type(e).__name__}: {e}"}
+        row[f"{st.name}_ms"] = round((time.perf_counter() - t0) * 1000.0, 1)
+        for k, v in r.items():
+            row[f"{st.name}_{k}"] = v
+        if r.get("status") != "OK":
+            status = "PARTIAL"
+
+    t0 = time.perf_counter()
+    written = []
+    for layer in layers:
+        if layer in run.layers:
+            write_layer(run, layer, out_dir)
+            written.append(layer)
+    if debug:
+        for layer in run.layers:
+            if layer not in layers:
+                write_layer(run, layer, out_dir / "_debug")
+    row["write_ms"] = round((time.perf_counter() - t0) * 1000.0, 1)
+    row["layers_written"] = ";".join(written)
+    row["status"] = status if written else "NO_OUTPUT"
+    row["total_ms"] = round((time.perf_counter() - t_route) * 1000.0, 1)
+    return row
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Run the GUNO route geometry stages in one pass per route.")
+    ap.add_argument("--lines-dir", required=True, help="input route line GeoJSONs")
+    ap.add_argument("--stations-dir", default=None, help="per-route station GeoJSONs (needed for guno_line)")
+    ap.add_argument("--out-dir", required=True, help="output root dir")
+    ap.add_argument("--pattern", default="*.geojson", help="glob pattern for input files")
+    ap.add_argument("--layers", default="centerline,guno_line_smooth",
+                    help=f"comma separated final layers ({', '.join(LAYERS)})")
+    ap.add_argument("--debug", action="store_true", help="also write intermediate layers under <out-dir>/_debug")
+    ap.add_argument("--jobs", type=int, default=1, help="worker processes (1 = serial)")
+
+    # clusterab (build_guno_centerlines_clusterab_v3_3 の既定値)
+    ap.add_argument("--center-simplify-m", type=float, default=6.0)
+    ap.add_argument("--seg-min-m", type=float, default=12.0)
+    ap.add_argument("--cluster-iters", type=int, default=5)
+    ap.add_argument("--converge-frac", type=float, default=0.0)
+    ap.add_argument("--sample-n", type=int, default=500)
+    ap.add_argument("--seed-min-d", type=float, default=5.0)
+    ap.add_argument("--seed-max-d", type=float, default=120.0)
+    ap.add_argument("--seed-max-angle-deg", type=float, default=45.0)
+    ap.add_argument("--center-snap-tol-m", type=float, default=3.0)
+    ap.add_argument("--center-match-max-d", type=float, default=600.0)
+
+    # mainline (extract_guno_mainline_v3_station_score の既定値)
+    ap.add_argument("--mainline-snap-tol-m", type=float, default=5.0)
+    ap.add_argument("--mainline-simplify-m", type=float, default=6.0)
+    ap.add_argument("--station-hit-m", type=float, default=60.0)
+    ap.add_argument("--target-station-ratio", type=float, default=0.92)
+    ap.add_argument("--max-components", type=int, default=3)
+    ap.add_argument("--keep-props-from", choices=["first", "none"], default="first")
+
+    # smooth (smooth_guno_lines_v1 の既定値)
+    ap.add_argument("--smooth-iterations", type=int, default=1)
+    ap.add_argument("--smooth-simplify-deg", type=float, default=5e-5)
+    ap.add_argument("--smooth-min-seg-deg", type=float, default=2e-6)
+
+    args = ap.parse_args()
+
+    layers = [l.strip() for l in args.layers.split(",") if l.strip()]
+    try:
+        stages = plan_stages(layers)
+    except ValueError as e:
+        ap.error(str(e))
+
+    lines_dir = Path(args.lines_dir)
+    stations_dir = Path(args.stations_dir) if args.stations_dir else None
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    params: Dict[str, Any] = {
+        "clusterab": dict(
+            simplify_m=args.center_simplify_m,
+            seg_min_m=args.seg_min_m,
+            cluster_iters=args.cluster_iters,
+            sample_n=args.sample_n,
+            seed_min_d=args.seed_min_d,
+            seed_max_d=args.seed_max_d,
+            seed_max_angle_deg=args.seed_max_angle_deg,
+            snap_tol_m=args.center_snap_tol_m,
+            center_match_max_d=args.center_match_max_d,
+            converge_frac=args.converge_frac,
+        ),
+        "mainline": dict(
+            snap_tol_m=args.mainline_snap_tol_m,
+            simplify_m=args.mainline_simplify_m,
+            station_hit_m=args.station_hit_m,
+            target_station_ratio=args.target_station_ratio,
+            max_components=args.max_components,
+        ),
+        "keep_props_from": args.keep_props_from,
+        "smooth": dict(
+            iterations=args.smooth_iterations,
+            simplify_deg=args.smooth_simplify_deg,
+            min_seg_deg=args.smooth_min_seg_deg,
+        ),
+    }
+
+    files = sorted(lines_dir.glob(args.pattern))
+    print(f"[INFO] stages: {' -> '.join(st.name for st in stages)}  layers: {', '.join(layers)}")
+
+    t_all = time.perf_counter()
+    if args.jobs > 1 and len(files) > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs) as ex:
+            rows = list(ex.map(run_route, files, [stations_dir] * len(files), [out_dir] * len(files),
+                               [layers] * len(files), [args.debug] * len(files), [params] * len(files)))
+    else:
+        rows = [run_route(fp, stations_dir, out_dir, layers, args.debug, params) for fp in files]
+    wall_ms = (time.perf_counter() - t_all) * 1000.0
+
+    for r in rows:
+        stage_ms = "  ".join(f"{st.name}={r[st.name + '_ms']}" for st in stages if f"{st.name}_ms" in r)
+        print(f"[{r['status']}] {r['route']}  total={r.get('total_ms', '-')}ms  read={r.get('read_ms', '-')}  "
+              f"{stage_ms}  write={r.get('write_ms', '-')}")
+
+    summary_fp = out_dir / "_summary_pipeline.csv"
+    pd.DataFrame(rows).to_csv(summary_fp, index=False, encoding="utf-8-sig")
+    print(f"[OK] {len(rows)} routes in {wall_ms:.0f} ms")
+    print("[OK] summary:", summary_fp)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+overpass_cache.py — Persistent on-disk cache for Overpass API responses.
+
+Shared by fetch_line_v2.py and fetch_oedo.py so both fetchers read and write
+one store. Entries are content-addressed by a hash of the normalized query
+(plus the endpoint URL), expire after a TTL, and the whole store is kept under
+a size budget by evicting least-recently-used entries.
+
+Layout:
+  <cache_dir>/<key[:2]>/<key>.json
+    {"key": ..., "url": ..., "query": ..., "fetched_at": <unix time>, "data": {...}}
+
+The file mtime is bumped on every hit and is used as the LRU clock;
+"fetched_at" inside the entry is used for the TTL. "data" is always written
+last so large entries can be stream-parsed (get(..., compact=True)).
+
+Offline mode never touches the network: a miss simply returns None, which the
+fetchers already treat as "no data".
+
+Environment:
+  GEODO_OVERPASS_CACHE   default cache directory (~/.cache/geodo/overpass)
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+
+from overpass_stream import load_compact_entry
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "GEODO_OVERPASS_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "geodo", "overpass"),
+)
+DEFAULT_TTL_HOURS = 24 * 7
+DEFAULT_MAX_MB = 512
+
+# [timeout:N] / [maxsize:N] change how Overpass runs a query, not its result
+_SETTING_RE = re.compile(r"\[(timeout|maxsize):\d+\]")
+
+
+def normalize_query(query):
+    """Strip per-line whitespace, blank lines and run-time settings from a query."""
+    q = _SETTING_RE.sub("", query)
+    lines = [ln.strip() for ln in q.splitlines()]
+    return "\n".join(ln for ln in lines if ln)
+
+
+def query_key(query, url=""):
+    """Return the content address (sha256 hex) of a query against an endpoint."""
+    h = hashlib.sha256()
+    h.update(url.encode("utf-8"))
+    h.update(b"\0")
+    h.update(normalize_query(query).encode("utf-8"))
+    return h.hexdigest()
+
+
+class OverpassCache:
+    """On-disk response cache with TTL, size-bounded LRU eviction and hit/miss counters."""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, ttl_hours=DEFAULT_TTL_HOURS,
+                 max_mb=DEFAULT_MAX_MB, offline=False, enabled=True):
+        self.cache_dir = cache_dir
+        self.ttl_s = ttl_hours * 3600 if ttl_hours and ttl_hours > 0 else None
+        self.max_bytes = int(max_mb * 1024 * 1024) if max_mb and max_mb > 0 else None
+        self.offline = offline
+        self.enabled = enabled or offline
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "stored": 0,
+                      "evicted": 0, "offline_misses": 0}
+        # get() / put() run on fetcher threads and the scheduler's worker threads:
+        # counters and the size estimate are updated under this lock
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._size = None
+
+    @property
+    def last_hit(self):
+        """True when this thread's last get() was answered from disk (lets callers skip polite sleeps)."""
+        return getattr(self._local, "hit", False)
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.stats[name] += n
+
+    # ---------------- paths ----------------
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _entries(self):
+        """Yield (path, size, mtime) for every cache entry."""
+        if not os.path.isdir(self.cache_dir):
+            return
+        for sub in os.listdir(self.cache_dir):
+            d = os.path.join(self.cache_dir, sub)
+            if not os.path.isdir(d):
+                continue
+            for name in os.listdir(d):
+                if not name.endswith(".json"):
+                    continue
+                p = os.path.join(d, name)
+                try:
+                    st = os.stat(p)
+                except OSError:
+                    continue
+                yield p, st.st_size, st.st_mtime
+
+    def total_bytes(self):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            return self._size
+
+    # ---------------- lookup / store ----------------
+    def _is_fresh(self, entry):
+        # offline replay serves stale entries rather than nothing
+        if self.ttl_s is None or self.offline:
+            return True
+        return time.time() - entry.get("fetched_at", 0) <= self.ttl_s
+
+    def get(self, query, url="", compact=False):
+        """
+        Return cached response data for query, or None on miss/expiry.
+        compact: stream-parse the entry into the overpass_stream compact form.
+        """
+        self._local.hit = False
+        if not self.enabled:
+            return None
+        path = self._path(query_key(query, url))
+        try:
+            with open(path, encoding="utf-8") as f:
+                if compact:
+                    entry, data = load_compact_entry(f, self._is_fresh)
+                else:
+                    entry = json.load(f)
+                    data = entry.get("data")
+        except (OSError, ValueError):
+            self._count_miss()
+            return None
+
+        if not self._is_fresh(entry):
+            self._count("expired")
+            self._count_miss()
+            return None
+
+        try:
+            os.utime(path, None)  # LRU touch
+        except OSError:
+            pass
+        self._count("hits")
+        self._local.hit = True
+        return data
+
+    def _header(self, key, query, url):
+        return {
+            "key": key,
+            "url": url,
+            "query": normalize_query(query),
+            "fetched_at": time.time(),
+        }
+
+    def put(self, query, data, url=""):
+        """Store a successful response and evict LRU entries over the size budget."""
+        if not self.enabled or self.offline or data is None:
+            return
+        key = query_key(query, url)
+        entry = self._header(key, query, url)
+        entry["data"] = data
+
+        def write(f):
+            f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        self._store(key, write)
+
+    def put_file(self, query, src_path, url=""):
+        """Store a raw response body from a file without loading it (streamed fetches)."""
+        if not self.enabled or self.offline:
+            return
+        key = query_key(query, url)
+        head = json.dumps(self._header(key, query, url), ensure_ascii=False, separators=(",", ":"))
+
+        def write(f):
+            f.write(head[:-1].encode("utf-8") + b',"data":')
+            with open(src_path, "rb") as src:
+                shutil.copyfileobj(src, f)
+            f.write(b"}")
+        self._store(key, write)
+
+    def _store(self, key, write):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            write(f)
+        os.replace(tmp, path)
+        with self._lock:
+            self.stats["stored"] += 1
+            if self._size is not None:
+                self._size += os.path.getsize(path) - old_size
+            self.evict()
+
+    def evict(self):
+        """Delete least-recently-used entries until the store fits in max_bytes."""
+        with self._lock:
+            if self.max_bytes is None or self.total_bytes() <= self.max_bytes:
+                return
+            entries = sorted(self._entries(), key=lambda e: e[2])
+            total = sum(size for _, size, _ in entries)
+            for p, size, _ in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(p)
+                except OSError:
+                    continue
+                total -= size
+                self.stats["evicted"] += 1
+            self._size = total
+
+    def _count_miss(self):
+        with self._lock:
+            self.stats["misses"] += 1
+            if self.offline:
+                self.stats["offline_misses"] += 1
+
+    def summary(self):
+        """One-line counter summary for run logs."""
+        with self._lock:
+            s = dict(self.stats)
+        looked_up = s["hits"] + s["misses"]
+        rate = (s["hits"] / looked_up * 100.0) if looked_up else 0.0
+        mode = "offline" if self.offline else ("on" if self.enabled else "off")
+        return (f"cache[{mode}] hits={s['hits']} misses={s['misses']} ({rate:.0f}% hit) "
+                f"expired={s['expired']} stored={s['stored']} evicted={s['evicted']}")
+
+
+def cache_from_argv(argv):
+    """
+    Build an OverpassCache from fetcher command-line flags:
+      --offline           replay from cache only, never touch the network
+      --no-cache          bypass the cache entirely
+      --cache-dir DIR     cache directory (default: $GEODO_OVERPASS_CACHE or ~/.cache/geodo/overpass)
+      --cache-ttl HOURS   entry lifetime (default 168; 0 = never expire)
+      --cache-max-mb MB   size budget before LRU eviction (default 512; 0 = unbounded)
+    """
+    def opt(name, default):
+        if name in argv:
+            i = argv.index(name)
+            if i + 1 < len(argv):
+                return argv[i + 1]
+        return default
+
+    return OverpassCache(
+        cache_dir=opt("--cache-dir", DEFAULT_CACHE_DIR),
+        ttl_hours=float(opt("--cache-ttl", DEFAULT_TTL_HOURS)),
+        max_mb=float(opt("--cache-max-mb", DEFAULT_MAX_MB)),
+        offline="--offline" in argv,
+        enabled="--no-cache" not in argv,
+    )
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+overpass_scheduler.py — asyncio request scheduler for the Overpass fetchers.
+
+Keeps up to `concurrency` queries in flight against an Overpass endpoint while
+  - a per-host token bucket limits the request rate,
+  - a 429/504 (or Retry-After) from any request pauses every request to that host,
+  - retries use capped exponential backoff with jitter instead of unbounded doubling,
+  - a priority queue lets follow-up work run before new work:
+        PRIO_STOPS       stop-node lookups for a route already in progress
+        PRIO_GEOM        relation geometry / up-pair lookups
+        PRIO_CANDIDATES  candidate searches that start a new route
+
+The fetchers are synchronous; they run their per-route pipelines in threads and
+call `request()`, which hands the query to the scheduler's event loop (running in
+a background thread) and blocks until the answer is back. Inside a coroutine,
+`await query()` can be used directly.
+
+Responses go through the shared OverpassCache when one is given.
+See overpass_stub_server.py for an offline endpoint to benchmark against.
+"""
+
+import asyncio
+import itertools
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+
+from overpass_stream import read_response_compact
+
+PRIO_STOPS = 0
+PRIO_GEOM = 1
+PRIO_CANDIDATES = 2
+
+RETRY_STATUS = (429, 502, 503, 504)
+
+
+class TokenBucket:
+    """Async token bucket; `penalize()` blocks all takers until a deadline."""
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(burst))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                await asyncio.sleep((1.0 - self.tokens) / self.rate)
+
+    def penalize(self, seconds):
+        """
+        Pause the host for `seconds` (extends, never shortens, an existing pause).
+        Returns True if the host was not already paused.
+        """
+        now = time.monotonic()
+        was_open = self.blocked_until <= now
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0.0
+        self.updated = now
+        return was_open
+
+
+class OverpassScheduler:
+    """Priority-queued, rate-limited Overpass client with N requests in flight."""
+
+    def __init__(self, url, headers=None, concurrency=2, rate=1.0, burst=2,
+                 retries=5, backoff=4.0, max_backoff=60.0, timeout=120, cache=None):
+        self.url = url
+        self.headers = headers or {}
+        self.concurrency = max(1, int(concurrency))
+        self.rate = rate
+        self.burst = burst
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.cache = cache
+        self.stats = {"sent": 0, "ok": 0, "retried": 0, "throttled": 0, "failed": 0, "cached": 0}
+
+        self._buckets = {}
+        self._seq = itertools.count()
+        self._queue = None
+        self._workers = []
+        self._loop = None
+        self._thread = None
+
+    # ---------------- lifecycle ----------------
+    async def __aenter__(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.PriorityQueue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        return self
+
+    async def __aexit__(self, *exc):
+        for w in self._workers:
+            w.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def start(self):
+        """Run the event loop in a background thread (for use from sync code)."""
+        ready = threading.Event()
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.__aenter__())
+            ready.set()
+            loop.run_forever()
+            loop.run_until_complete(self.__aexit__(None, None, None))
+            loop.close()
+
+        self._thread = threading.Thread(target=run, name="overpass-scheduler", daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._thread = None
+
+    # ---------------- public API ----------------
+    async def query(self, query, priority=PRIO_CANDIDATES, fresh=False, stream=False):
+        """
+        Queue a query and wait for its JSON result (None after all retries fail).
+        fresh: do not answer from the cache (the response is still stored).
+        stream: parse incrementally into the overpass_stream compact form.
+        """
+        if self.cache is not None and (not fresh or self.cache.offline):
+            # off the loop thread: a large entry is stream-parsed from disk
+            cached = await asyncio.to_thread(self.cache.get, query, self.url, compact=stream)
+            if cached is not None or self.cache.offline:
+                self.stats["cached"] += 1
+                return cached
+        fut = self._loop.create_future()
+        await self._queue.put((priority, next(self._seq), query, stream, fut))
+        return await fut
+
+    def request(self, query, priority=PRIO_CANDIDATES, fresh=False, stream=False):
+        """Blocking `query()` for worker threads; the loop must have been `start()`ed."""
+        return asyncio.run_coroutine_threadsafe(self.query(query, priority, fresh, stream),
+                                                self._loop).result()
+
+    def summary(self):
+        s = self.stats
+        return (f"scheduler[x{self.concurrency}] sent={s['sent']} ok={s['ok']} retried={s['retried']} "
+                f"throttled={s['throttled']} failed={s['failed']} cached={s['cached']}")
+
+    # ---------------- internals ----------------
+    def _bucket(self):
+        host = urlparse(self.url).netloc
+        if host not in self._buckets:
+            self._buckets[host] = TokenBucket(self.rate, self.burst)
+        return self._buckets[host]
+
+    def _post(self, query, stream=False):
+        """Blocking HTTP POST, run in a thread. Returns (status, json|None, retry_after|None)."""
+        try:
+            resp = requests.post(self.url, data={"data": query}, headers=self.headers,
+                                 timeout=self.timeout, stream=stream)
+        except requests.exceptions.Timeout:
+            return "timeout", None, None
+        except Exception as e:
+            return f"error: {e}", None, None
+        retry_after = None
+        ra = resp.headers.get("Retry-After")
+        if ra and ra.strip().isdigit():
+            retry_after = float(ra.strip())
+        if resp.status_code != 200:
+            return resp.status_code, None, retry_after
+        try:
+            if stream:
+                # stored in the cache while spooling, see _execute
+                return 200, read_response_compact(resp, self.cache, query, self.url), None
+            return 200, resp.json(), None
+        except ValueError:
+            return "bad json", None, None
+        except requests.exceptions.RequestException as e:
+            return f"error: {e}", None, None
+
+    def _backoff_s(self, attempt):
+        wait = min(self.backoff * (2 ** attempt), self.max_backoff)
+        return wait * random.uniform(0.8, 1.2)
+
+    async def _execute(self, query, stream=False):
+        bucket = self._bucket()
+        attempt = 0
+        # 429 only means "no free slot": it pauses the host but does not use up
+        # a retry, up to a hard cap on total attempts
+        for _ in range(self.retries * 4):
+            if attempt >= self.retries:
+                break
+            await bucket.acquire()
+            self.stats["sent"] += 1
+            status, data, retry_after = await asyncio.to_thread(self._post, query, stream)
+            if status == 200:
+                self.stats["ok"] += 1
+                if self.cache is not None and not stream:
+                    self.cache.put(query, data, self.url)
+                return data
+            wait = retry_after if retry_after is not None else self._backoff_s(attempt)
+            if status in RETRY_STATUS:
+                # the server is overloaded for everyone: pause the whole host
+                self.stats["throttled"] += 1
+                if bucket.penalize(wait):
+                    print(f"  [HTTP {status}] host paused {wait:.1f}s", flush=True)
+            else:
+                print(f"  [{status}] retry in {wait:.0f}s ({attempt + 1}/{self.retries})", flush=True)
+                await asyncio.sleep(wait)
+            if status != 429:
+                attempt += 1
+            self.stats["retried"] += 1
+        self.stats["failed"] += 1
+        return None
+
+    async def _worker(self):
+        while True:
+            _, _, query, stream, fut = await self._queue.get()
+            try:
+                data = await self._execute(query, stream)
+                if not fut.done():
+                    fut.set_result(data)
+            except Exception as e:  # never let one query kill a worker
+                if not fut.done():
+                    fut.set_exception(e)
+            finally:
+                self._queue.task_done()
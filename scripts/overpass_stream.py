@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+overpass_stream.py — Streaming parser for large Overpass `out geom` responses.
+
+`resp.json()` materializes the whole payload (raw bytes, decoded text and one
+dict per coordinate) before anything looks at it. Here the response body is
+spooled to a temp file in chunks and then walked incrementally: only one
+element member is decoded at a time, and every `geometry` list of
+{"lat", "lon"} dicts is packed straight into an array('d') and exposed as an
+(n, 2) float64 NumPy array under the key "coords".
+
+The result has the usual Overpass shape ({"elements": [...], ...}) except that
+"geometry" is replaced by "coords"; extract_track_coords() and track_chain.py
+accept either form. Peak memory is the compact arrays plus one read buffer.
+
+Cache entries (overpass_cache.py) wrap the raw response under "data", which is
+written last, so they can be read the same way (load_compact_entry).
+
+Self check: parse saved responses (or a synthetic node-heavy one) at several
+read chunk sizes and compare with json.loads, so values split across a read
+boundary are exercised:
+
+  python overpass_stream.py [response.json ...]
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import tempfile
+from array import array
+
+import numpy as np
+
+READ_CHUNK = 1 << 16
+# read chunk sizes tried by the self check (odd sizes move the cut points)
+CHECK_CHUNKS = (1000, 4096, 8192, READ_CHUNK)
+
+_WS = " \t\n\r"
+# characters that can continue a number cut off at the end of the buffer
+_NUM_MORE = ".eE+-0123456789"
+
+
+class JsonStream:
+    """Pull reader over a text file: walk objects/arrays, decode leaf values."""
+
+    def __init__(self, fp, chunk=READ_CHUNK):
+        self.fp = fp
+        self.chunk = chunk
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.dec = json.JSONDecoder()
+
+    def _more(self):
+        # read at least as much as is still buffered, so one large value costs
+        # O(n) re-decoding attempts in total rather than O(n^2)
+        data = self.fp.read(max(self.chunk, len(self.buf) - self.pos))
+        if not data:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WS:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._more():
+                raise ValueError("unexpected end of JSON stream")
+
+    def expect(self, ch):
+        if self.peek() != ch:
+            raise ValueError(f"expected {ch!r} at offset {self.pos}, got {self.buf[self.pos]!r}")
+        self.pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                v, end = self.dec.raw_decode(self.buf, self.pos)
+                # a number cut off by the end of the buffer decodes as a shorter
+                # one ("35." -> 35): read on while the number may continue
+                cut = (isinstance(v, (int, float)) and not isinstance(v, bool)
+                       and (end == len(self.buf) or self.buf[end] in _NUM_MORE))
+                if not cut or self.eof:
+                    self.pos = end
+                    return v
+            except ValueError:
+                if self.eof:
+                    raise
+            if not self._more():
+                v, self.pos = self.dec.raw_decode(self.buf, self.pos)
+                return v
+
+    def keys(self):
+        """Iterate the keys of the object at the cursor; the caller consumes each value."""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            c = self.peek()
+            self.pos += 1
+            if c == "}":
+                return
+            if c != ",":
+                raise ValueError(f"expected ',' or '}}' at offset {self.pos - 1}")
+
+    def items(self):
+        """Iterate the array at the cursor; the caller consumes each item."""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield
+            c = self.peek()
+            self.pos += 1
+            if c == "]":
+                return
+            if c != ",":
+                raise ValueError(f"expected ',' or ']' at offset {self.pos - 1}")
+
+
+def compact_geometry(geom):
+    """[{"lat", "lon"}, ...] -> (n, 2) float64 array of lon/lat (null points dropped)."""
+    a = array("d")
+    for p in geom:
+        if p:
+            a.append(p["lon"])
+            a.append(p["lat"])
+    return np.frombuffer(a, dtype=np.float64).reshape(-1, 2)
+
+
+def _compact(obj):
+    geom = obj.pop("geometry", None)
+    if geom is not None:
+        obj["coords"] = compact_geometry(geom)
+    return obj
+
+
+def _read_element(js):
+    el = {}
+    for key in js.keys():
+        if key == "members" and js.peek() == "[":
+            el["members"] = [_compact(js.value()) for _ in js.items()]
+        elif key == "geometry" and js.peek() == "[":
+            el["coords"] = compact_geometry(js.value())
+        else:
+            el[key] = js.value()
+    return el
+
+
+def _read_response(js):
+    out = {}
+    for key in js.keys():
+        if key == "elements" and js.peek() == "[":
+            out["elements"] = [_read_element(js) for _ in js.items()]
+        else:
+            out[key] = js.value()
+    return out
+
+
+def load_compact(fp):
+    """Parse an Overpass JSON response from a text file into the compact form."""
+    return _read_response(JsonStream(fp))
+
+
+def load_compact_entry(fp, accept=None):
+    """
+    Parse a cache entry {..., "data": <response>} whose "data" comes last.
+    accept(header) is called with the keys read before "data"; if it returns
+    False the response is not parsed. Returns (header, data or None).
+    """
+    js = JsonStream(fp)
+    header = {}
+    data = None
+    for key in js.keys():
+        if key != "data":
+            header[key] = js.value()
+            continue
+        if accept is not None and not accept(header):
+            return header, None
+        data = _read_response(js)
+    return header, data
+
+
+def read_response_compact(resp, cache=None, query=None, url=""):
+    """
+    Spool a `requests` response opened with stream=True to a temp file, parse it
+    with load_compact() and, if a cache is given, store the raw body as its entry.
+    Raises ValueError on malformed JSON.
+    """
+    fd, tmp = tempfile.mkstemp(prefix="overpass-", suffix=".json")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in resp.iter_content(READ_CHUNK):
+                f.write(chunk)
+        with open(tmp, encoding="utf-8") as f:
+            data = load_compact(f)
+        if cache is not None:
+            cache.put_file(query, tmp, url)
+        return data
+    finally:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+
+# ---------------- self check ----------------
+def synthetic_response(n_nodes=20000, n_ways=50, seed=0):
+    """Node-heavy `out body` / `out geom` style response text (~2 MB for the defaults)."""
+    rnd = random.Random(seed)
+    elements = []
+    for i in range(n_nodes):
+        el = {"type": "node", "id": 1000000 + i, "lat": round(rnd.uniform(-90, 90), 7),
+              "lon": round(rnd.uniform(-180, 180), 7)}
+        if i % 3 == 0:
+            el["tags"] = {"name": f"駅{i}", "ele": rnd.uniform(-1e-7, 1e7), "level": -rnd.randint(0, 99)}
+        elements.append(el)
+    for i in range(n_ways):
+        geom = [{"lat": rnd.uniform(35, 36), "lon": rnd.uniform(139, 140)} for _ in range(rnd.randint(2, 400))]
+        elements.append({"type": "way", "id": 2000000 + i, "geometry": geom, "tags": {"railway": "rail"}})
+    return json.dumps({"version": 0.6, "generator": "synthetic", "elements": elements}, ensure_ascii=False)
+
+
+def _expected(data):
+    for el in data.get("elements", []):
+        _compact(el)
+        for m in el.get("members", []):
+            _compact(m)
+    return data
+
+
+def _same(a, b):
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        return isinstance(a, np.ndarray) and isinstance(b, np.ndarray) and np.array_equal(a, b)
+    if isinstance(a, dict):
+        return isinstance(b, dict) and a.keys() == b.keys() and all(_same(a[k], b[k]) for k in a)
+    if isinstance(a, list):
+        return isinstance(b, list) and len(a) == len(b) and all(_same(x, y) for x, y in zip(a, b))
+    return type(a) is type(b) and a == b
+
+
+def check_chunks(text, chunks=CHECK_CHUNKS):
+    """Parse text at each read chunk size; returns {chunk: error or None}."""
+    expected = _expected(json.loads(text))
+    out = {}
+    for chunk in chunks:
+        try:
+            got = _read_response(JsonStream(io.StringIO(text), chunk))
+            out[chunk] = None if _same(got, expected) else "result differs from json.loads"
+        except ValueError as e:
+            out[chunk] = f"{type(e).__name__}: {e}"
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Check the streaming parser against json.loads at several read chunk sizes.")
+    ap.add_argument("files", nargs="*", help="Overpass JSON responses (default: a synthetic node-heavy response)")
+    args = ap.parse_args()
+
+    sources = [(fp, lambda fp=fp: open(fp, encoding="utf-8").read()) for fp in args.files]
+    sources = sources or [("<synthetic>", synthetic_response)]
+    failed = 0
+    for name, read in sources:
+        text = read()
+        for chunk, err in check_chunks(text).items():
+            if err:
+                failed += 1
+                print(f"[NG] {name} chunk={chunk}: {err}")
+            else:
+                print(f"[OK] {name} chunk={chunk}  {len(text):,} chars")
+    if failed:
+        raise SystemExit(f"[ERROR] {failed} checks failed")
+
+
+if __name__ == "__main__":
+    main()
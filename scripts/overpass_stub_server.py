@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+overpass_stub_server.py — Local stand-in for the Overpass API.
+
+Serves POST/GET /api/interpreter like the real endpoint, with tunable latency,
+a limited number of query slots (extra concurrent requests get 429 + Retry-After,
+as Overpass does) and optional random 504s. Responses are replayed from an
+OverpassCache directory when the query is found there, otherwise a small
+synthetic answer is returned.
+
+Point the fetchers at it with:
+  GEODO_OVERPASS_URL=http://127.0.0.1:8765/api/interpreter python3 fetch_line_v2.py ...
+
+Usage:
+  python3 overpass_stub_server.py [--port 8765] [--latency 0.5] [--slots 2]
+                                  [--error-rate 0.0] [--replay-dir DIR]
+  python3 overpass_stub_server.py --bench 40 [--latency 0.2] [--slots 4]
+      benchmark overpass_scheduler.py throughput offline for several concurrency levels
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from overpass_cache import query_key
+
+REAL_OVERPASS_URL = "https://overpass-api.de/api/interpreter"
+
+
+class StubState:
+    def __init__(self, latency, slots, error_rate, replay_dir, replay_url):
+        self.latency = latency
+        self.slots = slots
+        self.error_rate = error_rate
+        self.replay_dir = replay_dir
+        self.replay_url = replay_url
+        self.active = 0
+        self.lock = threading.Lock()
+        self.counts = {"requests": 0, "ok": 0, "429": 0, "504": 0, "replayed": 0}
+
+    def replay(self, query):
+        if not self.replay_dir:
+            return None
+        key = query_key(query, self.replay_url)
+        path = f"{self.replay_dir}/{key[:2]}/{key}.json"
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f).get("data")
+        except (OSError, ValueError):
+            return None
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, code, body, extra_headers=None):
+            raw = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(raw)))
+            for k, v in (extra_headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def _serve(self, query):
+            with state.lock:
+                state.counts["requests"] += 1
+                if state.active >= state.slots:
+                    state.counts["429"] += 1
+                    busy = True
+                else:
+                    state.active += 1
+                    busy = False
+            if busy:
+                self._send(429, {"remark": "rate_limited"}, {"Retry-After": "1"})
+                return
+            try:
+                time.sleep(state.latency)
+                if state.error_rate and random.random() < state.error_rate:
+                    with state.lock:
+                        state.counts["504"] += 1
+                    self._send(504, {"remark": "gateway timeout"})
+                    return
+                data = state.replay(query)
+                with state.lock:
+                    state.counts["ok"] += 1
+                    if data is not None:
+                        state.counts["replayed"] += 1
+                if data is None:
+                    data = {"version": 0.6, "generator": "overpass-stub", "elements": [],
+                            "remark": f"stub for query of {len(query)} chars"}
+                self._send(200, data)
+            finally:
+                with state.lock:
+                    state.active -= 1
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            form = parse_qs(self.rfile.read(length).decode("utf-8"))
+            self._serve(form.get("data", [""])[0])
+
+        def do_GET(self):
+            self._serve(parse_qs(urlparse(self.path).query).get("data", [""])[0])
+
+    return Handler
+
+
+def start_stub(port=0, latency=0.5, slots=2, error_rate=0.0, replay_dir=None,
+               replay_url=REAL_OVERPASS_URL):
+    """Start the stub in a background thread. Returns (server, state, url)."""
+    state = StubState(latency, slots, error_rate, replay_dir, replay_url)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/api/interpreter"
+    return server, state, url
+
+
+def bench(n_queries, latency, slots, error_rate, levels=(1, 2, 4, 8)):
+    """Run n_queries through OverpassScheduler at several concurrency levels."""
+    import asyncio
+    from overpass_scheduler import OverpassScheduler, PRIO_STOPS, PRIO_CANDIDATES
+
+    print(f"stub: latency={latency}s slots={slots} error_rate={error_rate}  queries={n_queries}")
+    print(f"{'concurrency':>11} {'wall_s':>8} {'q/s':>6} {'sent':>5} {'throttled':>9} {'failed':>6}")
+    for c in levels:
+        server, state, url = start_stub(latency=latency, slots=slots, error_rate=error_rate)
+
+        async def run():
+            async with OverpassScheduler(url, concurrency=c, rate=50.0, burst=c,
+                                         backoff=0.2, max_backoff=2.0) as sched:
+                tasks = [sched.query(f"[out:json];relation({i});out tags;",
+                                     PRIO_STOPS if i % 3 == 0 else PRIO_CANDIDATES)
+                         for i in range(n_queries)]
+                await asyncio.gather(*tasks)
+                return sched.stats
+
+        t0 = time.perf_counter()
+        stats = asyncio.run(run())
+        wall = time.perf_counter() - t0
+        server.shutdown()
+        print(f"{c:>11} {wall:>8.2f} {n_queries / wall:>6.1f} {stats['sent']:>5} "
+              f"{stats['throttled']:>9} {stats['failed']:>6}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Local stub Overpass server (offline fetch benchmarks).")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency", type=float, default=0.5, help="seconds per answered query")
+    ap.add_argument("--slots", type=int, default=2, help="concurrent queries before 429")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="probability of a 504")
+    ap.add_argument("--replay-dir", default=None, help="OverpassCache dir to replay real responses from")
+    ap.add_argument("--replay-url", default=REAL_OVERPASS_URL, help="endpoint URL the cache entries were keyed with")
+    ap.add_argument("--bench", type=int, default=0, help="run a scheduler benchmark with N queries and exit")
+    args = ap.parse_args()
+
+    if args.bench:
+        bench(args.bench, args.latency, args.slots, args.error_rate)
+        return
+
+    server, state, url = start_stub(args.port, args.latency, args.slots, args.error_rate,
+                                    args.replay_dir, args.replay_url)
+    print(f"[OK] stub Overpass at {url}  (Ctrl+C to stop)", flush=True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(f"[OK] served: {state.counts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,39 +3,143 @@
 
 import argparse
 from pathlib import Path
-from typing import List, Union
+from typing import List, Tuple, Union
 
 import geopandas as gpd
+import numpy as np
+import shapely
 from shapely.geometry import LineString, MultiLineString
 from shapely.ops import linemerge, unary_union
 
 
+# ---------- 配列エンジン ----------
+# 複数パートは (N, 2) float64 の座標配列 + パート境界 offsets（長さ パート数+1、
+# offsets[k]:offsets[k+1] が k 番目のパート）でまとめて扱う。
+# MultiLineString の全パートを 1 回の呼び出しで処理できる。
+def parts_to_ragged(lines) -> Tuple[np.ndarray, np.ndarray]:
+    """LineString 配列 -> (xy, offsets)"""
+    xy, idx = shapely.get_coordinates(np.asarray(lines, dtype=object), return_index=True)
+    counts = np.bincount(idx, minlength=len(lines))
+    offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+    return xy, offsets
+
+
+def ragged_to_parts(xy: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """(xy, offsets) -> LineString 配列"""
+    idx = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    return shapely.linestrings(xy, indices=idx)
+
+
+def chaikin_smooth_xy(xy: np.ndarray, offsets: np.ndarray, iterations: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Chaikin corner cutting の配列版（全パート一括）。
+    各反復で n 点のパートは 2n 点になる: [p0, q0, r0, q1, r1, ..., p(n-1)]。
+    隣接点の組 g は出力の 2g+1 (q) / 2g+2 (r) に入るので、全体を一度に
+    ストライドで書き込み、パートをまたぐ組が書いた位置だけ各パートの始点・終点で上書きする。
+    3 点未満のパートはそのまま（従来どおり）。
+    """
+    xy = np.asarray(xy, dtype=np.float64)[:, :2]
+    offsets = np.asarray(offsets, dtype=np.int64)
+    counts = np.diff(offsets)
+    if iterations <= 0 or len(xy) == 0:
+        return xy, offsets
+    short = counts < 3
+    if short.any():
+        # 短いパートを除いて平滑化し、元の位置に戻す
+        if short.all():
+            return xy, offsets
+        part = np.repeat(short, counts)
+        sm_xy, sm_off = chaikin_smooth_xy(xy[~part], np.concatenate(([0], np.cumsum(counts[~short]))), iterations)
+        new_counts = counts.copy()
+        new_counts[~short] = np.diff(sm_off)
+        new_off = np.concatenate(([0], np.cumsum(new_counts))).astype(np.int64)
+        out = np.empty((new_off[-1], 2))
+        out[np.repeat(~short, new_counts)] = sm_xy
+        out[np.repeat(short, new_counts)] = xy[part]
+        return out, new_off
+
+    for _ in range(iterations):
+        p0 = xy[:-1]
+        p1 = xy[1:]
+        out = np.empty((2 * len(xy), 2))
+        out[1:-1:2] = 0.75 * p0 + 0.25 * p1
+        out[2::2] = 0.25 * p0 + 0.75 * p1
+        out[2 * offsets[:-1]] = xy[offsets[:-1]]
+        out[2 * offsets[1:] - 1] = xy[offsets[1:] - 1]
+        xy = out
+        offsets = 2 * offsets
+    return xy, offsets
+
+
+def remove_tiny_segments_xy(xy: np.ndarray, offsets: np.ndarray, min_seg_len: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    トゲ取りの配列版（全パート一括）。各パートの始点・終点は残し、途中の点は
+    直前に残した点から min_seg_len 未満なら落とす。
+    まず隣接点間の距離を一括で判定し、点が落ちたパートだけ、その位置から
+    「直前に残した点」と比べ直す。3 点未満のパートはそのまま。
+    """
+    xy = np.asarray(xy, dtype=np.float64)[:, :2]
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n = len(xy)
+    if n == 0:
+        return xy, offsets
+
+    def seg_len(d):
+        # 従来の (dx*dx + dy*dy) ** 0.5 と同じ丸め（np.sqrt とは末尾ビットが異なることがある）
+        return np.float_power(d[..., 0] * d[..., 0] + d[..., 1] * d[..., 1], 0.5)
+
+    starts = offsets[:-1]
+    ends = offsets[1:] - 1
+    counts = np.diff(offsets)
+    long_part = counts >= 3
+    interior = np.ones(n, dtype=bool)
+    interior[starts] = False
+    interior[ends] = False
+    interior &= np.repeat(long_part, counts)
+
+    keep = np.ones(n, dtype=bool)
+    step = np.zeros(n)
+    step[1:] = seg_len(np.diff(xy, axis=0))
+    keep[interior] = step[interior] >= min_seg_len
+    for k in np.flatnonzero(long_part & np.add.reduceat(~keep, starts).astype(bool)).tolist():
+        s, e = int(starts[k]), int(ends[k])
+        first = s + int(np.argmin(keep[s:e]))
+        pts = xy[first - 1:e].tolist()
+        flags = keep[first:e].tolist()
+        x0, y0 = pts[0]
+        last_kept = True
+        for j in range(1, len(pts)):
+            x1, y1 = pts[j]
+            if not last_kept:
+                dx = x1 - x0
+                dy = y1 - y0
+                flags[j - 1] = (dx * dx + dy * dy) ** 0.5 >= min_seg_len
+            last_kept = flags[j - 1]
+            if last_kept:
+                x0, y0 = x1, y1
+        keep[first:e] = flags
+
+    new_counts = np.add.reduceat(keep.astype(np.int64), starts)
+    new_off = np.concatenate(([0], np.cumsum(new_counts))).astype(np.int64)
+    return xy[keep], new_off
+
+
+# ---------- 単体ジオメトリ向け ----------
 def chaikin_smooth_coords(coords, iterations=1):
     """
     Chaikin corner cutting (軽い平滑化).
     iterations=1〜2推奨。やりすぎると路線が痩せる/ズレる。
+    coords: (n, 2) 配列または座標タプルのリスト。戻り値は (m, 2) 配列。
     """
     if len(coords) < 3:
         return coords
-
-    for _ in range(iterations):
-        new_coords = [coords[0]]
-        for i in range(len(coords) - 1):
-            p0 = coords[i]
-            p1 = coords[i + 1]
-            q = (0.75 * p0[0] + 0.25 * p1[0], 0.75 * p0[1] + 0.25 * p1[1])
-            r = (0.25 * p0[0] + 0.75 * p1[0], 0.25 * p0[1] + 0.75 * p1[1])
-            new_coords.extend([q, r])
-        new_coords.append(coords[-1])
-        coords = new_coords
-
-    return coords
+    xy = np.asarray(coords, dtype=np.float64)[:, :2]
+    sm, _ = chaikin_smooth_xy(xy, np.array([0, len(xy)]), iterations)
+    return sm
 
 
 def smooth_linestring(ls: LineString, iterations: int) -> LineString:
-    coords = list(ls.coords)
-    sm = chaikin_smooth_coords(coords, iterations=iterations)
-    return LineString(sm)
+    return LineString(chaikin_smooth_coords(np.asarray(ls.coords), iterations=iterations))
 
 
 def remove_tiny_segments(ls: LineString, min_seg_len_deg: float) -> LineString:
@@ -43,25 +147,27 @@ def remove_tiny_segments(ls: LineString, min_seg_len_deg: float) -> LineString:
     EPSG:4326の度単位なので、超小さい値での間引き（トゲ取り用）。
     min_seg_len_deg は 1e-6〜5e-6 あたりが安全（東京付近で0.1〜0.5m程度）。
     """
-    coords = list(ls.coords)
-    if len(coords) < 3:
-        return ls
-
-    kept = [coords[0]]
-    for i in range(1, len(coords) - 1):
-        x0, y0 = kept[-1]
-        x1, y1 = coords[i]
-        dx = x1 - x0
-        dy = y1 - y0
-        if (dx * dx + dy * dy) ** 0.5 >= min_seg_len_deg:
-            kept.append(coords[i])
-    kept.append(coords[-1])
-
-    if len(kept) < 2:
+    xy = np.asarray(ls.coords)
+    if len(xy) < 3:
         return ls
+    kept, _ = remove_tiny_segments_xy(xy, np.array([0, len(xy)]), min_seg_len_deg)
     return LineString(kept)
 
 
+def smooth_parts(lines, iterations: int, simplify_deg: float, min_seg_len_deg: float) -> np.ndarray:
+    """LineString 配列をまとめて 平滑化 -> 簡略化 -> トゲ取り（1 パートずつ処理するのと同じ結果）。"""
+    xy, offsets = parts_to_ragged(lines)
+    xy, offsets = chaikin_smooth_xy(xy, offsets, iterations)
+    parts = ragged_to_parts(xy, offsets)
+    if simplify_deg and simplify_deg > 0:
+        parts = shapely.simplify(parts, simplify_deg, preserve_topology=True)
+    if min_seg_len_deg and min_seg_len_deg > 0:
+        xy, offsets = parts_to_ragged(parts)
+        xy, offsets = remove_tiny_segments_xy(xy, offsets, min_seg_len_deg)
+        parts = ragged_to_parts(xy, offsets)
+    return parts
+
+
 def smooth_geometry(geom, iterations: int, simplify_deg: float, min_seg_len_deg: float):
     """
     LineString / MultiLineString 両対応で平滑化＋簡略化。
@@ -70,28 +176,15 @@ def smooth_geometry(geom, iterations: int, simplify_deg: float, min_seg_len_deg:
     if geom is None or geom.is_empty:
         return geom
 
-    # MultiLineString -> 各LineStringを処理
+    # MultiLineString -> 全パートを配列エンジンで一括処理
     if geom.geom_type == "MultiLineString":
-        parts = []
-        for ls in geom.geoms:
-            s = smooth_linestring(ls, iterations)
-            if simplify_deg and simplify_deg > 0:
-                s = s.simplify(simplify_deg, preserve_topology=True)
-            if min_seg_len_deg and min_seg_len_deg > 0:
-                s = remove_tiny_segments(s, min_seg_len_deg)
-            parts.append(s)
-
-        merged = linemerge(unary_union(parts))
+        parts = smooth_parts(list(geom.geoms), iterations, simplify_deg, min_seg_len_deg)
+        merged = linemerge(unary_union(list(parts)))
         # merged が LineString / MultiLineString どちらでもOK
         return merged
 
     if geom.geom_type == "LineString":
-        s = smooth_linestring(geom, iterations)
-        if simplify_deg and simplify_deg > 0:
-            s = s.simplify(simplify_deg, preserve_topology=True)
-        if min_seg_len_deg and min_seg_len_deg > 0:
-            s = remove_tiny_segments(s, min_seg_len_deg)
-        return s
+        return smooth_parts([geom], iterations, simplify_deg, min_seg_len_deg)[0]
 
     # 想定外はそのまま
     return geom
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+station_order.py — Station ordering for the station-path mainline builders
+(build_guno_mainline_by_stationpath_v4*.py) when no order field is available.
+
+Track chainage (order_by_chainage): the line's two end stations come from a
+double sweep over track distances (track_graph.StationRouter): e1 farthest
+from station 0, e2 farthest from e1, so only two shortest-path trees are
+grown. Every station is projected onto the e1 -> e2 track route and ordered by
+its chainage along it. Projecting onto the route rather than comparing track
+distances keeps stations snapped onto the other track of a double-track line
+in place, even where that track only connects through a distant crossover.
+
+  - branches: stations further than branch_min_m from the trunk route are
+    anchored at the trunk station nearest to them along the track (not at
+    their projected chainage, which lands before the junction on a curved
+    trunk). Each anchor's branch stations are visited in line by track
+    distance and spliced in next to it where they add the least track length.
+  - loops (is_loop): track distances are no help on a loop run as two
+    single-direction rings (a station snapped onto the other ring is reached
+    the long way round), so loop stations are ordered by chainage along the
+    longest closed line of the merged track instead (order_on_ring), cut at
+    the widest gap and marked closed.
+
+Fallback (order_by_2opt): a nearest-neighbour path from one end of the
+straight-line distance matrix, improved with 2-opt moves (all move ends of one
+start position evaluated as one array). It is always computed and replaces
+the track-based ordering when that is unavailable or scores lower.
+
+Every ordering gets a quality score in (0, 1]: the minimum spanning tree length
+of the straight-line distances divided by the length of the ordered path (for
+a closed loop, the tour minus its longest leg). Visiting a line end to end
+scores ~1; zig-zags and doubling back lower it, and a line with branches
+cannot reach 1 since a branch has to be travelled twice.
+"""
+
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from track_projection import TrackProjector
+
+# stations further than this from the end-to-end trunk route are branch stations
+# (on a loop line: stations on the far side)
+BRANCH_MIN_M = 200.0
+# the straight-line 2-opt ordering must beat the track-based one by this much
+SCORE_MARGIN = 0.01
+
+
+class StationOrdering(NamedTuple):
+    order: List[int]
+    method: str         # "chainage" | "loop" | "2opt" | "trivial"
+    closed: bool        # loop line: the last station connects back to the first
+    score: float
+    branches: int = 0
+
+
+# ---------------- distance matrix helpers ----------------
+def distance_matrix(xy) -> np.ndarray:
+    p = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    d = p[:, None, :] - p[None, :, :]
+    return np.sqrt(d[..., 0] * d[..., 0] + d[..., 1] * d[..., 1])
+
+
+def mst_length(D: np.ndarray) -> float:
+    """Total length of a minimum spanning tree of the complete graph D (Prim, O(n^2))."""
+    n = len(D)
+    if n < 2:
+        return 0.0
+    in_tree = np.zeros(n, dtype=bool)
+    in_tree[0] = True
+    best = D[0].copy()
+    total = 0.0
+    for _ in range(n - 1):
+        cand = np.where(in_tree, np.inf, best)
+        j = int(np.argmin(cand))
+        total += float(cand[j])
+        in_tree[j] = True
+        np.minimum(best, D[j], out=best)
+    return total
+
+
+def path_length(D: np.ndarray, order: Sequence[int], closed: bool = False) -> float:
+    o = np.asarray(order, dtype=np.int64)
+    if len(o) < 2:
+        return 0.0
+    total = float(D[o[:-1], o[1:]].sum())
+    if closed and len(o) > 2:
+        total += float(D[o[-1], o[0]])
+    return total
+
+
+def ordering_score(D: np.ndarray, order: Sequence[int], closed: bool = False) -> float:
+    """MST length / ordered path length, in (0, 1]; 1 for a perfect end-to-end visit."""
+    o = np.asarray(order, dtype=np.int64)
+    length = path_length(D, o)
+    if closed and len(o) > 2:
+        legs = np.append(D[o[:-1], o[1:]], D[o[-1], o[0]])
+        length = float(legs.sum() - legs.max())
+    if length <= 0:
+        return 1.0
+    return min(1.0, mst_length(D) / length)
+
+
+# ---------------- fallback: nearest neighbour + 2-opt ----------------
+def nearest_neighbour_path(D: np.ndarray, start: int) -> List[int]:
+    n = len(D)
+    used = np.zeros(n, dtype=bool)
+    used[start] = True
+    order = [start]
+    for _ in range(n - 1):
+        j = int(np.argmin(np.where(used, np.inf, D[order[-1]])))
+        used[j] = True
+        order.append(j)
+    return order
+
+
+def two_opt(D: np.ndarray, order: Sequence[int], closed: bool = False, max_rounds: int = 50) -> List[int]:
+    """
+    2-opt improvement of an open path (closed=False) or a tour: reverse
+    o[i..j] whenever that shortens it, until no move helps or max_rounds.
+    """
+    o = np.asarray(order, dtype=np.int64).copy()
+    n = len(o)
+    if n < 4:
+        return o.tolist()
+    for _ in range(max_rounds):
+        improved = False
+        for i in range(1 if closed else 0, n - 1):
+            j = np.arange(i + 1, n)
+            oj = o[j]
+            if closed:
+                nj = o[(j + 1) % n]
+                has_next = np.ones(len(j), dtype=bool)
+            else:
+                nj = o[np.minimum(j + 1, n - 1)]
+                has_next = j < n - 1
+            delta = np.where(has_next, D[o[i], nj] - D[oj, nj], 0.0)
+            if i > 0:
+                delta += D[o[i - 1], oj] - D[o[i - 1], o[i]]
+            k = int(np.argmin(delta))
+            if delta[k] < -1e-9:
+                o[i:j[k] + 1] = o[i:j[k] + 1][::-1].copy()
+                improved = True
+        if not improved:
+            break
+    return o.tolist()
+
+
+def order_by_2opt(D: np.ndarray, closed: bool = False) -> List[int]:
+    # start from a line end: the station farthest from the one farthest from station 0
+    start = int(np.argmax(D[int(np.argmax(D[0]))]))
+    return two_opt(D, nearest_neighbour_path(D, start), closed=closed)
+
+
+# ---------------- track chainage ----------------
+def order_by_chainage(router, branch_min_m: float = BRANCH_MIN_M) -> Optional[Tuple[List[int], int]]:
+    """(order, branch count) from the track graph, or None if the stations are not connected."""
+    d0 = router.lengths(0)
+    if not np.isfinite(d0).all():
+        return None
+    e1 = int(np.argmax(d0))
+    e2 = int(np.argmax(router.lengths(e1)))
+    trunk_leg = router.leg(e1, e2)
+    if trunk_leg.xy is None:
+        return None
+
+    # chainage / offset of every station on the e1 -> e2 trunk route
+    snaps = np.array([(s.x, s.y) for s in router.snaps])
+    proj = TrackProjector(trunk_leg.xy)
+    seg, t, near = proj.nearest(snaps)
+    chain = proj.cum[seg] + t * proj.seg_len[seg]
+    off = np.hypot(*(snaps - near).T)
+    trunk = np.flatnonzero(off <= branch_min_m)
+    order = trunk[np.argsort(chain[trunk], kind="stable")].tolist()
+    rest = np.flatnonzero(off > branch_min_m)
+    if rest.size == 0:
+        return order, 0
+
+    # branches: each branch station is anchored at the trunk station nearest to
+    # it along the track (projected chainage can fall on the wrong side of the
+    # junction on a curved trunk). Stations sharing an anchor are visited in
+    # line by track distance from it, spliced in next to the anchor on the side
+    # and in the direction that adds the least track distance.
+    dist = {b: router.lengths(b) for b in rest.tolist()}
+    groups = {}
+    for b in rest.tolist():
+        groups.setdefault(int(trunk[np.argmin(dist[b][trunk])]), []).append(b)
+    for a in [t for t in order if t in groups]:
+        g = sorted(groups[a], key=lambda b: (dist[b][a], b))
+        at = order.index(a)
+        best = None
+        for side in (1, 0):          # after / before the anchor
+            u = a if side else (order[at - 1] if at > 0 else None)
+            v = (order[at + 1] if at + 1 < len(order) else None) if side else a
+            for seq in (g, g[::-1]):
+                cost = 0.0
+                if u is not None:
+                    cost += dist[seq[0]][u]
+                if v is not None:
+                    cost += dist[seq[-1]][v]
+                if u is not None and v is not None:
+                    cost -= abs(chain[u] - chain[v])
+                if best is None or cost < best[0] - 1e-9:
+                    best = (cost, at + side, seq)
+        _, pos, seq = best
+        order[pos:pos] = seq
+    return order, len(groups)
+
+
+def order_on_ring(xy: np.ndarray, track_lines, branch_min_m: float = BRANCH_MIN_M) -> Optional[List[int]]:
+    """
+    Loop line: order by chainage along the longest closed line of the track,
+    if every station lies within branch_min_m of it. The cut is placed at the
+    largest chainage gap, so the order starts after the widest station spacing.
+    """
+    rings = [ln for ln in (track_lines or []) if ln.is_ring]
+    if not rings:
+        return None
+    ring = max(rings, key=lambda ln: ln.length)
+    proj = TrackProjector(np.asarray(ring.coords)[:, :2])
+    seg, t, near = proj.nearest(xy)
+    if np.hypot(*(xy - near).T).max() > branch_min_m:
+        return None
+    chain = proj.cum[seg] + t * proj.seg_len[seg]
+    order = np.argsort(chain, kind="stable")
+    gaps = np.diff(np.append(chain[order], chain[order[0]] + ring.length))
+    cut = int(np.argmax(gaps)) + 1
+    return np.roll(order, -cut).tolist()
+
+
+def order_stations(xy, router=None, track_lines=None, is_loop: bool = False,
+                   branch_min_m: float = BRANCH_MIN_M) -> StationOrdering:
+    """
+    Station visiting order for metric station points xy.
+
+    router:      track_graph.StationRouter over the same stations (same index
+                 order), used for linear lines (track chainage).
+    track_lines: metric LineStrings of the merged track, used for loop lines
+                 (chainage along the longest closed line).
+    The 2-opt ordering is always scored as well and replaces the track-based
+    one only if it scores more than SCORE_MARGIN better (e.g. a loop without a
+    closed track line).
+    """
+    p = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    D = distance_matrix(p)
+    n = len(D)
+    if n < 3:
+        return StationOrdering(list(range(n)), "trivial", False, 1.0)
+
+    candidates = []
+    if is_loop:
+        order = order_on_ring(p, track_lines, branch_min_m)
+        if order is not None:
+            candidates.append(StationOrdering(order, "loop", True, ordering_score(D, order, True)))
+    elif router is not None:
+        found = order_by_chainage(router, branch_min_m)
+        if found is not None:
+            order, branches = found
+            candidates.append(StationOrdering(order, "chainage", False, ordering_score(D, order), branches))
+    order = order_by_2opt(D, closed=is_loop)
+    fallback = StationOrdering(order, "2opt", is_loop, ordering_score(D, order, is_loop))
+    if candidates and candidates[0].score >= fallback.score - SCORE_MARGIN:
+        return candidates[0]
+    return fallback
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+track_chain.py — Chain OSM way geometries into continuous track polylines.
+
+Shared by fetch_line_v2.py (extract_track_coords) and fetch_oedo.py (chain_ways).
+
+Way endpoints go into a hash grid with cell size = tol, so the way that continues
+a chain is found by looking at the 3x3 cells around the chain end instead of
+scanning every remaining way: chaining is linear in the number of ways.
+
+  - ways may be reversed (matched by either endpoint, flipped when needed)
+  - chains grow at the tail and, optionally, at the head
+  - when nothing connects, a new chain is started instead of gluing the next way
+    on with a silent gap; chains are then ordered nearest-end-first (chain ends
+    in a second hash grid, searched ring by ring outward from the current track
+    end, so heavily fragmented relations do not rescan every chain), gaps up to
+    BRIDGE_MAX_M are bridged and longer ones split the track into separate
+    parts (a MultiLineString in the written GeoJSON); every gap is reported
+    with its length in metres, per part
+
+Way preference when several ways touch the same end is "first in `order`",
+checking tail-start, tail-end, head-end, head-start in that order — the same
+tie-break as the original list scan.
+
+Ways are lists of [lon, lat] or (n, 2) NumPy arrays (the compact form from
+overpass_stream.py); the track parts are returned in the same form.
+"""
+
+import math
+from collections import defaultdict, deque
+
+import numpy as np
+
+EARTH_R = 6371008.8
+# gaps between chains up to this length are bridged; longer ones split the track into parts
+BRIDGE_MAX_M = 100.0
+
+
+def pt_eq(a, b, tol=1e-6):
+    return abs(a[0] - b[0]) < tol and abs(a[1] - b[1]) < tol
+
+
+def gap_length_m(a, b):
+    """Approximate distance in metres between two lon/lat points (equirectangular)."""
+    lat = math.radians((a[1] + b[1]) / 2.0)
+    dx = math.radians(b[0] - a[0]) * math.cos(lat)
+    dy = math.radians(b[1] - a[1])
+    return EARTH_R * math.hypot(dx, dy)
+
+
+class ChainEndIndex:
+    """
+    Nearest unused chain end: chain endpoints projected to metres (equirectangular
+    around their mean latitude) in a hash grid of about one end per cell. A query
+    scans rings of cells outward until no closer end can exist; used chains are
+    removed from the grid.
+    """
+
+    def __init__(self, chains):
+        ends = np.array([[c[0][0], c[0][1], c[-1][0], c[-1][1]] for c in chains],
+                        dtype=np.float64).reshape(-1, 2)
+        self.kx = math.cos(math.radians(float(ends[:, 1].mean()))) if len(ends) else 1.0
+        xy = self.project(ends)
+        span = float(np.ptp(xy, axis=0).max()) if len(xy) else 0.0
+        self.cell_m = max(span / max(1.0, math.sqrt(len(xy))), 1.0)
+        self.xy = xy.tolist()
+        self.grid = defaultdict(list)
+        for e, (x, y) in enumerate(self.xy):
+            self.grid[self.cell(x, y)].append(e)     # end e: chain e // 2, 0=start | 1=end
+        cells = np.array(list(self.grid) or [(0, 0)], dtype=np.int64).reshape(-1, 2)
+        self.lo, self.hi = cells.min(axis=0).tolist(), cells.max(axis=0).tolist()
+
+    def project(self, lonlat):
+        p = np.radians(np.asarray(lonlat, dtype=np.float64).reshape(-1, 2)) * EARTH_R
+        p[:, 0] *= self.kx
+        return p
+
+    def cell(self, x, y):
+        return (math.floor(x / self.cell_m), math.floor(y / self.cell_m))
+
+    def remove(self, k):
+        for e in (2 * k, 2 * k + 1):
+            self.grid[self.cell(*self.xy[e])].remove(e)
+
+    def nearest(self, pt):
+        """[(distance_m, chain, 0=start | 1=end)] of the nearest unused end(s) to lon/lat pt."""
+        x, y = self.project(pt)[0].tolist()
+        cx, cy = self.cell(x, y)
+        r_max = int(max(cx - self.lo[0], self.hi[0] - cx, cy - self.lo[1], self.hi[1] - cy, 0))
+        best_d, found = math.inf, []
+        (lx, ly), (hx, hy) = self.lo, self.hi
+        for r in range(r_max + 1):
+            # ring r, clipped to the occupied cells' bounding box
+            for gx in range(max(cx - r, lx), min(cx + r, hx) + 1):
+                if gx in (cx - r, cx + r):
+                    gys = range(max(cy - r, ly), min(cy + r, hy) + 1)
+                else:
+                    gys = [gy for gy in {cy - r, cy + r} if ly <= gy <= hy]
+                for gy in gys:
+                    for e in self.grid.get((gx, gy), ()):
+                        ex, ey = self.xy[e]
+                        d = math.hypot(ex - x, ey - y)
+                        if d < best_d:
+                            best_d, found = d, [e]
+                        elif d == best_d:
+                            found.append(e)
+            # ends in ring r + 1 and beyond are at least r cells away
+            if best_d <= r * self.cell_m:
+                break
+        return [(best_d, e // 2, e % 2) for e in found]
+
+
+class EndpointIndex:
+    """Hash grid of way endpoints: cell -> [(way_index, 0=start | 1=end)]."""
+
+    def __init__(self, ways, tol):
+        self.tol = tol
+        self.grid = defaultdict(list)
+        for i, w in enumerate(ways):
+            self.grid[self.cell(w[0])].append((i, 0))
+            self.grid[self.cell(w[-1])].append((i, 1))
+
+    def cell(self, pt):
+        return (math.floor(pt[0] / self.tol), math.floor(pt[1] / self.tol))
+
+    def near(self, pt):
+        cx, cy = self.cell(pt)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                yield from self.grid.get((cx + dx, cy + dy), ())
+
+
+def chain_ways(ways, tol=1e-6, order=None, extend_head=True):
+    """
+    Chain way coordinate lists into continuous chains.
+    ways:  list of [[lon, lat], ...]
+    order: way indices in preference order (default: input order); each new chain
+           starts from the first unused way in this order.
+    Returns a list of chains, each a list of oriented way coordinate lists.
+    """
+    ways = [w for w in ways if len(w) >= 1]
+    if not ways:
+        return []
+    order = list(range(len(ways))) if order is None else list(order)
+    rank = [0] * len(ways)
+    for r, i in enumerate(order):
+        rank[i] = r
+
+    index = EndpointIndex(ways, tol)
+    used = bytearray(len(ways))
+
+    def best_match(pt, at_head):
+        best = None
+        for i, end in index.near(pt):
+            if used[i]:
+                continue
+            w = ways[i]
+            if not pt_eq(pt, w[0] if end == 0 else w[-1], tol):
+                continue
+            # tail: start-match (case 0) beats end-match (1); head: end (2) beats start (3)
+            case = (2 + (1 - end)) if at_head else end
+            key = (rank[i], case)
+            if best is None or key < best[0]:
+                best = (key, i, end)
+        return best
+
+    chains = []
+    next_seed = 0
+    while True:
+        while next_seed < len(order) and used[order[next_seed]]:
+            next_seed += 1
+        if next_seed >= len(order):
+            break
+        seed = order[next_seed]
+        used[seed] = 1
+        head_part = []          # ways prepended at the head, in reverse order
+        tail_part = [ways[seed][:]]
+        head, tail = ways[seed][0], ways[seed][-1]
+        while True:
+            t = best_match(tail, at_head=False)
+            h = best_match(head, at_head=True) if extend_head else None
+            if t is None and h is None:
+                break
+            if h is None or (t is not None and t[0] < h[0]):
+                _, i, end = t
+                w = ways[i][:] if end == 0 else ways[i][::-1]
+                tail_part.append(w)
+                tail = w[-1]
+            else:
+                _, i, end = h
+                w = ways[i][:] if end == 1 else ways[i][::-1]
+                head_part.append(w)
+                head = w[0]
+            used[i] = 1
+        chains.append(head_part[::-1] + tail_part)
+    return chains
+
+
+def _is_array(c):
+    return isinstance(c, np.ndarray)
+
+
+def chain_coords(chain):
+    """Flatten one chain, skipping the duplicated junction point between ways."""
+    if chain and _is_array(chain[0]):
+        return np.concatenate([chain[0]] + [w[1:] for w in chain[1:]])
+    coords = []
+    for i, w in enumerate(chain):
+        coords.extend(w[1:] if i > 0 else w)
+    return coords
+
+
+def link_chains(chains, bridge_max_m=BRIDGE_MAX_M):
+    """
+    Order and orient flattened chains nearest-end-first, starting from chains[0],
+    then split that sequence into parts wherever the gap between neighbouring
+    chains is longer than bridge_max_m. Chains inside a part are joined with a
+    straight bridge; parts are returned separately so a real hole in the track
+    is never drawn as a straight segment.
+    Returns (parts, part_gaps, split_gaps): the coordinates of every part,
+    the bridged gap lengths (m) inside each part and the gaps between parts.
+    """
+    if not chains:
+        return [], [], []
+    pieces = deque([chains[0]])
+    links = deque()         # gap between pieces[i] and pieces[i + 1]
+    head, tail = chains[0][0], chains[0][-1]
+    rest = [c for c in chains[1:] if len(c)]
+    index = ChainEndIndex(rest)
+    # nearest ends per side (False: tail, True: head), kept until that side moves.
+    # When they are used by the other side, their distance stays as a lower bound
+    # and the side is only searched again once that bound could win, so a side
+    # with no close neighbours left is not searched on every step.
+    near = {False: None, True: None}
+    bound = {False: 0.0, True: 0.0}
+    for _ in range(len(rest)):
+        for side in sorted((False, True), key=lambda s: -1.0 if near[s] is not None else bound[s]):
+            if near[side] is None:
+                known = [near[s][0][0] for s in (False, True) if near[s]]
+                if not known or bound[side] <= min(known):
+                    near[side] = index.nearest(head if side else tail)
+        # (distance, chain index, flip, prepend); the tail takes a chain's start
+        # as is, the head takes a chain's end as is
+        _, k, flip, prepend = min((d, j, end == (0 if side else 1), side)
+                                  for side in (False, True) if near[side]
+                                  for d, j, end in near[side])
+        index.remove(k)
+        near[prepend], bound[prepend] = None, 0.0
+        other = near[not prepend]
+        if other is not None:
+            left = [n for n in other if n[1] != k]
+            if not left:
+                bound[not prepend] = other[0][0]
+            near[not prepend] = left or None
+        c = rest[k][::-1] if flip else rest[k]
+        if prepend:
+            d = gap_length_m(c[-1], head)
+            pieces.appendleft(c)
+            links.appendleft(d)
+            head = c[0]
+        else:
+            d = gap_length_m(tail, c[0])
+            pieces.append(c)
+            links.append(d)
+            tail = c[-1]
+
+    groups = [[pieces[0]]]
+    part_gaps = [[]]
+    split_gaps = []
+    for c, d in zip(list(pieces)[1:], links):
+        if d > bridge_max_m:
+            groups.append([c])
+            part_gaps.append([])
+            split_gaps.append(d)
+        else:
+            groups[-1].append(c)
+            part_gaps[-1].append(d)
+    if _is_array(chains[0]):
+        parts = [np.concatenate(g) for g in groups]
+    else:
+        parts = [[p for piece in g for p in piece] for g in groups]
+    return parts, part_gaps, split_gaps
+
+
+def chain_report(chains, parts, part_gaps, split_gaps):
+    """Summary dict for logs / result json (gap lengths listed per output part)."""
+    return {
+        "chains": len(chains),
+        "chain_points": [len(chain_coords(c)) for c in chains],
+        "parts": len(parts),
+        "part_points": [len(p) for p in parts],
+        "gaps": sum(len(g) for g in part_gaps),
+        "gap_lengths_m": [[round(g, 1) for g in gaps] for gaps in part_gaps],
+        "split_gaps_m": [round(g, 1) for g in split_gaps],
+    }
+
+
+def chain_track(ways, tol=1e-6, order=None, extend_head=True, bridge_max_m=BRIDGE_MAX_M):
+    """
+    Chain ways into track parts: chains closer than bridge_max_m are joined into
+    one polyline, longer gaps start a new part.
+    Returns (parts, report), parts being a list of coordinate lists / arrays.
+    """
+    chains = chain_ways(ways, tol=tol, order=order, extend_head=extend_head)
+    parts, part_gaps, split_gaps = link_chains([chain_coords(c) for c in chains], bridge_max_m)
+    return parts, chain_report(chains, parts, part_gaps, split_gaps)
+
+
+def parts_geometry(parts):
+    """GeoJSON geometry of one direction's track parts: LineString, or MultiLineString if split."""
+    parts = [p.tolist() if _is_array(p) else p for p in parts if len(p)]
+    if len(parts) == 1:
+        return {"type": "LineString", "coordinates": parts[0]}
+    return {"type": "MultiLineString", "coordinates": parts}
+
+
+def geometry_parts(geom):
+    """Track parts back from a parts_geometry() geometry (for reuse of written files)."""
+    if geom["type"] == "LineString":
+        return [geom["coordinates"]]
+    return list(geom["coordinates"])
+
+
+def flatten_parts(parts):
+    """All parts in order as one coordinate list (for chainage along the track)."""
+    return [p for part in parts for p in (part.tolist() if _is_array(part) else part)]
@@ -0,0 +1,588 @@
+#!/usr/bin/env python3
+"""
+track_graph.py — Compact CSR track graph for the station-path mainline builders
+(build_guno_mainline_by_stationpath_v4*.py).
+
+Vertices of the metric track lines are quantized to a node grid exactly like the
+networkx version (cell = round(coord / grid)); instead of a Graph keyed by
+(int, int) tuples with per-edge coordinate dicts, the graph is stored as
+
+  cells    (n, 2) int64    grid cell of each node (node ids are int32 0..n-1,
+                           numbered in order of first appearance)
+  xy       (n, 2) float64  node coordinates (cell * grid)
+  indptr   (n + 1,) int64  CSR row pointers
+  indices  (2m,) int32     neighbour node ids
+  weights  (2m,) float32   edge lengths in metres (shortest of duplicate edges)
+
+Neighbours are listed in the order their edge first appeared, the same order
+networkx iterates adjacency in, so Dijkstra breaks ties the same way.
+shortest_path() runs A* by default with a heuristic that is admissible by
+construction (see heuristic_scale), or plain Dijkstra.
+
+Stations are snapped through STRtree indexes built once per graph and queried
+for all stations in one call: nearest_nodes() (k nearest vertices) and
+snap_to_edges() (nearest point on an edge). An edge snap splits its edge, so
+legs start and end at the projected station instead of the nearest vertex
+(shortest_path_between, station_legs). station_legs snaps onto the largest
+connected component only, so a stray fragment of a few vertices next to a
+station cannot cut the route.
+
+Station-to-station routes go through a StationRouter: one PathTree (resumable
+Dijkstra) per station, grown only until the station asked for is settled and
+kept for later queries, so trying another station order or asking a leg in
+reverse reuses the search done so far. Every Leg carries its path length and
+the straight-line distance between its end points for QA.
+"""
+
+import heapq
+import math
+import os
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import shapely
+from shapely.geometry import LineString
+
+
+def line_segments(lines: Iterable[LineString]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """All consecutive vertex pairs of the lines: (a (k, 2), b (k, 2), length (k,))."""
+    a_parts, b_parts = [], []
+    for ln in lines:
+        c = np.asarray(ln.coords, dtype=np.float64)[:, :2]
+        if len(c) >= 2:
+            a_parts.append(c[:-1])
+            b_parts.append(c[1:])
+    if not a_parts:
+        empty = np.zeros((0, 2))
+        return empty, empty, np.zeros(0)
+    a = np.concatenate(a_parts)
+    b = np.concatenate(b_parts)
+    d = b - a
+    # same expression as GEOS LineString.length for a 2-point line
+    return a, b, np.sqrt(d[:, 0] * d[:, 0] + d[:, 1] * d[:, 1])
+
+
+class EdgeSnap(NamedTuple):
+    """A point snapped onto edge u-v (u < v) at fraction t from u; w is the edge weight."""
+    u: int
+    v: int
+    t: float
+    w: float
+    x: float
+    y: float
+    dist: float
+
+
+class Leg(NamedTuple):
+    """Route between stations i -> j; xy is None (length inf) when unreachable."""
+    i: int
+    j: int
+    xy: Optional[np.ndarray]
+    length: float
+    straight: float
+
+    @property
+    def detour(self) -> float:
+        """Path length / straight-line distance (nan for coincident end points)."""
+        return self.length / self.straight if self.straight > 0 else math.nan
+
+
+class TrackGraph:
+    """Undirected weighted graph over quantized track vertices, in CSR form."""
+
+    ARRAYS = ("cells", "xy", "indptr", "indices", "weights")
+
+    def __init__(self, cells: np.ndarray, indptr: np.ndarray, indices: np.ndarray,
+                 weights: np.ndarray, grid_m: float, xy: Optional[np.ndarray] = None):
+        self.grid_m = float(grid_m)
+        self.cells = cells
+        self.xy = cells.astype(np.float64) * self.grid_m if xy is None else xy
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self._lists = None
+        self._cell_ids = None
+        self._h_scale = None
+        self._node_tree = None
+        self._edge_index = {}
+        self._labels = None
+
+    @classmethod
+    def from_lines(cls, lines: Iterable[LineString], grid_m: float) -> "TrackGraph":
+        a, b, w = line_segments(lines)
+        ca = np.rint(a / grid_m).astype(np.int64)
+        cb = np.rint(b / grid_m).astype(np.int64)
+        keep = np.any(ca != cb, axis=1)
+        ca, cb, w = ca[keep], cb[keep], w[keep]
+        k = len(w)
+
+        # node ids in first-appearance order of the endpoint sequence a0, b0, a1, b1, ...
+        ends = np.empty((2 * k, 2), dtype=np.int64)
+        ends[0::2] = ca
+        ends[1::2] = cb
+        if k == 0:
+            return cls(np.zeros((0, 2), dtype=np.int64), np.zeros(1, dtype=np.int64),
+                       np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32), grid_m)
+        uniq, first, inv = np.unique(ends, axis=0, return_index=True, return_inverse=True)
+        inv = inv.reshape(-1)
+        order = np.argsort(first, kind="stable")
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        cells = uniq[order]
+        ids = rank[inv]
+        u, v = ids[0::2], ids[1::2]
+
+        # undirected edges: first occurrence position + shortest length
+        lo, hi = np.minimum(u, v), np.maximum(u, v)
+        n = len(cells)
+        key = lo * n + hi
+        ukey, efirst, einv = np.unique(key, return_index=True, return_inverse=True)
+        ew = np.full(len(ukey), np.inf)
+        np.minimum.at(ew, einv.reshape(-1), w)
+        eu, ev = u[efirst], v[efirst]
+
+        # directed arcs sorted by (source, edge first appearance)
+        src = np.concatenate([eu, ev])
+        dst = np.concatenate([ev, eu])
+        pos = np.concatenate([efirst, efirst])
+        aw = np.concatenate([ew, ew])
+        o = np.lexsort((pos, src))
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+        return cls(cells, indptr, dst[o].astype(np.int32), aw[o].astype(np.float32), grid_m)
+
+    def save(self, dirpath: str) -> None:
+        """Write the arrays as <name>.npy files into dirpath (see load)."""
+        for name in self.ARRAYS:
+            np.save(os.path.join(dirpath, f"{name}.npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls, dirpath: str, grid_m: float, mmap: bool = True) -> "TrackGraph":
+        """
+        Graph saved by save(). With mmap the arrays are read-only memory maps,
+        so processes loading the same graph share its pages instead of each
+        holding a copy.
+        """
+        a = {name: np.load(os.path.join(dirpath, f"{name}.npy"), mmap_mode="r" if mmap else None)
+             for name in cls.ARRAYS}
+        return cls(a["cells"], a["indptr"], a["indices"], a["weights"], grid_m, xy=a["xy"])
+
+    # ---------- basic queries ----------
+    @property
+    def n_nodes(self) -> int:
+        return len(self.cells)
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.indices) // 2
+
+    def __contains__(self, cell) -> bool:
+        return self.node_id(cell) is not None
+
+    def node_id(self, cell) -> Optional[int]:
+        """Node id of a grid cell (cx, cy), or None."""
+        if self._cell_ids is None:
+            self._cell_ids = {(int(x), int(y)): i for i, (x, y) in enumerate(self.cells.tolist())}
+        return self._cell_ids.get((int(cell[0]), int(cell[1])))
+
+    def neighbors(self, i: int) -> Tuple[np.ndarray, np.ndarray]:
+        s, e = self.indptr[i], self.indptr[i + 1]
+        return self.indices[s:e], self.weights[s:e]
+
+    def path_xy(self, path: List[int]) -> np.ndarray:
+        return self.xy[np.asarray(path, dtype=np.int64)]
+
+    # ---------- search ----------
+    def _adjacency(self):
+        # plain Python lists for the heap loop (one-off conversion; indexing
+        # NumPy scalars per relaxation would dominate the search)
+        if self._lists is None:
+            self._lists = (self.indptr.tolist(), self.indices.tolist(), self.weights.astype(np.float64).tolist(),
+                           self.xy[:, 0].tolist(), self.xy[:, 1].tolist())
+        return self._lists
+
+    def heuristic_scale(self) -> float:
+        """
+        r = min over edges of weight / node-to-node distance (<= 1). Every path
+        then weighs at least r * straight-line distance between its end nodes, so
+        h = r * |xy - xy_target| is admissible and consistent even though edge
+        weights are measured between the original (unquantized) vertices.
+        """
+        if self._h_scale is None:
+            if len(self.indices) == 0:
+                self._h_scale = 0.0
+            else:
+                src = np.repeat(np.arange(self.n_nodes), np.diff(self.indptr))
+                d = np.hypot(*(self.xy[self.indices] - self.xy[src]).T)
+                ok = d > 0
+                self._h_scale = float(min(1.0, np.min(self.weights[ok] / d[ok]))) if ok.any() else 0.0
+                # float32 weights: stay strictly below so rounding never overestimates
+                self._h_scale *= 1.0 - 1e-6
+        return self._h_scale
+
+    def shortest_path(self, source: int, target: int, astar: bool = True) -> Optional[List[int]]:
+        """Node ids of the shortest source -> target path, or None if unreachable."""
+        if source == target:
+            return [source]
+        xs, ys = self._adjacency()[3:]
+        found = self._search([(source, 0.0)], {target: 0.0}, xs[target], ys[target], astar)
+        return None if found is None else found[0]
+
+    def shortest_path_between(self, a: EdgeSnap, b: EdgeSnap,
+                              astar: bool = True) -> Optional[Tuple[List[int], float]]:
+        """
+        Shortest route between two edge snaps: (inner node ids, length), or None.
+        The route leaves a's edge through either end and enters b's edge through
+        either end; an empty node list means straight along a shared edge.
+        """
+        direct = abs(a.t - b.t) * a.w if (a.u, a.v) == (b.u, b.v) else math.inf
+        sources = [(a.u, a.t * a.w), (a.v, (1.0 - a.t) * a.w)]
+        targets = {b.u: b.t * b.w, b.v: (1.0 - b.t) * b.w}
+        return self._search(sources, targets, b.x, b.y, astar, direct)
+
+    def _search(self, sources, targets: Dict[int, float], tx: float, ty: float,
+                astar: bool, direct: float = math.inf) -> Optional[Tuple[List[int], float]]:
+        """
+        Multi-source A* / Dijkstra. sources: [(node, start cost)], targets:
+        {node: remaining cost to the goal point (tx, ty)}. Reaching a target
+        queues the goal at its full cost; direct, if finite, is a route that
+        touches no node. The heuristic r * |xy - goal| stays admissible: every
+        target remainder is a fraction of an edge, hence >= r * its distance.
+        """
+        indptr, indices, weights, xs, ys = self._adjacency()
+        r = self.heuristic_scale() if astar else 0.0
+        push, pop, sqrt = heapq.heappush, heapq.heappop, math.sqrt
+
+        dist: Dict[int, float] = {}
+        seen: Dict[int, float] = {}
+        pred: Dict[int, int] = {}
+        heap = []
+        count = 0
+        for s, c in sources:
+            if s not in seen or c < seen[s]:
+                seen[s] = c
+                pred[s] = -1
+                dx, dy = xs[s] - tx, ys[s] - ty
+                push(heap, (c + r * sqrt(dx * dx + dy * dy), count, c, s))
+                count += 1
+        if direct < math.inf:
+            push(heap, (direct, count, direct, None))
+            count += 1
+        while heap:
+            _, _, d, v = pop(heap)
+            if v is None:
+                return [], d
+            if v < 0:
+                return self._trace(pred, ~v), d
+            if v in dist:
+                continue
+            dist[v] = d
+            rest = targets.get(v)
+            if rest is not None:
+                if rest == 0.0:
+                    return self._trace(pred, v), d
+                push(heap, (d + rest, count, d + rest, ~v))
+                count += 1
+            for k in range(indptr[v], indptr[v + 1]):
+                u = indices[k]
+                if u in dist:
+                    continue
+                du = d + weights[k]
+                if u not in seen or du < seen[u]:
+                    seen[u] = du
+                    pred[u] = v
+                    dx, dy = xs[u] - tx, ys[u] - ty
+                    push(heap, (du + r * sqrt(dx * dx + dy * dy), count, du, u))
+                    count += 1
+        return None
+
+    @staticmethod
+    def _trace(pred: Dict[int, int], v: int) -> List[int]:
+        path = [v]
+        while pred[path[-1]] != -1:
+            path.append(pred[path[-1]])
+        return path[::-1]
+
+    # ---------- station snapping ----------
+    def _nodes(self) -> shapely.STRtree:
+        if self._node_tree is None:
+            self._node_tree = shapely.STRtree(shapely.points(self.xy))
+        return self._node_tree
+
+    def _edges(self, main_only: bool = False):
+        # each undirected edge once (u < v), as 2-point segments in an STRtree
+        if main_only not in self._edge_index:
+            src = np.repeat(np.arange(self.n_nodes), np.diff(self.indptr))
+            m = src < self.indices
+            if main_only:
+                m &= self.components()[src] == 0
+            eu, ev = src[m], self.indices[m].astype(np.int64)
+            segs = shapely.linestrings(np.stack([self.xy[eu], self.xy[ev]], axis=1))
+            self._edge_index[main_only] = (eu, ev, self.weights[m].astype(np.float64), shapely.STRtree(segs))
+        return self._edge_index[main_only]
+
+    def components(self) -> np.ndarray:
+        """Connected component label of every node; 0 is the largest component."""
+        if self._labels is None:
+            indptr, indices = self._adjacency()[:2]
+            labels = [-1] * self.n_nodes
+            sizes = []
+            for s in range(self.n_nodes):
+                if labels[s] >= 0:
+                    continue
+                c = len(sizes)
+                labels[s] = c
+                stack = [s]
+                size = 0
+                while stack:
+                    v = stack.pop()
+                    size += 1
+                    for u in indices[indptr[v]:indptr[v + 1]]:
+                        if labels[u] < 0:
+                            labels[u] = c
+                            stack.append(u)
+                sizes.append(size)
+            # relabel by size, largest first (ties: first found)
+            order = np.argsort(-np.asarray(sizes, dtype=np.int64), kind="stable")
+            rank = np.empty(len(order), dtype=np.int32)
+            rank[order] = np.arange(len(order))
+            self._labels = rank[np.asarray(labels, dtype=np.int64)] if labels else np.zeros(0, dtype=np.int32)
+        return self._labels
+
+    def nearest_nodes(self, points, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        k nearest nodes of every point, batched: (ids (n, k), distances (n, k)),
+        nearest first. Rows are padded with -1 / inf when the graph has fewer
+        than k nodes.
+        """
+        if self.n_nodes == 0:
+            raise ValueError("empty track graph")
+        p = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        geoms = shapely.points(p)
+        tree = self._nodes()
+        want = min(k, self.n_nodes)
+        # radius that holds `want` nodes: start at the nearest node, double until enough
+        (src, hit), d1 = tree.query_nearest(geoms, return_distance=True, all_matches=False)
+        radius = np.empty(len(p))
+        radius[src] = d1 * (1.0 + 1e-9) + 1e-9
+        if want > 1:
+            radius = np.maximum(radius * 2.0, self.grid_m)
+        while True:
+            qi, ni = tree.query(geoms, predicate="dwithin", distance=radius)
+            cnt = np.bincount(qi, minlength=len(p))
+            short = cnt < want
+            if not short.any():
+                break
+            radius = np.where(short, radius * 2.0, radius)
+
+        d = np.hypot(*(self.xy[ni] - p[qi]).T)
+        o = np.lexsort((ni, d, qi))
+        qi, ni, d = qi[o], ni[o], d[o]
+        rank = np.arange(len(qi)) - np.repeat(np.cumsum(cnt) - cnt, cnt)
+        keep = rank < want
+        ids = np.full((len(p), k), -1, dtype=np.int64)
+        dist = np.full((len(p), k), np.inf)
+        ids[qi[keep], rank[keep]] = ni[keep]
+        dist[qi[keep], rank[keep]] = d[keep]
+        return ids, dist
+
+    def snap_to_edges(self, points, main_only: bool = False) -> List[EdgeSnap]:
+        """
+        Nearest point on any edge for every point, batched (one STRtree query).
+        main_only: consider edges of the largest connected component only.
+        """
+        if self.n_edges == 0:
+            raise ValueError("empty track graph")
+        p = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        eu, ev, ew, tree = self._edges(main_only)
+        (src, hit), _ = tree.query_nearest(shapely.points(p), return_distance=True, all_matches=False)
+        e = np.empty(len(p), dtype=np.int64)
+        e[src] = hit
+        a, b = self.xy[eu[e]], self.xy[ev[e]]
+        d = b - a
+        len2 = d[:, 0] * d[:, 0] + d[:, 1] * d[:, 1]
+        t = np.clip(np.einsum("ij,ij->i", p - a, d) / len2, 0.0, 1.0)
+        q = a + t[:, None] * d
+        off = np.hypot(*(p - q).T)
+        return [EdgeSnap(int(eu[i]), int(ev[i]), float(ti), float(ew[i]), float(x), float(y), float(o))
+                for i, ti, (x, y), o in zip(e, t, q, off)]
+
+    def snapped_path_xy(self, a: EdgeSnap, path: List[int], b: EdgeSnap) -> np.ndarray:
+        """Coordinates of a snap-to-snap route (repeated points dropped)."""
+        xy = np.concatenate([[(a.x, a.y)], self.path_xy(path).reshape(-1, 2), [(b.x, b.y)]])
+        keep = np.ones(len(xy), dtype=bool)
+        keep[1:] = np.any(xy[1:] != xy[:-1], axis=1)
+        return xy[keep]
+
+    def node_snaps(self, points) -> List[EdgeSnap]:
+        """Nearest vertex of every point, as zero-length snaps (u == v, t = 0)."""
+        p = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        ids, dist = self.nearest_nodes(p)
+        return [EdgeSnap(n, n, 0.0, 0.0, float(self.xy[n, 0]), float(self.xy[n, 1]), float(d))
+                for n, d in zip(ids[:, 0].tolist(), dist[:, 0].tolist())]
+
+    def station_router(self, points: Sequence, snap: str = "edge") -> "StationRouter":
+        """
+        StationRouter over the snapped stations.
+        snap="edge": stations are projected onto the largest connected component
+        of the track; snap="node": they are moved to their nearest vertices.
+        """
+        if snap == "edge":
+            snaps = self.snap_to_edges(points, main_only=True)
+        elif snap == "node":
+            snaps = self.node_snaps(points)
+        else:
+            raise ValueError(f"unknown snap mode: {snap}")
+        return StationRouter(self, snaps)
+
+    def station_legs(self, points: Sequence, snap: str = "edge") -> List[Leg]:
+        """Legs between consecutive stations (see station_router)."""
+        return self.station_router(points, snap).legs()
+
+
+class PathTree:
+    """
+    Shortest-path tree from one snapped station, built by a Dijkstra search
+    that can be resumed: route() settles nodes only until the requested station
+    is reached, and the next query continues from there.
+    """
+
+    def __init__(self, graph: TrackGraph, src: EdgeSnap):
+        self.graph = graph
+        self.src = src
+        self.dist: Dict[int, float] = {}
+        self.seen: Dict[int, float] = {}
+        self.pred: Dict[int, int] = {}
+        self.heap = []
+        self.count = 0
+        for s, c in ((src.u, src.t * src.w), (src.v, (1.0 - src.t) * src.w)):
+            if s not in self.seen or c < self.seen[s]:
+                self.seen[s] = c
+                self.pred[s] = -1
+                heapq.heappush(self.heap, (c, self.count, s))
+                self.count += 1
+
+    @property
+    def settled(self) -> int:
+        return len(self.dist)
+
+    def _grow(self, ends: List[Tuple[int, float]], best: float) -> None:
+        # settle nodes until every unreached end of the target edge is provably
+        # no better than `best` (an unsettled node costs at least the heap minimum)
+        indptr, indices, weights = self.graph._adjacency()[:3]
+        dist, seen, pred, heap = self.dist, self.seen, self.pred, self.heap
+        push, pop = heapq.heappush, heapq.heappop
+        open_ends = {}
+        for n, rest in ends:
+            if n in dist:
+                best = min(best, dist[n] + rest)
+            else:
+                open_ends[n] = min(rest, open_ends.get(n, math.inf))
+        min_rest = min(open_ends.values(), default=math.inf)
+        count = self.count
+        while heap and heap[0][0] + min_rest < best:
+            d, _, v = pop(heap)
+            if v in dist:
+                continue
+            dist[v] = d
+            if v in open_ends:
+                best = min(best, d + open_ends.pop(v))
+                min_rest = min(open_ends.values(), default=math.inf)
+            for k in range(indptr[v], indptr[v + 1]):
+                u = indices[k]
+                if u in dist:
+                    continue
+                du = d + weights[k]
+                if u not in seen or du < seen[u]:
+                    seen[u] = du
+                    pred[u] = v
+                    push(heap, (du, count, u))
+                    count += 1
+        self.count = count
+
+    def _best(self, b: EdgeSnap) -> Tuple[float, Optional[int]]:
+        # (length, node the route enters b's edge through; None = along the shared edge)
+        a = self.src
+        direct = abs(a.t - b.t) * a.w if (a.u, a.v) == (b.u, b.v) else math.inf
+        ends = [(b.u, b.t * b.w), (b.v, (1.0 - b.t) * b.w)]
+        self._grow(ends, direct)
+        best, end = direct, None
+        for n, rest in ends:
+            d = self.dist.get(n)
+            if d is not None and d + rest < best:
+                best, end = d + rest, n
+        return best, end
+
+    def length(self, b: EdgeSnap) -> float:
+        """Route length from the source station to snap b (inf if unreachable)."""
+        return self._best(b)[0]
+
+    def route(self, b: EdgeSnap) -> Optional[Tuple[List[int], float]]:
+        """(inner node ids, length) from the source station to snap b, or None."""
+        best, end = self._best(b)
+        if best == math.inf:
+            return None
+        if end is None:
+            return [], best
+        return TrackGraph._trace(self.pred, end), best
+
+
+class StationRouter:
+    """
+    Routes between snapped stations with one cached PathTree per source station.
+    Legs are cached too, and a leg already known in the other direction is
+    returned reversed instead of searched again.
+    """
+
+    def __init__(self, graph: TrackGraph, snaps: Sequence[EdgeSnap]):
+        self.graph = graph
+        self.snaps = list(snaps)
+        self._trees: Dict[int, PathTree] = {}
+        self._legs: Dict[Tuple[int, int], Leg] = {}
+
+    def __len__(self) -> int:
+        return len(self.snaps)
+
+    def tree(self, i: int) -> PathTree:
+        if i not in self._trees:
+            self._trees[i] = PathTree(self.graph, self.snaps[i])
+        return self._trees[i]
+
+    @property
+    def settled(self) -> int:
+        """Nodes settled over all trees so far (search effort)."""
+        return sum(t.settled for t in self._trees.values())
+
+    def leg(self, i: int, j: int) -> Leg:
+        key = (i, j)
+        if key in self._legs:
+            return self._legs[key]
+        back = self._legs.get((j, i))
+        if back is not None:
+            xy = None if back.xy is None else back.xy[::-1]
+            leg = Leg(i, j, xy, back.length, back.straight)
+        else:
+            a, b = self.snaps[i], self.snaps[j]
+            found = self.tree(i).route(b)
+            xy = None if found is None else self.graph.snapped_path_xy(a, found[0], b)
+            if xy is not None and len(xy) < 2:
+                xy = None
+            length = math.inf if found is None else found[1]
+            leg = Leg(i, j, xy, length, math.hypot(b.x - a.x, b.y - a.y))
+        self._legs[key] = leg
+        return leg
+
+    def lengths(self, i: int) -> np.ndarray:
+        """Track distances from station i to every station (inf where unreachable)."""
+        t = self.tree(i)
+        return np.array([t.length(b) for b in self.snaps])
+
+    def legs(self, order: Optional[Sequence[int]] = None, closed: bool = False) -> List[Leg]:
+        """
+        Legs between consecutive stations of `order` (default: input order);
+        closed adds the leg from the last station back to the first (loop lines).
+        """
+        order = list(range(len(self.snaps))) if order is None else list(order)
+        if closed and len(order) > 2:
+            order = order + order[:1]
+        return [self.leg(i, j) for i, j in zip(order[:-1], order[1:])]
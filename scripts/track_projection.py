@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+track_projection.py — Batched projection of stations onto a track polyline (NumPy).
+
+Shared by fetch_line_v2.py (sort_stations_along_track), fetch_oedo.py
+(project_onto_track) and geodo_geom.py (sample_midline, via TrackProjector.nearest).
+
+Segment vectors, squared lengths and cumulative chainage are computed once per
+track; all stations are then projected onto all segments in one broadcast
+operation (chunked over stations to bound memory). The projection is done in
+lon/lat space exactly like the original per-station loop, so chainage and the
+chosen segment are unchanged; the perpendicular offset is additionally returned
+in metres (local equirectangular scale) so far-off-track stops can be flagged.
+"""
+
+import numpy as np
+
+EARTH_R = 6371008.8
+DEG_M = np.pi / 180.0 * EARTH_R
+
+# stations x segments cells processed per chunk (~16 MB per float64 work array)
+CHUNK_CELLS = 2_000_000
+
+
+class TrackProjector:
+    """Precomputed segment geometry of a track for repeated batched projections."""
+
+    def __init__(self, track_coords):
+        t = np.asarray(track_coords, dtype=np.float64)[:, :2]
+        self.a = t[:-1]
+        self.d = t[1:] - t[:-1]
+        self.len2 = np.einsum("ij,ij->i", self.d, self.d)
+        seg_len = np.sqrt(self.len2)
+        self.seg_len = seg_len
+        self.cum = np.concatenate(([0.0], np.cumsum(seg_len)[:-1]))
+
+    def nearest(self, points):
+        """
+        Batched point-to-polyline projection (planar, in track units).
+        Returns (seg_index, t, closest_xy) for (n, 2) points: the first nearest
+        segment, the clamped parameter along it and the closest point.
+        """
+        p = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        n = len(p)
+        seg = np.zeros(n, dtype=np.int64)
+        tt = np.zeros(n)
+        m = len(self.a)
+        if m == 0 or n == 0:
+            return seg, tt, p[:, :2].copy()
+
+        safe_len2 = np.where(self.len2 == 0, 1.0, self.len2)
+        step = max(1, CHUNK_CELLS // m)
+        for s0 in range(0, n, step):
+            q = p[s0:s0 + step]
+            # (k, m) parameter of the closest point on every segment
+            rx = q[:, 0:1] - self.a[:, 0]
+            ry = q[:, 1:2] - self.a[:, 1]
+            t = (rx * self.d[:, 0] + ry * self.d[:, 1]) / safe_len2
+            t = np.where(self.len2 == 0, 0.0, np.clip(t, 0.0, 1.0))
+            # closest point first, then the difference (same rounding as the scalar loop)
+            ex = q[:, 0:1] - (self.a[:, 0] + t * self.d[:, 0])
+            ey = q[:, 1:2] - (self.a[:, 1] + t * self.d[:, 1])
+            best = np.argmin(ex * ex + ey * ey, axis=1)  # first minimum, like the scalar loop
+            seg[s0:s0 + step] = best
+            tt[s0:s0 + step] = t[np.arange(len(q)), best]
+        closest = self.a[seg] + tt[:, None] * self.d[seg]
+        return seg, tt, closest
+
+    def project(self, points):
+        """
+        Project (n, 2) lon/lat points.
+        Returns (chainage, offset_m, seg_index): chainage in track units (degrees) from
+        the track start, offset_m the perpendicular distance in metres.
+        """
+        p = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if len(self.a) == 0 or len(p) == 0:
+            return np.zeros(len(p)), np.zeros(len(p)), np.zeros(len(p), dtype=np.int64)
+        seg, t, closest = self.nearest(p)
+        chain = self.cum[seg] + t * self.seg_len[seg]
+        # metres: scale lon by cos(lat) at the station
+        e = p - closest
+        offset = DEG_M * np.hypot(e[:, 0] * np.cos(np.radians(p[:, 1])), e[:, 1])
+        return chain, offset, seg
+
+
+def project_points(points, track_coords):
+    """One-shot TrackProjector(track_coords).project(points)."""
+    return TrackProjector(track_coords).project(points)